@@ -9,7 +9,9 @@ from __future__ import print_function
 
 from collections import OrderedDict
 import sys
+import threading
 
+import control
 import fdt_util
 import re
 import tools
@@ -47,8 +49,9 @@ class Section(object):
     def __init__(self, name, node, test=False):
         global entry
         global Entry
+        global Region
         import entry
-        from entry import Entry
+        from entry import Entry, Region
 
         self._name = name
         self._node = node
@@ -192,9 +195,18 @@ class Section(object):
         return True. We stop calling an entry's function once it returns
         True. This allows the contents of one entry to depend on another.
 
+        Entries which do not depend on other entries are dealt with first,
+        using a number of threads, since they may run tools or read large
+        files. The others are then processed in order.
+
         After 3 rounds we give up since it's likely an error.
         """
-        todo = self._entries.values()
+        entries = self._entries.values()
+        independent = [entry for entry in entries
+                       if not entry.DependsOnOthers()]
+        not_done = self._ObtainContents(independent)
+        todo = [entry for entry in entries
+                if entry in not_done or entry.DependsOnOthers()]
         for passnum in range(3):
             next_todo = []
             for entry in todo:
@@ -208,6 +220,51 @@ class Section(object):
                         'contents: remaining %s' % todo)
         return True
 
+    def _ObtainContents(self, entries):
+        """Call ObtainContents() once for each of a list of entries
+
+        The entries are shared out between a number of threads, as set by
+        control.SetThreads(). If an entry raises an exception, no more
+        entries are started and the exception is raised again once the
+        threads have finished.
+
+        Args:
+            entries: List of Entry objects to process
+
+        Returns:
+            Set of entries whose ObtainContents() returned False
+        """
+        threads = min(control.GetThreads(), len(entries))
+        if threads <= 1:
+            return set(entry for entry in entries if not entry.ObtainContents())
+
+        not_done = set()
+        errors = []
+        lock = threading.Lock()
+        todo = iter(entries)
+
+        def _Worker():
+            while not errors:
+                with lock:
+                    entry = next(todo, None)
+                if entry is None:
+                    return
+                try:
+                    if not entry.ObtainContents():
+                        with lock:
+                            not_done.add(entry)
+                except Exception as e:
+                    errors.append(e)
+
+        workers = [threading.Thread(target=_Worker) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if errors:
+            raise errors[0]
+        return not_done
+
     def _SetEntryOffsetSize(self, name, offset, size):
         """Set the offset and size of an entry
 
@@ -289,18 +346,57 @@ class Section(object):
     def BuildSection(self, fd, base_offset):
         """Write the section to a file"""
         fd.seek(base_offset)
-        fd.write(self.GetData())
+        fd.write(self._BuildData())
 
     def GetData(self):
         """Get the contents of the section"""
-        section_data = chr(self._pad_byte) * self._size
+        return bytes(self._BuildData())
+
+    def WriteData(self, buf, offset):
+        """Write the contents of the section into a buffer
+
+        The section's padding is written first, then each entry is written
+        in place, so that the section is assembled without making a copy of
+        it for each entry. Subsections write into the same buffer.
+
+        Args:
+            buf: bytearray to write into, which must be large enough to hold
+                the section at the given offset
+            offset: Offset in buf at which the section starts
+        """
+        buf[offset:offset + self._size] = chr(self._pad_byte) * self._size
+        for entry in self._entries.values():
+            base = self._pad_before + entry.offset - self._skip_at_start
+            entry.WriteData(buf, offset + base)
+
+    def GetRegions(self, offset):
+        """Get the regions of the image which are written by this section
+
+        This matches what WriteData() writes: the section's padding, followed
+        by the regions for each entry.
+
+        Args:
+            offset: Offset in the image at which the section starts
 
+        Returns:
+            List of Region objects
+        """
+        regions = [Region(self.GetPath(), offset, self._size,
+                          'pad %#x' % self._pad_byte, None)]
         for entry in self._entries.values():
-            data = entry.GetData()
             base = self._pad_before + entry.offset - self._skip_at_start
-            section_data = (section_data[:base] + data +
-                            section_data[base + len(data):])
-        return section_data
+            regions += entry.GetRegions(offset + base)
+        return regions
+
+    def _BuildData(self):
+        """Assemble the contents of the section
+
+        Returns:
+            bytearray containing the section
+        """
+        buf = bytearray(self._size)
+        self.WriteData(buf, 0)
+        return buf
 
     def LookupSymbol(self, sym_name, optional, msg):
         """Look up a symbol in an ELF file
@@ -0,0 +1,177 @@
+# SPDX-License-Identifier: GPL-2.0+
+# Copyright (c) 2019 Google, Inc
+#
+# Cache of the output of external tools run by entries
+#
+# Some entries (e.g. gbb and vblock) run external tools to create their
+# contents. The output only changes when the tool, its arguments or its input
+# files change, so it can be kept in a cache directory and re-used by later
+# runs of binman, rather than running the tools again.
+#
+# Each item is stored in a file named after a SHA256 hash of everything that
+# affects the output.
+#
+
+import distutils.spawn
+import hashlib
+import os
+import tempfile
+
+import tools
+import tout
+
+# Directory to use for the cache, or None to disable it
+cache_dir = None
+
+# Hashes of the external tools, keyed by tool name
+tool_hashes = {}
+
+
+def SetCacheDir(dirname):
+    """Set the directory to use to cache tool output
+
+    Args:
+        dirname: Directory to use (it is created if needed), or None to
+            disable the cache
+    """
+    global cache_dir
+
+    cache_dir = dirname
+    if dirname:
+        _MakeDir(dirname)
+
+def _MakeDir(dirname):
+    """Create a directory if it does not already exist
+
+    Another binman run or thread may create the directory at the same time,
+    so this is not an error.
+
+    Args:
+        dirname: Directory to create, including any missing parents
+    """
+    if not os.path.exists(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname):
+                raise
+
+def _GetToolHash(name):
+    """Get a hash of an external tool, so that a new version is noticed
+
+    Args:
+        name: Name of the tool (e.g. 'futility')
+
+    Returns:
+        Hash of the tool's contents as a hex string, or the name of the tool
+        if it cannot be found on the path
+    """
+    if name not in tool_hashes:
+        pathname = distutils.spawn.find_executable(name)
+        if pathname:
+            tool_hashes[name] = hashlib.sha256(
+                tools.ReadFile(pathname)).hexdigest()
+        else:
+            tool_hashes[name] = name
+    return tool_hashes[name]
+
+def GetKey(name, cmds, fnames):
+    """Work out the cache key for the output of some tool commands
+
+    Filenames in the output directory are recorded without the directory,
+    since it changes from one run of binman to the next.
+
+    Args:
+        name: Name of the tool which is run (e.g. 'futility')
+        cmds: List of commands, each a list of arguments to the tool
+        fnames: List of input files used by the commands, each a full path
+            (e.g. from tools.GetInputFilename()). Files which do not exist
+            are included by name only
+
+    Returns:
+        Key as a hex string
+    """
+    hash = hashlib.sha256()
+    hash.update(_GetToolHash(name) + '\0')
+    for args in cmds:
+        for arg in args:
+            if tools.outdir:
+                arg = arg.replace(tools.outdir, '')
+            hash.update(arg + '\0')
+        hash.update('\0')
+    for fname in fnames:
+        if os.path.exists(fname):
+            hash.update(hashlib.sha256(tools.ReadFile(fname)).digest())
+        else:
+            hash.update(fname + '\0')
+    return hash.hexdigest()
+
+def _GetCacheFilename(key):
+    """Get the filename used to cache an item
+
+    Args:
+        key: Key of the item, as returned by GetKey()
+
+    Returns:
+        Path to the file
+    """
+    return os.path.join(cache_dir, key[:2], key[2:])
+
+def Lookup(key):
+    """Look up an item in the cache
+
+    Args:
+        key: Key of the item, as returned by GetKey()
+
+    Returns:
+        Contents of the item, or None if the cache is disabled or the item is
+        not present
+    """
+    if not cache_dir:
+        return None
+    fname = _GetCacheFilename(key)
+    if not os.path.exists(fname):
+        return None
+    tout.Info("Using cached tool output '%s'" % key)
+    return tools.ReadFile(fname)
+
+def Store(key, data):
+    """Store an item in the cache, if it is enabled
+
+    Args:
+        key: Key of the item, as returned by GetKey()
+        data: Contents of the item
+    """
+    if not cache_dir:
+        return
+    fname = _GetCacheFilename(key)
+    dirname = os.path.dirname(fname)
+    _MakeDir(dirname)
+
+    # Write to a temporary file first, so that a binman run in parallel never
+    # sees a partial file
+    fd, tmpname = tempfile.mkstemp(dir=dirname)
+    with os.fdopen(fd, 'wb') as outf:
+        outf.write(data)
+    os.rename(tmpname, fname)
+
+def RunCached(name, cmds, fnames, output_fname):
+    """Run some tool commands, or use their output from the cache
+
+    Args:
+        name: Name of the tool to run (e.g. 'futility')
+        cmds: List of commands to run, each a list of arguments to the tool
+        fnames: List of input files used by the commands, each a full path
+        output_fname: Output file written by the commands
+
+    Returns:
+        Contents of the output file
+    """
+    key = GetKey(name, cmds, fnames)
+    data = Lookup(key)
+    if data is None:
+        for args in cmds:
+            tools.Run(name, *args)
+        data = tools.ReadFile(output_fname)
+        Store(key, data)
+    return data
@@ -24,14 +24,23 @@ def ParseArgs(argv):
             help='Board name to build')
     parser.add_option('-B', '--build-dir', type='string', default='b',
             help='Directory containing the build output')
+    parser.add_option('-c', '--cache-dir', type='string',
+            help='Directory to use to cache the output of external tools, so '
+                 'it can be re-used by later runs')
     parser.add_option('-d', '--dt', type='string',
             help='Configuration file (.dtb) to use')
     parser.add_option('-D', '--debug', action='store_true',
             help='Enabling debugging (provides a full traceback on error)')
     parser.add_option('-E', '--entry-docs', action='store_true',
             help='Write out entry documentation (see README.entries)')
+    parser.add_option('-i', '--incremental', action='store_true',
+            default=False, help='Only write the entries which have changed '
+                                'since the image was last built')
     parser.add_option('-I', '--indir', action='append',
             help='Add a path to a directory to use for input files')
+    parser.add_option('-j', '--jobs', type='int',
+            help='Number of threads to use to obtain entry contents (default '
+                 'is one per CPU, 1 to obtain them one at a time)')
     parser.add_option('-H', '--full-help', action='store_true',
         default=False, help='Display the README file')
     parser.add_option('-m', '--map', action='store_true',
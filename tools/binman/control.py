@@ -6,11 +6,13 @@
 #
 
 from collections import OrderedDict
+import multiprocessing
 import os
 import re
 import sys
 import tools
 
+import cache
 import command
 import elf
 from image import Image
@@ -27,6 +29,10 @@ fdt_files = {}
 # Arguments passed to binman to provide arguments to entries
 entry_args = {}
 
+# Number of threads to use when obtaining the contents of entries, or None to
+# use one for each CPU
+num_threads = None
+
 
 def _ReadImageDesc(binman_node):
     """Read the image descriptions from the /binman node
@@ -92,6 +98,27 @@ def SetEntryArgs(args):
 def GetEntryArg(name):
     return entry_args.get(name)
 
+def SetThreads(threads):
+    """Set the number of threads to use when obtaining entry contents
+
+    Args:
+        threads: Number of threads (1 to obtain contents serially), or None
+            to use one for each CPU
+    """
+    global num_threads
+
+    num_threads = threads
+
+def GetThreads():
+    """Get the number of threads to use when obtaining entry contents
+
+    Returns:
+        Number of threads to use
+    """
+    if num_threads is None:
+        return multiprocessing.cpu_count()
+    return num_threads
+
 def WriteEntryDocs(modules, test_missing=None):
     from entry import Entry
     Entry.WriteDocs(modules, test_missing)
@@ -142,6 +169,8 @@ def Binman(options, args):
             tools.SetInputDirs(options.indir)
             tools.PrepareOutputDir(options.outdir, options.preserve)
             SetEntryArgs(options.entry_arg)
+            SetThreads(options.jobs)
+            cache.SetCacheDir(options.cache_dir)
 
             # Get the device tree ready by compiling it and copying the compiled
             # output into a file in our output directly. Then scan it for use
@@ -192,7 +221,7 @@ def Binman(options, args):
                     image.SetCalculatedProperties()
                 image.ProcessEntryContents()
                 image.WriteSymbols()
-                image.BuildImage()
+                image.BuildImage(options.incremental)
                 if options.map:
                     image.WriteMap()
             with open(fname, 'wb') as outfd:
@@ -6,7 +6,7 @@
 #
 
 from collections import namedtuple, OrderedDict
-import command
+import mmap
 import os
 import re
 import struct
@@ -18,45 +18,158 @@ debug = False
 
 Symbol = namedtuple('Symbol', ['section', 'address', 'size', 'weak'])
 
+# Symbols read from each ELF file, keyed by filename. Each value is a tuple:
+#    (mtime, size, dict of Symbol, keyed by symbol name)
+# so that the file is only parsed again if it changes
+symbol_cache = {}
+
+# ELF constants used when reading the symbol table
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2MSB = 2
+SHT_SYMTAB = 2
+STB_WEAK = 2
+STT_SECTION = 3
+
+# Names used for symbols which are not in a normal section, as used by objdump
+SPECIAL_SECTIONS = {
+    0: '*UND*',         # SHN_UNDEF
+    0xfff1: '*ABS*',    # SHN_ABS
+    0xfff2: '*COM*',    # SHN_COMMON
+}
+
+# struct formats for the file header (the part from e_shoff onwards), section
+# header and symbol, for ELF32 and ELF64. Also given is the offset of e_shoff
+# and the position in the symbol of (st_name, st_value, st_size, st_info,
+# st_shndx), since the order differs.
+ElfFormat = namedtuple('ElfFormat', ['shoff_pos', 'ehdr', 'shdr', 'sym',
+                                     'sym_order'])
+ELF_FORMATS = {
+    ELFCLASS32: ElfFormat(0x20, 'IIHHHHHH', 'IIIIIIIIII', 'IIIBBH',
+                          (0, 1, 2, 3, 5)),
+    ELFCLASS64: ElfFormat(0x28, 'QIHHHHHH', 'IIQQQQIIQQ', 'IBBHQQ',
+                          (0, 4, 5, 1, 3)),
+}
+
+
+def _GetString(data, offset):
+    """Read a nul-terminated string
+
+    Args:
+        data: Data to read from (string or mmap)
+        offset: Offset of the start of the string
+
+    Returns:
+        String, without the terminator
+    """
+    return data[offset:data.find('\0', offset)]
+
+def _ReadSymbols(data):
+    """Read the symbol table from the contents of an ELF file
+
+    This deals with 32- and 64-bit files of either byte order. Symbols
+    without a name are ignored, except that section symbols are given the
+    name of their section, as objdump does.
+
+    Args:
+        data: Contents of the ELF file (string or mmap)
+
+    Returns:
+        Dict of Symbol, keyed by symbol name. This is empty if the file is not
+        an ELF file or has no symbol table
+
+    Raises:
+        struct.error or IndexError if the file is not a valid ELF file
+    """
+    syms = {}
+    if data[:4] != '\x7fELF' or ord(data[4]) not in ELF_FORMATS:
+        return syms
+    fmt = ELF_FORMATS[ord(data[4])]
+    endian = '>' if ord(data[5]) == ELFDATA2MSB else '<'
+    (shoff, _, _, _, _, shentsize, shnum, shstrndx) = struct.unpack_from(
+        endian + fmt.ehdr, data, fmt.shoff_pos)
+
+    # Each section header is (name, type, flags, addr, offset, size, link,
+    # info, addralign, entsize)
+    shdrs = [struct.unpack_from(endian + fmt.shdr, data, shoff + i * shentsize)
+             for i in range(shnum)]
+    shstr_offset = shdrs[shstrndx][4] if shnum else 0
+    names = [_GetString(data, shstr_offset + shdr[0]) for shdr in shdrs]
+
+    sym_fmt = endian + fmt.sym
+    sym_size = struct.calcsize(sym_fmt)
+    for shdr in [shdr for shdr in shdrs if shdr[1] == SHT_SYMTAB]:
+        str_offset = shdrs[shdr[6]][4]
+
+        # Skip the first symbol, which is always empty
+        for offset in range(shdr[4] + sym_size, shdr[4] + shdr[5], sym_size):
+            sym = struct.unpack_from(sym_fmt, data, offset)
+            st_name, value, size, info, shndx = [sym[i] for i in fmt.sym_order]
+            section = SPECIAL_SECTIONS.get(shndx)
+            if section is None:
+                section = names[shndx] if shndx < shnum else '*ABS*'
+            name = _GetString(data, str_offset + st_name) if st_name else ''
+            if not name and info & 0xf == STT_SECTION:
+                name = section
+            if name:
+                syms[name] = Symbol(section, value, size, info >> 4 == STB_WEAK)
+    return syms
+
+def _GetAllSymbols(fname):
+    """Get all the symbols from an ELF file, using the cache if possible
+
+    The file is mapped into memory rather than read, since only the headers
+    and symbol table are needed.
+
+    Args:
+        fname: Filename of the ELF file to read
+
+    Returns:
+        Dict of Symbol, keyed by symbol name. This is empty if the file does
+        not exist or is not an ELF file
+    """
+    try:
+        stat = os.stat(fname)
+    except OSError:
+        return {}
+    cached = symbol_cache.get(fname)
+    if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+    syms = {}
+    if stat.st_size:
+        with open(fname, 'rb') as fd:
+            data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                syms = _ReadSymbols(data)
+            except (struct.error, IndexError):
+                # A corrupt file, so ignore its symbols
+                syms = {}
+            finally:
+                data.close()
+    symbol_cache[fname] = (stat.st_mtime, stat.st_size, syms)
+    return syms
 
 def GetSymbols(fname, patterns):
     """Get the symbols from an ELF file
 
+    The symbol table is read directly from the file and kept in memory, so
+    later calls for the same file do not read it again.
+
     Args:
         fname: Filename of the ELF file to read
-        patterns: List of regex patterns to search for, each a string
+        patterns: List of regex patterns to search for in the symbol names,
+            each a string
 
     Returns:
-        None, if the file does not exist, or Dict:
+        OrderedDict, sorted by address (empty if the file does not exist):
           key: Name of symbol
-          value: Hex value of symbol
+          value: Symbol object
     """
-    stdout = command.Output('objdump', '-t', fname, raise_on_error=False)
-    lines = stdout.splitlines()
+    syms = _GetAllSymbols(fname)
     if patterns:
         re_syms = re.compile('|'.join(patterns))
-    else:
-        re_syms = None
-    syms = {}
-    syms_started = False
-    for line in lines:
-        if not line or not syms_started:
-            if 'SYMBOL TABLE' in line:
-                syms_started = True
-            line = None  # Otherwise code coverage complains about 'continue'
-            continue
-        if re_syms and not re_syms.search(line):
-            continue
-
-        space_pos = line.find(' ')
-        value, rest = line[:space_pos], line[space_pos + 1:]
-        flags = rest[:7]
-        parts = rest[7:].split()
-        section, size =  parts[:2]
-        if len(parts) > 2:
-            name = parts[2]
-            syms[name] = Symbol(section, int(value, 16), int(size,16),
-                                flags[1] == 'w')
+        syms = dict((name, sym) for name, sym in syms.iteritems()
+                    if re_syms.search(name))
 
     # Sort dict by address
     return OrderedDict(sorted(syms.iteritems(), key=lambda x: x[1].address))
@@ -5,7 +5,9 @@
 # Test for the elf module
 
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 
 import elf
@@ -130,6 +132,36 @@ class TestElf(unittest.TestCase):
         elf.debug = False
         self.assertTrue(len(stdout.getvalue()) > 0)
 
+    def testNotElf(self):
+        """Test that files which are not valid ELF files have no symbols"""
+        self.assertEqual({}, elf.GetSymbols('missing-file', []))
+        self.assertEqual({}, elf.GetSymbols(os.path.join(binman_dir, 'test',
+                                                         'Makefile'), []))
+        tmpdir = tempfile.mkdtemp(prefix='elf.')
+        try:
+            fname = os.path.join(tmpdir, 'elf')
+            for data in ['', '\x7fELF', '\x7fELF\x01' + '\xff' * 60]:
+                with open(fname, 'wb') as fd:
+                    fd.write(data)
+                elf.symbol_cache.clear()
+                self.assertEqual({}, elf.GetSymbols(fname, []))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testSymbolCache(self):
+        """Test that the symbols from a file are only read once"""
+        fname = os.path.join(binman_dir, 'test', 'u_boot_binman_syms')
+        elf.symbol_cache.clear()
+        syms = elf.GetSymbols(fname, [])
+        self.assertIn(fname, elf.symbol_cache)
+        cached = elf.symbol_cache[fname][2]
+        self.assertIs(cached, elf._GetAllSymbols(fname))
+        self.assertEqual(syms, elf.GetSymbols(fname, []))
+        self.assertEqual(['_binman_u_boot_spl_prop_offset'],
+                         elf.GetSymbols(fname, ['spl_prop_offset']).keys())
+        sym = syms['__image_copy_start']
+        self.assertEqual(False, sym.weak)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -19,6 +19,7 @@ except:
 
 import fdt_util
 import control
+import hashlib
 import os
 import sys
 import tools
@@ -32,6 +33,16 @@ our_path = os.path.dirname(os.path.realpath(__file__))
 # device-tree properties.
 EntryArg = namedtuple('EntryArg', ['name', 'datatype'])
 
+# A region of an image written by an entry or section, used to work out which
+# parts of an image have changed since it was last built:
+#    path: Path of the entry's node
+#    offset: Offset of the region in the image
+#    size: Size of the region in bytes
+#    digest: SHA256 hash of the data (as a hex string), or for a section, a
+#        string describing the padding written over the whole section
+#    data: Data written to the region, or None for a section
+Region = namedtuple('Region', ['path', 'offset', 'size', 'digest', 'data'])
+
 
 class Entry(object):
     """An Entry in the section
@@ -211,6 +222,17 @@ class Entry(object):
                        (len(data), self.contents_size))
         self.SetContents(data)
 
+    def DependsOnOthers(self):
+        """Check whether this entry's contents depend on other entries
+
+        Entries which do not depend on others can obtain their contents at
+        the same time as each other, in separate threads.
+
+        Returns:
+            True if ObtainContents() uses other entries, False if not
+        """
+        return False
+
     def ObtainContents(self):
         """Figure out the contents of an entry.
 
@@ -315,6 +337,31 @@ class Entry(object):
     def GetData(self):
         return self.data
 
+    def WriteData(self, buf, offset):
+        """Write the contents of the entry into a buffer
+
+        Args:
+            buf: bytearray holding the section being built
+            offset: Offset in buf at which the entry starts
+        """
+        data = self.GetData()
+        buf[offset:offset + len(data)] = data
+
+    def GetRegions(self, offset):
+        """Get the regions of the image which are written by this entry
+
+        This matches what WriteData() writes.
+
+        Args:
+            offset: Offset in the image at which the entry starts
+
+        Returns:
+            List of Region objects
+        """
+        data = self.GetData()
+        return [Region(self.GetPath(), offset, len(data),
+                       hashlib.sha256(data).hexdigest(), data)]
+
     def GetOffsets(self):
         return {}
 
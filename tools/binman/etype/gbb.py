@@ -8,6 +8,7 @@
 
 from collections import OrderedDict
 
+import cache
 import command
 from entry import Entry, EntryArg
 
@@ -80,17 +81,19 @@ class Entry_gbb(Entry):
         sizes = [0x100, 0x1000, bmpfv_size, 0x1000]
         sizes = ['%#x' % size for size in sizes]
         keydir = tools.GetInputFilename(self.keydir)
+        rootkey = '%s/root_key.vbpubk' % keydir
+        recoverykey = '%s/recovery_key.vbpubk' % keydir
+        bmpfv = tools.GetInputFilename(self.bmpblk)
         gbb_set_command = [
             'gbb_utility', '-s',
             '--hwid=%s' % self.hardware_id,
-            '--rootkey=%s/root_key.vbpubk' % keydir,
-            '--recoverykey=%s/recovery_key.vbpubk' % keydir,
+            '--rootkey=%s' % rootkey,
+            '--recoverykey=%s' % recoverykey,
             '--flags=%d' % self.gbb_flags,
-            '--bmpfv=%s' % tools.GetInputFilename(self.bmpblk),
+            '--bmpfv=%s' % bmpfv,
             fname]
 
-        tools.Run('futility', 'gbb_utility', '-c', ','.join(sizes), fname)
-        tools.Run('futility', *gbb_set_command)
-
-        self.SetContents(tools.ReadFile(fname))
+        cmds = [['gbb_utility', '-c', ','.join(sizes), fname], gbb_set_command]
+        self.SetContents(cache.RunCached('futility', cmds,
+                                         [rootkey, recoverykey, bmpfv], fname))
         return True
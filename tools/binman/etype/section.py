@@ -41,12 +41,22 @@ class Entry_section(Entry):
         Entry.AddMissingProperties(self)
         self._section.AddMissingProperties()
 
+    def DependsOnOthers(self):
+        # The entries in this section obtain their contents in threads
+        return True
+
     def ObtainContents(self):
         return self._section.GetEntryContents()
 
     def GetData(self):
         return self._section.GetData()
 
+    def WriteData(self, buf, offset):
+        self._section.WriteData(buf, offset)
+
+    def GetRegions(self, offset):
+        return self._section.GetRegions(offset)
+
     def GetOffsets(self):
         """Handle entries that want to set the offset/size of other entries
 
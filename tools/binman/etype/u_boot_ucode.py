@@ -60,6 +60,9 @@ class Entry_u_boot_ucode(Entry_blob):
     def __init__(self, section, etype, node):
         Entry_blob.__init__(self, section, etype, node)
 
+    def DependsOnOthers(self):
+        return True
+
     def ObtainContents(self):
         # If the section does not need microcode, there is nothing to do
         ucode_dest_entry = self.section.FindEntryType('u-boot-with-ucode-ptr')
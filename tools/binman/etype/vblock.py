@@ -9,6 +9,7 @@
 from collections import OrderedDict
 import os
 
+import cache
 from entry import Entry, EntryArg
 
 import fdt_util
@@ -43,6 +44,9 @@ class Entry_vblock(Entry):
             EntryArg('kernelkey', str),
             EntryArg('preamble-flags', int)])
 
+    def DependsOnOthers(self):
+        return True
+
     def ObtainContents(self):
         # Join up the data files to be signed
         input_data = ''
@@ -56,7 +60,7 @@ class Entry_vblock(Entry):
         output_fname = tools.GetOutputFilename('vblock.%s' % self.name)
         input_fname = tools.GetOutputFilename('input.%s' % self.name)
         tools.WriteFile(input_fname, input_data)
-        prefix = self.keydir + '/'
+        prefix = tools.GetInputFilename(self.keydir) + '/'
         args = [
             'vbutil_firmware',
             '--vblock', output_fname,
@@ -68,7 +72,8 @@ class Entry_vblock(Entry):
             '--flags', '%d' % self.preamble_flags,
         ]
         #out.Notice("Sign '%s' into %s" % (', '.join(self.value), self.label))
-        stdout = tools.Run('futility', *args)
-        #out.Debug(stdout)
-        self.SetContents(tools.ReadFile(output_fname))
+        fnames = [input_fname, prefix + self.keyblock,
+                  prefix + self.signprivate, prefix + self.kernelkey]
+        self.SetContents(cache.RunCached('futility', [args], fnames,
+                                         output_fname))
         return True
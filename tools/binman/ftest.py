@@ -15,6 +15,7 @@ import tempfile
 import unittest
 
 import binman
+import cache
 import cmdline
 import command
 import control
@@ -170,7 +171,7 @@ class TestFunctional(unittest.TestCase):
         return control.Binman(options, args)
 
     def _DoTestFile(self, fname, debug=False, map=False, update_dtb=False,
-                    entry_args=None):
+                    entry_args=None, threads=None, cache_dir=None):
         """Run binman with a given test file
 
         Args:
@@ -179,6 +180,13 @@ class TestFunctional(unittest.TestCase):
             map: True to output map files for the images
             update_dtb: Update the offset and size of each entry in the device
                 tree before packing it into the image
+            entry_args: Dict of entry args to supply to binman
+                key: arg name
+                value: value of that arg
+            threads: Number of threads to use to obtain entry contents, or
+                None for the default
+            cache_dir: Directory to use to cache tool output, or None for
+                no cache
         """
         args = ['-p', '-I', self._indir, '-d', self.TestFile(fname)]
         if debug:
@@ -190,6 +198,10 @@ class TestFunctional(unittest.TestCase):
         if entry_args:
             for arg, value in entry_args.iteritems():
                 args.append('-a%s=%s' % (arg, value))
+        if threads is not None:
+            args.append('-j%d' % threads)
+        if cache_dir:
+            args += ['-c', cache_dir]
         return self._DoBinman(*args)
 
     def _SetupDtb(self, fname, outfile='u-boot.dtb'):
@@ -1380,6 +1392,107 @@ class TestFunctional(unittest.TestCase):
         self.assertIn("Node '/binman/u-boot': Please use 'offset' instead of "
                       "'pos'", str(e.exception))
 
+    def testThreads(self):
+        """Test that entry contents are the same with and without threads"""
+        for threads in (1, 4):
+            self.assertEqual(0, self._DoTestFile('24_sorted.dts',
+                                                 threads=threads))
+            self.assertEqual(threads, control.GetThreads())
+            data = tools.ReadFile(tools.GetOutputFilename('image.bin'))
+            self.assertEqual(chr(0) * 1 + U_BOOT_SPL_DATA + chr(0) * 2 +
+                             U_BOOT_DATA, data)
+
+    def testThreadsError(self):
+        """Test that an error in a thread obtaining contents is reported"""
+        with self.assertRaises(ValueError) as e:
+            self._DoTestFile('82_blob_missing.dts', threads=4)
+        self.assertIn("Filename 'missing-file' not found in input path",
+                      str(e.exception))
+
+    def testToolCache(self):
+        """Test that the output of external tools is cached"""
+        calls = []
+        def _HandleCommand(pipe_list):
+            calls.append(pipe_list)
+            return self._HandleVblockCommand(pipe_list)
+
+        command.test_result = _HandleCommand
+        entry_args = {
+            'keydir': 'devkeys',
+        }
+        cache_dir = tempfile.mkdtemp()
+        key_fname = TestFunctional._MakeInputFile('devkeys/firmware.keyblock',
+                                                  'key')
+        try:
+            for upto in range(2):
+                self.assertEqual(0, self._DoTestFile('74_vblock.dts',
+                        entry_args=entry_args, cache_dir=cache_dir))
+                data = tools.ReadFile(tools.GetOutputFilename('image.bin'))
+                self.assertEqual(U_BOOT_DATA + VBLOCK_DATA + U_BOOT_DTB_DATA,
+                                 data)
+            self.assertEqual(1, len(calls))
+
+            # Changing the data to be signed should run the tool again
+            TestFunctional._MakeInputFile('u-boot.bin', U_BOOT_DATA * 2)
+            self.assertEqual(0, self._DoTestFile('74_vblock.dts',
+                    entry_args=entry_args, cache_dir=cache_dir))
+            self.assertEqual(2, len(calls))
+
+            # So should changing the contents of a key
+            TestFunctional._MakeInputFile('devkeys/firmware.keyblock', 'new')
+            self.assertEqual(0, self._DoTestFile('74_vblock.dts',
+                    entry_args=entry_args, cache_dir=cache_dir))
+            self.assertEqual(3, len(calls))
+        finally:
+            TestFunctional._MakeInputFile('u-boot.bin', U_BOOT_DATA)
+            os.remove(key_fname)
+            shutil.rmtree(cache_dir)
+
+        # A tool which is on the path is identified by its contents
+        self.assertNotEqual('sh', cache._GetToolHash('sh'))
+        self.assertEqual('no-such-tool', cache._GetToolHash('no-such-tool'))
+
+    def testIncremental(self):
+        """Test that an incremental build only writes entries which change"""
+        outdir = tempfile.mkdtemp()
+        fname = os.path.join(outdir, 'image.bin')
+        manifest_fname = os.path.join(outdir, 'image.manifest')
+        args = ['-p', '-I', self._indir, '-d', self.TestFile('24_sorted.dts'),
+                '-O', outdir, '-i']
+
+        def _Build(u_boot_data, updated):
+            self.assertEqual(0, self._DoBinman(*args))
+            self.assertEqual(updated, control.images['image'].updated_entries)
+            self.assertEqual(chr(0) * 1 + U_BOOT_SPL_DATA + chr(0) * 2 +
+                             u_boot_data, tools.ReadFile(fname))
+
+        try:
+            # The first build writes everything, the next writes nothing
+            _Build(U_BOOT_DATA, None)
+            _Build(U_BOOT_DATA, [])
+
+            # Changing the contents of an entry writes just that entry
+            TestFunctional._MakeInputFile('u-boot.bin', '5678')
+            _Build('5678', ['/binman/u-boot'])
+
+            # Changing its size changes the layout, so everything is written
+            TestFunctional._MakeInputFile('u-boot.bin', '56789')
+            _Build('56789', None)
+
+            # So does changing the image file, the manifest or the padding
+            os.utime(fname, (0, 0))
+            _Build('56789', None)
+            tools.WriteFile(manifest_fname, 'invalid')
+            _Build('56789', None)
+            manifest = tools.ReadFile(manifest_fname)
+            tools.WriteFile(manifest_fname, manifest.replace('pad 0x0',
+                                                             'pad 0xff'))
+            _Build('56789', None)
+            _Build('56789', [])
+        finally:
+            TestFunctional._MakeInputFile('u-boot.bin', U_BOOT_DATA)
+            shutil.rmtree(outdir, ignore_errors=True)
+
 
 if __name__ == "__main__":
     unittest.main()
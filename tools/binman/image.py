@@ -8,7 +8,9 @@
 from __future__ import print_function
 
 from collections import OrderedDict
+import json
 from operator import attrgetter
+import os
 import re
 import sys
 
@@ -30,6 +32,9 @@ class Image:
         _size: Image size in bytes, or None if not known yet
         _filename: Output filename for image
         _sections: Sections present in this image (may be one or more)
+        updated_entries: After an incremental build, a list of the paths of
+            the entries which were written to the existing image file, or
+            None if the whole image was written
 
     Args:
         test: True if this is being called from a test of Images. This this case
@@ -41,6 +46,7 @@ class Image:
         self._name = name
         self._size = None
         self._filename = '%s.bin' % self._name
+        self.updated_entries = None
         if test:
             self._section = bsection.Section('main-section', self._node, True)
         else:
@@ -110,11 +116,81 @@ class Image:
         """Write symbol values into binary files for access at run time"""
         self._section.WriteSymbols()
 
-    def BuildImage(self):
-        """Write the image to a file"""
+    def BuildImage(self, incremental=False):
+        """Write the image to a file
+
+        Args:
+            incremental: True to write only the entries which have changed
+                since the image was last built, if the layout of the image is
+                the same. A manifest is written next to the image to allow
+                this
+        """
         fname = tools.GetOutputFilename(self._filename)
-        with open(fname, 'wb') as fd:
-            self._section.BuildSection(fd, 0)
+        self.updated_entries = None
+        if not incremental:
+            with open(fname, 'wb') as fd:
+                self._section.BuildSection(fd, 0)
+            return
+
+        manifest_fname = tools.GetOutputFilename('%s.manifest' % self._name)
+        regions = self._section.GetRegions(0)
+        changed = self._GetChangedRegions(fname, manifest_fname, regions)
+        if changed is None:
+            with open(fname, 'wb') as fd:
+                self._section.BuildSection(fd, 0)
+        else:
+            with open(fname, 'r+b') as fd:
+                for region in changed:
+                    fd.seek(region.offset)
+                    fd.write(region.data)
+            self.updated_entries = [region.path for region in changed]
+        stat = os.stat(fname)
+        manifest = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'regions': [region[:4] for region in regions],
+        }
+        with open(manifest_fname, 'w') as fd:
+            json.dump(manifest, fd)
+
+    def _GetChangedRegions(self, fname, manifest_fname, regions):
+        """Work out which regions of an image need to be written
+
+        Args:
+            fname: Filename of the image
+            manifest_fname: Filename of the manifest written when the image
+                was last built
+            regions: List of Region objects for the new image
+
+        Returns:
+            List of Region objects which need to be written to the existing
+            image, or None if the whole image must be written, since the
+            image or its manifest is missing, the image has been changed
+            since the manifest was written, or the layout has changed
+        """
+        if not os.path.exists(fname) or not os.path.exists(manifest_fname):
+            return None
+        try:
+            with open(manifest_fname) as fd:
+                manifest = json.load(fd)
+        except ValueError:
+            return None
+        stat = os.stat(fname)
+        if (stat.st_size, stat.st_mtime) != (manifest['size'],
+                                             manifest['mtime']):
+            return None
+        old_regions = manifest['regions']
+        if ([old[:3] for old in old_regions] !=
+                [[region.path, region.offset, region.size]
+                 for region in regions]):
+            return None
+        changed = [region for old, region in zip(old_regions, regions)
+                   if old[3] != region.digest]
+
+        # A section has changed its padding, so everything must be written
+        if [region for region in changed if region.data is None]:
+            return None
+        return changed
 
     def GetEntries(self):
         return self._section.GetEntries()
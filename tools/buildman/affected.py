@@ -0,0 +1,381 @@
+# SPDX-License-Identifier: GPL-2.0+
+# Copyright (c) 2019 Google, Inc
+#
+
+"""Working out which boards are affected by a commit
+
+When building a series of commits, many commits only touch files which are
+not used by most boards (e.g. a single board's directory, or a driver which
+few boards enable). This module works out whether a commit can affect the
+build for a board, so that buildman can reuse the board's result from the
+previous commit instead of building it again.
+
+The checks are conservative: a file is assumed to affect a board unless it
+can be shown not to. A file is not used by a board if:
+
+   - it is in documentation (doc/, README, MAINTAINERS)
+   - it is in another architecture's arch/ directory
+   - it is in another vendor's or board's board/ directory, which the
+     board's Makefile does not build objects from (e.g. '../cardhu/cardhu.o')
+   - it is another board's defconfig, or an include/configs header which
+     the board's own header does not include (directly or indirectly)
+   - it is a source file which its Makefile only builds with a CONFIG
+     option that the board does not enable, or is in a directory which is
+     only built with such an option
+
+The board's configuration comes from the config files (.config, autoconf.mk,
+u-boot.cfg, etc.) written by the board's build of the previous commit.
+"""
+
+import os
+import re
+import threading
+
+import gitutil
+
+# Makefile variables which list objects and directories to build
+RE_MAKE_LIST = re.compile(r'^(obj|lib|libs|head|extra)-(\S+?)\s*[+:]?=(.*)$')
+
+# A make condition which uses a single CONFIG option
+RE_MAKE_CONFIG = re.compile(r'^\$\((CONFIG_\w+)\)$')
+
+# Start and end of conditional blocks in a Makefile
+RE_MAKE_IF = re.compile(r'^(ifdef|ifndef|ifeq|ifneq)\b')
+RE_MAKE_ENDIF = re.compile(r'^endif\b')
+
+# Makefiles outside the source directory which list directories to build
+EXTRA_MAKEFILES = ['scripts/Makefile.spl']
+
+# Prefixes used in Makefiles for options which differ in SPL/TPL builds
+SPL_PREFIXES = ['', 'SPL_', 'TPL_']
+
+# Source files which are built by make, and so can be found in a Makefile
+SOURCE_EXTS = ['.c', '.S', '.s']
+
+# An #include of another header in include/configs, from a header there
+RE_CONFIG_INCLUDE = re.compile(
+    r'^\s*#\s*include\s*(?:"([\w.-]+)"|<configs/([\w.-]+)>)')
+
+class AffectedChecker:
+    """Works out whether commits affect boards
+
+    Private members:
+        _changed: Dict of changed files, keyed by (old_hash, new_hash)
+        _config_headers: Dict of the include/configs headers used by a board,
+            keyed by (commit hash, header name). See _GetConfigHeaders()
+        _git_dir: Git directory containing the commits
+        _lock: Lock used to serialise access from builder threads
+        _makefiles: Dict of Makefile entries, keyed by (commit hash,
+            Makefile name). See _GetMakefileEntries() for the format
+    """
+    def __init__(self, git_dir):
+        """Set up a new checker
+
+        Args:
+            git_dir: Git directory containing the commits to check
+        """
+        self._git_dir = git_dir
+        self._lock = threading.Lock()
+        self._changed = {}
+        self._config_headers = {}
+        self._makefiles = {}
+
+    def GetChangedFiles(self, old_hash, new_hash):
+        """Get the files changed between two commits
+
+        Args:
+            old_hash: Hash of the old commit
+            new_hash: Hash of the new commit
+
+        Returns:
+            List of filenames
+        """
+        key = (old_hash, new_hash)
+        with self._lock:
+            if key not in self._changed:
+                self._changed[key] = gitutil.GetChangedFiles(self._git_dir,
+                                                             old_hash, new_hash)
+            return self._changed[key]
+
+    def IsAffected(self, brd, config, commit_hash, fnames):
+        """Check whether changes to a list of files can affect a board
+
+        Args:
+            brd: Board object to check
+            config: Dict of the board's CONFIG options, keyed by name (e.g.
+                'CONFIG_DM'). Any option present is treated as enabled
+            commit_hash: Hash of the commit containing the changes
+            fnames: List of filenames which were changed
+
+        Returns:
+            True if the board may be affected, False if not
+        """
+        for fname in fnames:
+            if self._IsFileUsed(brd, config, commit_hash, fname):
+                return True
+        return False
+
+    def _IsFileUsed(self, brd, config, commit_hash, fname):
+        """Check whether a file can be used in the build of a board
+
+        Args:
+            brd: Board object to check
+            config: Dict of the board's CONFIG options
+            commit_hash: Hash of the commit to check
+            fname: Filename to check, relative to the top of the tree
+
+        Returns:
+            True if the file may be used, False if not
+        """
+        parts = fname.split('/')
+        basename = parts[-1]
+        if parts[0] == 'doc' or basename in ['README', 'MAINTAINERS']:
+            return False
+        if parts[0] == 'arch' and len(parts) > 2 and parts[1] != brd.arch:
+            return False
+        if parts[0] == 'board' and len(parts) > 2:
+            if not self._IsBoardDirUsed(brd, config, commit_hash, parts):
+                return False
+        if parts[0] == 'configs' and len(parts) == 2:
+            return basename == '%s_defconfig' % brd.target
+        if parts[:2] == ['include', 'configs'] and len(parts) == 3:
+            name = config.get('CONFIG_SYS_CONFIG_NAME', '').strip('"')
+            return not name or basename in self._GetConfigHeaders(
+                commit_hash, '%s.h' % name)
+
+        base, ext = os.path.splitext(basename)
+        if ext not in SOURCE_EXTS:
+            return True
+        dirname = '/'.join(parts[:-1])
+        conds = self._GetConditions(commit_hash,
+                                    os.path.join(dirname, 'Makefile'),
+                                    [base + '.o'])
+        if conds is not None and not self._AnyEnabled(config, conds):
+            return False
+        for depth in range(1, len(parts)):
+            if not self._IsDirUsed(config, commit_hash, parts[:depth]):
+                return False
+        return True
+
+    def _GetConfigHeaders(self, commit_hash, header):
+        """Get the headers in include/configs which a board's header uses
+
+        This follows #include lines from the board's header to other headers
+        in include/configs (e.g. a header shared by boards using the same
+        SoC), however deeply they are nested.
+
+        Args:
+            commit_hash: Hash of the commit to check
+            header: Name of the board's header (e.g. 'ls1043ardb.h')
+
+        Returns:
+            Set of header names, including the board's header
+        """
+        key = (commit_hash, header)
+        with self._lock:
+            if key in self._config_headers:
+                return self._config_headers[key]
+        headers = set()
+        todo = [header]
+        while todo:
+            name = todo.pop()
+            if name in headers:
+                continue
+            headers.add(name)
+            data = gitutil.GetFileContents(self._git_dir, commit_hash,
+                                           'include/configs/%s' % name)
+            for line in (data or '').splitlines():
+                match = RE_CONFIG_INCLUDE.match(line)
+                if match:
+                    todo.append(match.group(1) or match.group(2))
+        with self._lock:
+            self._config_headers[key] = headers
+        return headers
+
+    def _IsBoardDirUsed(self, brd, config, commit_hash, parts):
+        """Check whether a file in the board/ directory can be used
+
+        Besides the board's own directory, this covers directories which the
+        board's Makefiles build objects from (e.g. '../cardhu/cardhu.o').
+
+        Args:
+            brd: Board object to check
+            config: Dict of the board's CONFIG options
+            commit_hash: Hash of the commit to check
+            parts: Path components of the filename, starting with 'board'
+
+        Returns:
+            True if the file may be used, False if not
+        """
+        vendor = config.get('CONFIG_SYS_VENDOR', '').strip('"') or brd.vendor
+        board_name = (config.get('CONFIG_SYS_BOARD', '').strip('"') or
+                      brd.board_name)
+        if vendor and vendor != '-':
+            if parts[1] == vendor and (len(parts) == 3 or
+                                       parts[2] in [board_name, 'common']):
+                return True
+            board_dirs = ['board/%s/%s' % (vendor, board_name),
+                          'board/%s/common' % vendor]
+        else:
+            if parts[1] == board_name:
+                return True
+            board_dirs = ['board/%s' % board_name]
+        dirname = '/'.join(parts[:-1])
+        for used in self._GetBoardExtraDirs(commit_hash, board_dirs):
+            if dirname == used or dirname.startswith(used + '/'):
+                return True
+        return False
+
+    def _GetBoardExtraDirs(self, commit_hash, board_dirs):
+        """Get other directories which a board's Makefiles build from
+
+        Args:
+            commit_hash: Hash of the commit to check
+            board_dirs: List of the board's directories, relative to the top
+                of the tree (e.g. 'board/nvidia/beaver')
+
+        Returns:
+            Set of directories, relative to the top of the tree
+        """
+        dirs = set()
+        for board_dir in board_dirs:
+            makefile = os.path.join(board_dir, 'Makefile')
+            for token, cond in self._GetMakefileEntries(commit_hash, makefile):
+                if '..' not in token:
+                    continue
+                path = os.path.normpath(os.path.join(board_dir, token))
+                dirs.add(path if token.endswith('/') else
+                         os.path.dirname(path))
+        return dirs
+
+    def _IsDirUsed(self, config, commit_hash, parts):
+        """Check whether a directory can be built for a board
+
+        The directory is built if any Makefile which mentions it builds it
+        for the board. If no Makefile mentions it, it is assumed to be built.
+
+        Args:
+            config: Dict of the board's CONFIG options
+            commit_hash: Hash of the commit to check
+            parts: Path components of the directory
+
+        Returns:
+            True if the directory may be built, False if not
+        """
+        found = False
+        makefiles = [(os.path.join(*(parts[:depth] + ['Makefile'])),
+                      '/'.join(parts[depth:]) + '/')
+                     for depth in range(len(parts))]
+        makefiles += [(name, '/'.join(parts) + '/')
+                      for name in EXTRA_MAKEFILES]
+        for makefile, entry in makefiles:
+            conds = self._GetConditions(commit_hash, makefile, [entry])
+            if conds is None:
+                continue
+            found = True
+            if self._AnyEnabled(config, conds):
+                return True
+        return not found
+
+    def _AnyEnabled(self, config, conds):
+        """Check whether any of a list of conditions is met
+
+        Args:
+            config: Dict of the board's CONFIG options
+            conds: List of conditions, each a list of CONFIG options of which
+                any one enables the condition, or None if always enabled
+
+        Returns:
+            True if any condition is met
+        """
+        for cond in conds:
+            if cond is None:
+                return True
+            for name in cond:
+                if name in config:
+                    return True
+        return False
+
+    def _GetConditions(self, commit_hash, makefile, entries):
+        """Get the conditions under which a Makefile builds something
+
+        Args:
+            commit_hash: Hash of the commit to check
+            makefile: Filename of Makefile, relative to the top of the tree
+            entries: List of objects or directories to look for (e.g.
+                'fred.o' or 'dir/')
+
+        Returns:
+            None if the Makefile does not mention any of the entries, else a
+            list of conditions (see _AnyEnabled())
+        """
+        conds = []
+        for token, cond in self._GetMakefileEntries(commit_hash, makefile):
+            if token in entries:
+                conds.append(cond)
+        return conds or None
+
+    def _GetMakefileEntries(self, commit_hash, makefile):
+        """Read the objects and directories listed in a Makefile
+
+        Entries within conditional blocks (ifdef, etc.) or with a condition
+        which is not a simple CONFIG option are treated as unconditional.
+
+        Args:
+            commit_hash: Hash of the commit to check
+            makefile: Filename of Makefile, relative to the top of the tree
+
+        Returns:
+            List of tuples:
+                Object or directory (e.g. 'fred.o' or 'dir/')
+                List of CONFIG options which build it, or None if
+                    unconditional
+        """
+        key = (commit_hash, makefile)
+        with self._lock:
+            if key in self._makefiles:
+                return self._makefiles[key]
+        data = gitutil.GetFileContents(self._git_dir, commit_hash, makefile)
+        entries = []
+        depth = 0
+        for line in (data or '').replace('\\\n', ' ').splitlines():
+            line = line.split('#', 1)[0].strip()
+            if RE_MAKE_IF.match(line):
+                depth += 1
+            elif RE_MAKE_ENDIF.match(line):
+                depth = max(0, depth - 1)
+            match = RE_MAKE_LIST.match(line)
+            if not match:
+                continue
+            cond = None
+            if depth == 0 and match.group(2) != 'y':
+                cond = _GetConfigNames(match.group(2))
+            for token in match.group(3).split():
+                entries.append((token, cond))
+        with self._lock:
+            self._makefiles[key] = entries
+        return entries
+
+
+def _GetConfigNames(var):
+    """Get the CONFIG options used in a Makefile condition
+
+    Conditions like $(CONFIG_$(SPL_)FRED) are expanded to cover U-Boot
+    proper, SPL and TPL.
+
+    Args:
+        var: Condition (e.g. '$(CONFIG_FRED)')
+
+    Returns:
+        List of CONFIG options, any of which enables the condition, or None if
+        the condition is not understood
+    """
+    names = []
+    for prefix in SPL_PREFIXES:
+        expanded = var.replace('$(SPL_TPL_)', prefix).replace('$(SPL_)',
+                                                              prefix)
+        match = RE_MAKE_CONFIG.match(expanded)
+        if not match:
+            return None
+        names.append(match.group(1))
+    return names
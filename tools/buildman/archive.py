@@ -0,0 +1,238 @@
+# SPDX-License-Identifier: GPL-2.0+
+# Copyright (c) 2019 Google, Inc
+#
+
+"""Compressed storage of build output files
+
+With -k and many commits, the output directory holds a copy of the images,
+maps and logs for every board and commit, even though most of them are the
+same from one commit to the next. Instead, these files can be kept in an
+archive: each file is compressed and stored once under the hash of its
+contents, in a directory shared by all builds, and each build directory has
+a manifest listing the files it contains.
+
+Code which reads the output files should use Archive.Open() and
+Archive.Glob(), which look in the manifest and then fall back to a plain file
+in the build directory, so that they work whether or not the build was
+archived.
+"""
+
+import fnmatch
+import glob
+import hashlib
+import io
+import json
+import os
+import tempfile
+import zlib
+
+# Directory within the output directory holding the archived files
+OBJECTS_DIR = '.bm-objects'
+
+# Filename of the manifest in each build directory
+MANIFEST_FNAME = 'archive'
+
+# zlib compression level to use
+COMPRESS_LEVEL = 6
+
+class Archive:
+    """A store of compressed build output files, shared between builds
+
+    Private members:
+        _objects_dir: Directory holding the compressed files, each named
+            after the SHA1 hash of its contents
+        _manifests: Manifests already read, keyed by build directory. Each
+            value is a tuple (stamp, entries) where stamp is the manifest's
+            modification time and size, and entries is the dict returned by
+            ReadManifest()
+    """
+    def __init__(self, base_dir):
+        """Set up an archive for an output directory
+
+        Nothing is created until a file is stored.
+
+        Args:
+            base_dir: Output directory holding the builds
+        """
+        self._objects_dir = os.path.join(base_dir, OBJECTS_DIR)
+        self._manifests = {}
+
+    def StoreData(self, data):
+        """Store some data in the archive, if it is not already there
+
+        Args:
+            data: Contents of the file to store
+
+        Returns:
+            Tuple (hash, size) giving the SHA1 hash of the data as a string
+            and its size in bytes
+        """
+        obj_hash = hashlib.sha1(data).hexdigest()
+        fname = self._GetObjectFile(obj_hash)
+        if not os.path.exists(fname):
+            dirname = os.path.dirname(fname)
+            if not os.path.exists(dirname):
+                try:
+                    os.makedirs(dirname)
+                except OSError:
+                    # Another thread may have created it
+                    if not os.path.isdir(dirname):
+                        raise
+
+            # Write to a temporary file first, so that other threads never
+            # see a partial file
+            fd, tmpname = tempfile.mkstemp(dir=dirname)
+            with os.fdopen(fd, 'wb') as outf:
+                outf.write(zlib.compress(data, COMPRESS_LEVEL))
+            os.rename(tmpname, fname)
+        return obj_hash, len(data)
+
+    def StoreFile(self, pathname):
+        """Store a file in the archive, if it is not already there
+
+        Args:
+            pathname: Path to the file to store
+
+        Returns:
+            Tuple (hash, size), see StoreData()
+        """
+        with open(pathname, 'rb') as fd:
+            return self.StoreData(fd.read())
+
+    def WriteManifest(self, build_dir, entries):
+        """Write the manifest for a build directory
+
+        Any plain files left in the build directory by an earlier build,
+        which have the same name as an archived file, are removed.
+
+        Args:
+            build_dir: Build directory to write to
+            entries: Dict of the files in the build, keyed by filename. Each
+                value is a tuple (hash, size) returned by StoreData()
+        """
+        for name in entries:
+            pathname = os.path.join(build_dir, name)
+            if os.path.exists(pathname):
+                os.remove(pathname)
+        fname = os.path.join(build_dir, MANIFEST_FNAME)
+        with open(fname, 'w') as fd:
+            json.dump(entries, fd, sort_keys=True)
+        self._manifests.pop(build_dir, None)
+
+    def RemoveManifest(self, build_dir):
+        """Remove the manifest from a build directory, if there is one
+
+        This is used when a build is not archived, so that files from an
+        earlier archived build are not used in place of the new ones.
+
+        Args:
+            build_dir: Build directory to update
+        """
+        fname = os.path.join(build_dir, MANIFEST_FNAME)
+        if os.path.exists(fname):
+            os.remove(fname)
+        self._manifests.pop(build_dir, None)
+
+    def ReadManifest(self, build_dir):
+        """Read the manifest for a build directory
+
+        The manifest is only parsed again if it has changed since it was last
+        read, so this is cheap to call for each file in the build.
+
+        Args:
+            build_dir: Build directory to read from
+
+        Returns:
+            Dict of the files in the build, keyed by filename. Each value is
+            a tuple (hash, size). The dict is empty if there is no manifest.
+            The caller must not modify it
+        """
+        fname = os.path.join(build_dir, MANIFEST_FNAME)
+        try:
+            stat = os.stat(fname)
+        except OSError:
+            self._manifests.pop(build_dir, None)
+            return {}
+        stamp = (stat.st_mtime, stat.st_size)
+        cached = self._manifests.get(build_dir)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        with open(fname) as fd:
+            entries = json.load(fd)
+        entries = dict((str(name), (str(obj_hash), size))
+                       for name, (obj_hash, size) in entries.iteritems())
+        self._manifests[build_dir] = (stamp, entries)
+        return entries
+
+    def Open(self, pathname):
+        """Open a build output file for reading
+
+        Args:
+            pathname: Path to the file, i.e. the build directory and the
+                filename
+
+        Returns:
+            File object to read from, or None if the file does not exist
+        """
+        build_dir, name = os.path.split(pathname)
+        entry = self.ReadManifest(build_dir).get(name)
+        if entry:
+            return io.BytesIO(self._ReadObject(entry[0]))
+        if os.path.exists(pathname):
+            return open(pathname, 'rb')
+        return None
+
+    def Glob(self, pattern):
+        """Find the build output files which match a pattern
+
+        Args:
+            pattern: Pattern to match, i.e. the build directory and a
+                filename pattern (e.g. '*.sizes')
+
+        Returns:
+            Sorted list of paths to the matching files
+        """
+        build_dir, name_pattern = os.path.split(pattern)
+        names = set(fnmatch.filter(self.ReadManifest(build_dir).keys(),
+                                   name_pattern))
+        names.update(os.path.basename(fname) for fname in glob.glob(pattern))
+        return [os.path.join(build_dir, name) for name in sorted(names)]
+
+    def Extract(self, build_dir, dest_dir):
+        """Write out the archived files for a build
+
+        Args:
+            build_dir: Build directory to read from
+            dest_dir: Directory to write the files to
+
+        Returns:
+            List of the filenames written
+        """
+        entries = self.ReadManifest(build_dir)
+        for name, (obj_hash, size) in entries.iteritems():
+            with open(os.path.join(dest_dir, name), 'wb') as fd:
+                fd.write(self._ReadObject(obj_hash))
+        return sorted(entries)
+
+    def _GetObjectFile(self, obj_hash):
+        """Get the filename of an archived file
+
+        Args:
+            obj_hash: SHA1 hash of the file's contents
+
+        Returns:
+            Path to the compressed file
+        """
+        return os.path.join(self._objects_dir, obj_hash[:2], obj_hash[2:])
+
+    def _ReadObject(self, obj_hash):
+        """Read an archived file
+
+        Args:
+            obj_hash: SHA1 hash of the file's contents
+
+        Returns:
+            Contents of the file
+        """
+        with open(self._GetObjectFile(obj_hash), 'rb') as fd:
+            return zlib.decompress(fd.read())
@@ -1,8 +1,14 @@
 # SPDX-License-Identifier: GPL-2.0+
 # Copyright (c) 2012 The Chromium OS Authors.
 
+import bisect
+import itertools
 import re
 
+# An expression which only matches literally, i.e. contains no special
+# characters
+RE_LITERAL = re.compile(r'[\w:,=-]*$')
+
 class Expr:
     """A single regular expression for matching boards to build"""
 
@@ -28,6 +34,17 @@ class Expr:
                 return True
         return False
 
+    def GetPrefix(self):
+        """Get the prefix which properties must have to match
+
+        Returns:
+            The expression itself if it has no special characters, so that it
+            matches any property which starts with it, else None
+        """
+        if RE_LITERAL.match(self._expr):
+            return self._expr
+        return None
+
     def __str__(self):
         return self._expr
 
@@ -69,6 +86,84 @@ class Term:
                 return False
         return True
 
+    def GetMatches(self, index):
+        """Get the boards which match this term
+
+        Args:
+            index: BoardIndex object for the boards to check
+        Returns:
+            Set of indexes of the boards for which all of the expressions in
+            the Term match
+        """
+        matches = None
+        for expr in self._expr_list:
+            expr_matches = index.Match(expr)
+            if matches is None:
+                matches = set(expr_matches)
+            else:
+                matches &= expr_matches
+            if not matches:
+                break
+        return matches or set()
+
+class BoardIndex:
+    """An index of board properties, used to select boards quickly
+
+    Rather than checking each expression against every property of every
+    board, each expression is checked against the distinct property values,
+    and the boards with matching values are found from the index. Where an
+    expression is a plain string, only the values starting with it are
+    checked.
+
+    Private members:
+        _boards_by_prop: Dict of the list of indexes of boards which have
+            each property value, keyed by value
+        _matches: Dict of the set of indexes of boards matched by each
+            expression, keyed by the expression string
+        _values: Sorted list of distinct property values
+    """
+    def __init__(self, boards):
+        """Create an index for a list of boards
+
+        Args:
+            boards: List of Board objects. Boards are referred to by their
+                index in this list
+        """
+        self._boards_by_prop = {}
+        self._matches = {}
+        for upto, board in enumerate(boards):
+            for prop in board.props:
+                upto_list = self._boards_by_prop.setdefault(prop, [])
+                if not upto_list or upto_list[-1] != upto:
+                    upto_list.append(upto)
+        self._values = sorted(self._boards_by_prop)
+
+    def Match(self, expr):
+        """Get the boards with any property which matches an expression
+
+        Args:
+            expr: Expr object to check
+        Returns:
+            Set of indexes of the matching boards. This must not be changed
+            by the caller
+        """
+        key = str(expr)
+        if key not in self._matches:
+            prefix = expr.GetPrefix()
+            if prefix is not None:
+                start = bisect.bisect_left(self._values, prefix)
+                values = itertools.takewhile(
+                        lambda value: value.startswith(prefix),
+                        itertools.islice(self._values, start, None))
+            else:
+                values = [value for value in self._values
+                          if expr.Matches([value])]
+            matches = set()
+            for value in values:
+                matches.update(self._boards_by_prop[value])
+            self._matches[key] = matches
+        return self._matches[key]
+
 class Board:
     """A particular board that we can build"""
     def __init__(self, status, arch, cpu, soc, vendor, board_name, target, options):
@@ -101,6 +196,7 @@ class Boards:
     def __init__(self):
         # Use a simple list here, sinc OrderedDict requires Python 2.7
         self._boards = []
+        self._index = None
 
     def AddBoard(self, board):
         """Add a new board to the list.
@@ -111,6 +207,7 @@ class Boards:
             board: board to add
         """
         self._boards.append(board)
+        self._index = None
 
     def ReadBoards(self, fname):
         """Read a list of boards from a board file.
@@ -257,33 +354,29 @@ class Boards:
         for term in terms:
             result[str(term)] = []
 
-        exclude_list = []
-        for expr in exclude:
-            exclude_list.append(Expr(expr))
+        if not self._index:
+            self._index = BoardIndex(self._boards)
 
-        for board in self._boards:
-            matching_term = None
-            build_it = False
-            if terms:
-                match = False
-                for term in terms:
-                    if term.Matches(board.props):
-                        matching_term = str(term)
-                        build_it = True
-                        break
-            else:
-                build_it = True
-
-            # Check that it is not specifically excluded
-            for expr in exclude_list:
-                if expr.Matches(board.props):
-                    build_it = False
-                    break
-
-            if build_it:
-                board.build_it = True
-                if matching_term:
-                    result[matching_term].append(board.target)
-                result['all'].append(board.target)
+        # Each board is reported against the first term which matches it
+        matching_term = {}
+        for term in terms:
+            for upto in term.GetMatches(self._index):
+                if upto not in matching_term:
+                    matching_term[upto] = str(term)
+        if terms:
+            selected = set(matching_term)
+        else:
+            selected = set(range(len(self._boards)))
+
+        # Remove those that are specifically excluded
+        for expr in exclude:
+            selected -= self._index.Match(Expr(expr))
+
+        for upto in sorted(selected):
+            board = self._boards[upto]
+            board.build_it = True
+            if upto in matching_term:
+                result[matching_term[upto]].append(board.target)
+            result['all'].append(board.target)
 
         return result
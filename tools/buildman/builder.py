@@ -7,6 +7,8 @@
 import collections
 from datetime import datetime, timedelta
 import glob
+import hashlib
+import multiprocessing
 import os
 import re
 import Queue
@@ -18,8 +20,13 @@ import threading
 import time
 
 import builderthread
+import buildtimes
+import affected
+import archive
 import command
 import gitutil
+import linetable
+import resultdb
 import terminal
 from terminal import Print
 import toolchain
@@ -94,6 +101,13 @@ u-boot/             source directory
 # Possible build outcomes
 OUTCOME_OK, OUTCOME_WARNING, OUTCOME_ERROR, OUTCOME_UNKNOWN = range(4)
 
+# Names of the outcomes used in build events
+EVENT_OUTCOMES = ['ok', 'warning', 'error', 'unknown']
+
+# Image size metrics which can be used to bisect a size regression, as well
+# as 'func:<name>' for the size of a function
+BISECT_METRICS = ['text', 'data', 'bss', 'rodata', 'all']
+
 # Translate a commit subject into a valid filename (and handle unicode)
 trans_valid_chars = string.maketrans('/: ', '---')
 trans_valid_chars = trans_valid_chars.decode('latin-1')
@@ -108,6 +122,41 @@ EXTRA_CONFIG_FILENAMES = [
     'autoconf.h', 'autoconf-spl.h','autoconf-tpl.h',
 ]
 
+# Files in the source tree (other than the board's defconfig) which affect the
+# configuration of a board
+RE_CONFIG_INPUT = re.compile(r'(.*/)?Kconfig[^/]*$|scripts/kconfig/')
+
+# Minimum number of build outcomes to read before it is worth starting a pool
+# of processes to read them in parallel
+MIN_PARALLEL_OUTCOMES = 200
+
+# Builder whose build outcomes are read by a summary worker process
+_summary_builder = None
+
+def _InitSummaryWorker(builder):
+    """Set up a worker process for reading build outcomes
+
+    Args:
+        builder: Builder object to use to read the outcomes
+    """
+    global _summary_builder
+
+    _summary_builder = builder
+
+def _ReadOutcome(args):
+    """Read the outcome of a build in a worker process
+
+    Args:
+        args: Tuple of arguments for Builder._ReadBuildOutcome()
+
+    Returns:
+        Tuple of arguments to create a Builder.Outcome object, which cannot
+        itself be passed back to the parent process
+    """
+    outcome = _summary_builder._ReadBuildOutcome(*args)
+    return (outcome.rc, outcome.err_lines, outcome.sizes, outcome.func_sizes,
+            outcome.config, outcome.environment)
+
 class Config:
     """Holds information about configuration settings for a board."""
     def __init__(self, config_filename, target):
@@ -140,13 +189,26 @@ class Builder:
     """Class for building U-Boot for a particular commit.
 
     Public members: (many should ->private)
+        affected: AffectedChecker object used to skip builds for commits
+            which cannot affect a board, or None to build every commit
         already_done: Number of builds already completed
+        archive: Archive object used to read (and with archive_outputs,
+            write) the build output files
+        archive_outputs: Put the build output files (logs, config files and
+            with -k the images) in a compressed archive rather than copying
+            them to the build directory
         base_dir: Base directory to use for builder
+        build_times: BuildTimes object recording how long each board takes
+            to build, or None if not building
+        carried_over: Number of builds skipped because the commit did not
+            affect the board
         checkout: True to check out source, False to skip that step.
             This is used for testing.
         col: terminal.Color() object
+        compiler_cache: CompilerCache object to use when building, or None
         count: Number of commits to build
         do_make: Method to call to invoke Make
+        events: EventStream object to write build events to, or None
         fail: Number of builds that failed due to error
         force_build: Force building even if a build already exists
         force_config_on_failure: If a commit fails for a board, disable
@@ -155,6 +217,10 @@ class Builder:
         force_build_failures: If a previously-built build (i.e. built on
             a previous run of buildman) is marked as failed, rebuild it.
         git_dir: Git directory containing source repository
+        jobserver: JobServer object providing job tokens shared by all
+            threads, or None to pass num_jobs to make instead
+        monitor: ResourceMonitor object limiting the number of threads which
+            run jobs at once, or None to use all threads
         last_line_len: Length of the last line we printed (used for erasing
             it with new progress information)
         num_jobs: Number of jobs to run at once (passed to make as -j)
@@ -163,23 +229,55 @@ class Builder:
         re_make_err: Compiled regular expression for ignore_lines
         queue: Queue of jobs to run
         threads: List of active threads
+        tmpfs: Tmpfs object providing output directories in memory, or None
+            to put them in the thread directories
         toolchains: Toolchains object to use for building
         upto: Current commit number we are building (0.count-1)
         warned: Number of builds that produced at least one warning
+        skip_unaffected: Skip building commits which cannot affect a board,
+            reusing the board's result for the previous commit
         force_reconfig: Reconfigure U-Boot on each comiit. This disables
             incremental building, where buildman reconfigures on the first
             commit for a baord, and then just does an incremental build for
             the following commits. In fact buildman will reconfigure and
             retry for any failing commits, so generally the only effect of
             this option is to slow things down.
+        fast_checkout: Check out each commit by only writing the files which
+            differ from the previous commit built by the thread, so that
+            their modification times are preserved
+        config_hash: When buildman would reconfigure a board (after a failure
+            or on the first commit), only do so if the inputs to the
+            configuration have changed since the output directory was last
+            configured. See GetConfigHash()
         in_tree: Build U-Boot in-tree instead of specifying an output
             directory separate from the source code. This option is really
             only useful for testing in-tree builds.
 
     Private members:
+        _config_inputs: Dict of the inputs to the configuration for each
+            commit, keyed by commit number, see _ReadConfigInputs()
+        _config_lock: Lock used to serialise access to _config_inputs
+        _outcomes: Dict of build outcomes which have been read from the
+            output files, keyed by (commit directory, target). Each value is
+            a tuple:
+                Stamp of the files when read, see _GetOutcomeStamp()
+                Tuple of the read_func_sizes, read_config and
+                    read_environment flags used to read the outcome
+                Outcome object
+        _result_db: ResultDb object holding build outcomes, or None if not
+            opened yet
+        _use_result_db: True to store and look up build outcomes in a
+            database in the output directory
         _base_board_dict: Last-summarised Dict of boards
-        _base_err_lines: Last-summarised list of errors
-        _base_warn_lines: Last-summarised list of warnings
+        _base_err_lines: Last-summarised list of error line IDs
+        _base_warn_lines: Last-summarised list of warning line IDs
+        _base_err_line_boards: Last-summarised dict of the boards with each
+            error, see GetResultSummary()
+        _base_warn_line_boards: Last-summarised dict of the boards with each
+            warning, see GetResultSummary()
+        _board_bits: BoardBits object giving each board a bit in the sets of
+            boards held for each error/warning line
+        _line_table: LineTable object giving each error/warning line an ID
         _build_period_us: Time taken for a single build (float object).
         _complete_delay: Expected delay until completion (timedelta)
         _next_delay_update: Next time we plan to display a progress update
@@ -225,7 +323,9 @@ class Builder:
                  no_subdirs=False, full_path=False, verbose_build=False,
                  incremental=False, per_board_out_dir=False,
                  config_only=False, squash_config_y=False,
-                 warnings_as_errors=False):
+                 warnings_as_errors=False, result_db=False,
+                 compiler_cache=None, jobserver=None, tmpfs=None,
+                 events=None, monitor=None):
         """Create a new Builder object
 
         Args:
@@ -251,6 +351,18 @@ class Builder:
             config_only: Only configure each build, don't build it
             squash_config_y: Convert CONFIG options with the value 'y' to '1'
             warnings_as_errors: Treat all compiler warnings as errors
+            result_db: Store build outcomes in a database in the output
+                directory and use it when producing summaries
+            compiler_cache: CompilerCache object to use when building, or
+                None to build without one (other than any wrapper in the
+                settings file)
+            jobserver: JobServer object to share job tokens between all
+                threads, or None to pass num_jobs to make instead
+            tmpfs: Tmpfs object to provide output directories in memory, or
+                None to put them in the thread directories
+            events: EventStream object to write build events to, or None
+            monitor: ResourceMonitor object to adjust the number of threads
+                running jobs to suit the machine, or None
         """
         self.toolchains = toolchains
         self.base_dir = base_dir
@@ -262,6 +374,9 @@ class Builder:
         self.num_threads = num_threads
         self.num_jobs = num_jobs
         self.already_done = 0
+        self.carried_over = 0
+        self.skip_unaffected = False
+        self.affected = None
         self.force_build = False
         self.git_dir = git_dir
         self._show_unknown = show_unknown
@@ -272,6 +387,12 @@ class Builder:
         self.force_config_on_failure = True
         self.force_build_failures = False
         self.force_reconfig = False
+        self.config_hash = False
+        self.fast_checkout = False
+        self.archive = archive.Archive(base_dir)
+        self.archive_outputs = False
+        self._config_inputs = {}
+        self._config_lock = threading.Lock()
         self._step = step
         self.in_tree = False
         self._error_lines = 0
@@ -285,6 +406,17 @@ class Builder:
             self.config_filenames += EXTRA_CONFIG_FILENAMES
 
         self.warnings_as_errors = warnings_as_errors
+        self._use_result_db = result_db
+        self._result_db = None
+        self._outcomes = {}
+        self._line_table = linetable.LineTable()
+        self._board_bits = linetable.BoardBits()
+        self.compiler_cache = compiler_cache
+        self.jobserver = jobserver
+        self.tmpfs = tmpfs
+        self.events = events
+        self.monitor = monitor
+        self.build_times = None
         self.col = terminal.Color()
 
         self._re_function = re.compile('(.*): In function.*')
@@ -432,6 +564,12 @@ class Builder:
                 self.warned += 1
             if result.already_done:
                 self.already_done += 1
+            if getattr(result, 'carried_over', False):
+                self.carried_over += 1
+            if self._use_result_db:
+                self._StoreOutcome(result.commit_upto, target)
+            if self.events:
+                self._WriteResultEvent(result)
             if self._verbose:
                 Print('\r', newline=False)
                 self.ClearLine(0)
@@ -465,6 +603,57 @@ class Builder:
         length = 16 + len(name)
         self.ClearLine(length)
 
+    def _WriteResultEvent(self, result):
+        """Write an event giving the result of a build to the event stream
+
+        The event has these fields, as well as 'type' and 'time':
+            board: Target board
+            arch: Architecture of the board
+            commit_upto: Commit number (0..n-1)
+            commit: Commit hash, or None if building the current source
+            subject: Commit subject, or None if building the current source
+            outcome: 'ok', 'warning', 'error' or 'unknown'
+            return_code: Return code from the build
+            already_done: True if the build was done by an earlier run
+            carried_over: True if the result was copied from the previous
+                commit (see --skip-unaffected)
+            duration: Time taken by the build in seconds, or None if not
+                known
+            warnings: Number of warning lines
+            errors: Number of error lines
+            sizes: Dict of image sizes, keyed by ELF file (e.g. 'u-boot').
+                Each value is a dict of sizes, keyed by section type ('text',
+                'data', 'bss', 'rodata' and 'all')
+            toolchain: Path to the C compiler, or None if there is none
+
+        Args:
+            result: CommandResult object for the build
+        """
+        brd = result.brd
+        outcome = self.GetBuildOutcome(result.commit_upto, brd.target, False,
+                                       False, False)
+        warnings = errors = 0
+        for line in outcome.err_lines:
+            if 'warning: ' in line:
+                warnings += 1
+            elif 'error: ' in line:
+                errors += 1
+        commit = None
+        if self.commits:
+            commit = self.commits[result.commit_upto]
+        toolchain = result.toolchain
+        self.events.Write('result', board=brd.target, arch=brd.arch,
+                commit_upto=result.commit_upto,
+                commit=commit.hash if commit else None,
+                subject=commit.subject if commit else None,
+                outcome=EVENT_OUTCOMES[outcome.rc],
+                return_code=result.return_code,
+                already_done=bool(result.already_done),
+                carried_over=getattr(result, 'carried_over', False),
+                duration=getattr(result, 'duration', None),
+                warnings=warnings, errors=errors, sizes=outcome.sizes,
+                toolchain=toolchain.gcc if toolchain else None)
+
     def _GetOutputDir(self, commit_upto):
         """Get the name of the output directory for a commit number
 
@@ -485,6 +674,26 @@ class Builder:
             return self.base_dir
         return os.path.join(self.base_dir, commit_dir)
 
+    def GetBuildConfig(self, commit_upto, target):
+        """Get the configuration used for a build
+
+        This combines all the config files written for the build (.config,
+        autoconf.mk, u-boot.cfg and their SPL/TPL versions).
+
+        Args:
+            commit_upto: Commit number to use (0..self.count-1)
+            target: Target name
+
+        Returns:
+            Dict of config values, keyed by config name (e.g. CONFIG_DM).
+            This is empty if there are no config files.
+        """
+        build_dir = self.GetBuildDir(commit_upto, target)
+        config = {}
+        for name in BASE_CONFIG_FILENAMES + EXTRA_CONFIG_FILENAMES:
+            config.update(self._ProcessConfig(os.path.join(build_dir, name)))
+        return config
+
     def GetBuildDir(self, commit_upto, target):
         """Get the name of the build directory for a commit number
 
@@ -515,6 +724,15 @@ class Builder:
         """
         return os.path.join(self.GetBuildDir(commit_upto, target), 'sizes')
 
+    def GetTimingFile(self, commit_upto, target):
+        """Get the name of the timing file for a commit number
+
+        Args:
+            commit_upto: Commit number to use (0..self.count-1)
+            target: Target name
+        """
+        return os.path.join(self.GetBuildDir(commit_upto, target), 'timing')
+
     def GetFuncSizesFile(self, commit_upto, target, elf_fname):
         """Get the name of the funcsizes file for a commit number and ELF file
 
@@ -603,8 +821,9 @@ class Builder:
                 value: Config value (e.g. 1)
         """
         config = {}
-        if os.path.exists(fname):
-            with open(fname) as fd:
+        fd = self.archive.Open(fname)
+        if fd:
+            with fd:
                 for line in fd:
                     line = line.strip()
                     if line.startswith('#define'):
@@ -639,8 +858,9 @@ class Builder:
                 value: value of environment variable (e.g. 1)
         """
         environment = {}
-        if os.path.exists(fname):
-            with open(fname) as fd:
+        fd = self.archive.Open(fname)
+        if fd:
+            with fd:
                 for line in fd.read().split('\0'):
                     try:
                         key, value = line.split('=', 1)
@@ -650,10 +870,194 @@ class Builder:
                         pass
         return environment
 
+    def _GetResultDb(self):
+        """Get the result database, opening it if needed
+
+        Returns:
+            ResultDb object
+        """
+        if not self._result_db:
+            builderthread.Mkdir(self.base_dir, parents = True)
+            self._result_db = resultdb.ResultDb(
+                    os.path.join(self.base_dir, '.bm-results.db'))
+        return self._result_db
+
+    def _GetDoneStamp(self, commit_upto, target):
+        """Get the modification time of the done file for a build
+
+        Args:
+            commit_upto: Commit number to check (0..n-1)
+            target: Target board to check
+
+        Returns:
+            Modification time (float), or None if the build is not done
+        """
+        try:
+            return os.stat(self.GetDoneFile(commit_upto, target)).st_mtime
+        except OSError:
+            return None
+
+    def _StoreOutcome(self, commit_upto, target):
+        """Read the outcome of a build from its files and store it
+
+        This is called from the result thread once the files for a build
+        have been written.
+
+        Args:
+            commit_upto: Commit number of the build (0..n-1)
+            target: Target board of the build
+
+        Returns:
+            Outcome object, or None if the build is not done
+        """
+        stamp = self._GetDoneStamp(commit_upto, target)
+        if stamp is None:
+            return None
+        outcome = self._ReadBuildOutcome(commit_upto, target, True, True,
+                                         True)
+        commit_dir = os.path.basename(self._GetOutputDir(commit_upto))
+        self._GetResultDb().Add(commit_dir, target, stamp, outcome.rc,
+                                outcome.err_lines, outcome.sizes,
+                                outcome.func_sizes, outcome.config,
+                                outcome.environment)
+        return outcome
+
     def GetBuildOutcome(self, commit_upto, target, read_func_sizes,
                         read_config, read_environment):
         """Work out the outcome of a build.
 
+        If the result database is in use, the outcome is taken from there
+        when it is up to date. Otherwise it is read from the build's output
+        files (and added to the database, if in use).
+
+        Args:
+            commit_upto: Commit number to check (0..n-1)
+            target: Target board to check
+            read_func_sizes: True to read function size information
+            read_config: True to read .config and autoconf.h files
+            read_environment: True to read uboot.env files
+
+        Returns:
+            Outcome object
+        """
+        if not self._use_result_db:
+            key = (os.path.basename(self._GetOutputDir(commit_upto)), target)
+            stamp = self._GetOutcomeStamp(commit_upto, target)
+            flags = (read_func_sizes, read_config, read_environment)
+            outcome = self._GetCachedOutcome(key, stamp, flags)
+            if not outcome:
+                outcome = self._ReadBuildOutcome(commit_upto, target,
+                        read_func_sizes, read_config, read_environment)
+                if stamp[0] is not None:
+                    self._outcomes[key] = (stamp, flags, outcome)
+            return outcome
+        stamp = self._GetDoneStamp(commit_upto, target)
+        if stamp is None:
+            return Builder.Outcome(OUTCOME_UNKNOWN, [], {}, {}, {}, {})
+        commit_dir = os.path.basename(self._GetOutputDir(commit_upto))
+        info = self._GetResultDb().Get(commit_dir, target, stamp)
+        if not info:
+            outcome = self._StoreOutcome(commit_upto, target)
+            if not outcome:
+                return Builder.Outcome(OUTCOME_UNKNOWN, [], {}, {}, {}, {})
+            info = (outcome.rc, outcome.err_lines, outcome.sizes,
+                    outcome.func_sizes, outcome.config, outcome.environment)
+        rc, err_lines, sizes, func_sizes, config, environment = info
+        return Builder.Outcome(rc, err_lines, sizes,
+                               func_sizes if read_func_sizes else {},
+                               config if read_config else {},
+                               environment if read_environment else {})
+
+    def _GetOutcomeStamp(self, commit_upto, target):
+        """Get a stamp which changes whenever a build's outcome may change
+
+        Args:
+            commit_upto: Commit number to check (0..n-1)
+            target: Target board to check
+
+        Returns:
+            Tuple of the modification times of the done and err files, each
+            None if the file does not exist
+        """
+        stamp = []
+        for fname in [self.GetDoneFile(commit_upto, target),
+                      self.GetErrFile(commit_upto, target)]:
+            try:
+                stamp.append(os.stat(fname).st_mtime)
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _GetCachedOutcome(self, key, stamp, flags):
+        """Get a build outcome previously read from the output files
+
+        Args:
+            key: Key of the outcome in self._outcomes
+            stamp: Current stamp of the build's files
+            flags: Tuple of the read_func_sizes, read_config and
+                read_environment flags needed
+
+        Returns:
+            Outcome object containing only the information requested by
+            flags, or None if there is no suitable outcome
+        """
+        cached = self._outcomes.get(key)
+        if not cached or cached[0] != stamp:
+            return None
+        cached_stamp, cached_flags, outcome = cached
+        for have, want in zip(cached_flags, flags):
+            if want and not have:
+                return None
+        read_func_sizes, read_config, read_environment = flags
+        return Builder.Outcome(outcome.rc, outcome.err_lines, outcome.sizes,
+                               outcome.func_sizes if read_func_sizes else {},
+                               outcome.config if read_config else {},
+                               outcome.environment if read_environment else {})
+
+    def _ReadOutcomes(self, commit_uptos, board_selected):
+        """Read the outcomes of many builds in parallel
+
+        This uses a pool of processes to read the output files of any builds
+        which are not already in self._outcomes, so that GetBuildOutcome()
+        can then find them there. It does nothing if there are only a few
+        builds to read.
+
+        Args:
+            commit_uptos: List of commit numbers to read (0..n-1)
+            board_selected: Dict containing boards to read
+        """
+        flags = (self._show_bloat, self._show_config, self._show_environment)
+        todo = []
+        for commit_upto in commit_uptos:
+            commit_dir = os.path.basename(self._GetOutputDir(commit_upto))
+            for brd in board_selected.itervalues():
+                key = (commit_dir, brd.target)
+                stamp = self._GetOutcomeStamp(commit_upto, brd.target)
+                if (stamp[0] is not None and
+                        not self._GetCachedOutcome(key, stamp, flags)):
+                    todo.append((commit_upto, brd.target, key, stamp))
+        if self.num_threads < 2 or len(todo) < MIN_PARALLEL_OUTCOMES:
+            return
+        pool = multiprocessing.Pool(self.num_threads, _InitSummaryWorker,
+                                    (self,))
+        try:
+            args = [(commit_upto, target) + flags
+                    for commit_upto, target, key, stamp in todo]
+            chunksize = max(1, len(args) / (self.num_threads * 4))
+            infos = pool.imap(_ReadOutcome, args, chunksize)
+            for (commit_upto, target, key, stamp), info in zip(todo, infos):
+                # Share the lines which are common to many builds
+                err_lines = [intern(line) for line in info[1]]
+                self._outcomes[key] = (stamp, flags, Builder.Outcome(info[0],
+                        err_lines, *info[2:]))
+        finally:
+            pool.close()
+            pool.join()
+
+    def _ReadBuildOutcome(self, commit_upto, target, read_func_sizes,
+                          read_config, read_environment):
+        """Work out the outcome of a build by reading its output files.
+
         Args:
             commit_upto: Commit number to check (0..n-1)
             target: Target board to check
@@ -677,7 +1081,8 @@ class Builder:
                 err_file = self.GetErrFile(commit_upto, target)
                 if os.path.exists(err_file):
                     with open(err_file, 'r') as fd:
-                        err_lines = self.FilterErrors(fd.readlines())
+                        err_lines = [intern(line) for line in
+                                     self.FilterErrors(fd.readlines())]
 
                 # Decide whether the build was ok, failed or created warnings
                 if return_code:
@@ -707,8 +1112,8 @@ class Builder:
 
             if read_func_sizes:
                 pattern = self.GetFuncSizesFile(commit_upto, target, '*')
-                for fname in glob.glob(pattern):
-                    with open(fname, 'r') as fd:
+                for fname in self.archive.Glob(pattern):
+                    with self.archive.Open(fname) as fd:
                         dict_name = os.path.basename(fname).replace('.sizes',
                                                                     '')
                         func_sizes[dict_name] = self.ReadFuncSizes(fname, fd)
@@ -744,12 +1149,13 @@ class Builder:
             Tuple:
                 Dict containing boards which passed building this commit.
                     keyed by board.target
-                List containing a summary of error lines
-                Dict keyed by error line, containing a list of the Board
-                    objects with that error
-                List containing a summary of warning lines
-                Dict keyed by error line, containing a list of the Board
-                    objects with that warning
+                List containing a summary of error lines, each an ID from
+                    self._line_table
+                Dict keyed by error line ID, containing a bitset (see
+                    self._board_bits) of the boards with that error
+                List containing a summary of warning lines, each an ID
+                Dict keyed by warning line ID, containing a bitset of the
+                    boards with that warning
                 Dictionary keyed by board.target. Each value is a dictionary:
                     key: filename - e.g. '.config'
                     value is itself a dictionary:
@@ -760,12 +1166,12 @@ class Builder:
                     value: value of environment variable
         """
         def AddLine(lines_summary, lines_boards, line, board):
-            line = line.rstrip()
-            if line in lines_boards:
-                lines_boards[line].append(board)
+            line_id = self._line_table.Intern(line)
+            if line_id in lines_boards:
+                lines_boards[line_id] |= self._board_bits.Get(board.target)
             else:
-                lines_boards[line] = [board]
-                lines_summary.append(line)
+                lines_boards[line_id] = self._board_bits.Get(board.target)
+                lines_summary.append(line_id)
 
         board_dict = {}
         err_lines_summary = []
@@ -1087,14 +1493,14 @@ class Builder:
                 board.target
             board_dict: Dict containing boards for which we built this
                 commit, keyed by board.target. The value is an Outcome object.
-            err_lines: A list of errors for this commit, or [] if there is
-                none, or we don't want to print errors
-            err_line_boards: Dict keyed by error line, containing a list of
-                the Board objects with that error
-            warn_lines: A list of warnings for this commit, or [] if there is
-                none, or we don't want to print errors
-            warn_line_boards: Dict keyed by warning line, containing a list of
-                the Board objects with that warning
+            err_lines: A list of error line IDs for this commit, or [] if
+                there is none, or we don't want to print errors
+            err_line_boards: Dict keyed by error line ID, containing a
+                bitset of the boards with that error
+            warn_lines: A list of warning line IDs for this commit, or [] if
+                there is none, or we don't want to print errors
+            warn_line_boards: Dict keyed by warning line ID, containing a
+                bitset of the boards with that warning
             config: Dictionary keyed by filename - e.g. '.config'. Each
                     value is itself a dictionary:
                         key: config name
@@ -1107,20 +1513,18 @@ class Builder:
             show_config: Show config changes
             show_environment: Show environment changes
         """
-        def _BoardList(line, line_boards):
+        def _BoardList(line_id, line_boards):
             """Helper function to get a line of boards containing a line
 
             Args:
-                line: Error line to search for
+                line_id: ID of error line to search for
+                line_boards: Dict of the bitset of boards with each line
             Return:
                 String containing a list of boards with that error line, or
                 '' if the user has not requested such a list
             """
             if self._list_error_boards:
-                names = []
-                for board in line_boards[line]:
-                    if not board.target in names:
-                        names.append(board.target)
+                names = self._board_bits.GetTargets(line_boards[line_id])
                 names_str = '(%s) ' % ','.join(names)
             else:
                 names_str = ''
@@ -1130,14 +1534,18 @@ class Builder:
                             char):
             better_lines = []
             worse_lines = []
-            for line in lines:
-                if line not in base_lines:
+            base_set = set(base_lines)
+            line_set = set(lines)
+            for line_id in lines:
+                if line_id not in base_set:
                     worse_lines.append(char + '+' +
-                            _BoardList(line, line_boards) + line)
-            for line in base_lines:
-                if line not in lines:
+                            _BoardList(line_id, line_boards) +
+                            self._line_table.GetLine(line_id))
+            for line_id in base_lines:
+                if line_id not in line_set:
                     better_lines.append(char + '-' +
-                            _BoardList(line, base_line_boards) + line)
+                            _BoardList(line_id, base_line_boards) +
+                            self._line_table.GetLine(line_id))
             return better_lines, worse_lines
 
         def _CalcConfig(delta, name, config):
@@ -1433,12 +1841,132 @@ class Builder:
         self.ResetResultSummary(board_selected)
         self._error_lines = 0
 
-        for commit_upto in range(0, self.commit_count, self._step):
+        commit_uptos = range(0, self.commit_count, self._step)
+        if not self._use_result_db:
+            self._ReadOutcomes(commit_uptos, board_selected)
+        for commit_upto in commit_uptos:
             self.ProduceResultSummary(commit_upto, commits, board_selected)
+        if self._result_db:
+            self._result_db.Flush()
         if not self._error_lines:
             Print('(no errors to report)', colour=self.col.GREEN)
 
 
+    def ReadTiming(self, commit_upto, target):
+        """Read the time taken by each stage of a build
+
+        Args:
+            commit_upto: Commit number to read (0..n-1)
+            target: Target board to read
+
+        Returns:
+            Dict of the time taken by each stage in seconds, keyed by stage
+            name (see builderthread.TIMING_STAGES), or None if there is no
+            timing information for the build
+        """
+        fname = self.GetTimingFile(commit_upto, target)
+        if not os.path.exists(fname):
+            return None
+        timing = {}
+        with open(fname) as fd:
+            for line in fd:
+                fields = line.split()
+                if len(fields) == 2:
+                    timing[fields[0]] = float(fields[1])
+        return timing
+
+    def ShowTimingReport(self, commits, board_selected, top):
+        """Show how long the builds took, by stage and by board
+
+        This shows the total time spent in each stage of the builds (git
+        checkout, make mrproper, etc.) followed by the boards which took
+        longest to build, over all commits.
+
+        Args:
+            commits: Commit objects to report on
+            board_selected: Dict containing boards to report on
+            top: Number of boards to show
+        """
+        self.commit_count = len(commits) if commits else 1
+        self.commits = commits
+        stages = builderthread.TIMING_STAGES
+        stage_totals = dict((stage, 0.0) for stage in stages)
+        board_totals = {}
+        builds = 0
+        for commit_upto in range(0, self.commit_count, self._step):
+            for target in board_selected:
+                timing = self.ReadTiming(commit_upto, target)
+                if timing is None:
+                    continue
+                builds += 1
+                board_timing = board_totals.setdefault(target, {})
+                for stage, seconds in timing.iteritems():
+                    stage_totals[stage] = stage_totals.get(stage, 0) + seconds
+                    board_timing[stage] = board_timing.get(stage, 0) + seconds
+        if not builds:
+            Print('(no build timing to report)', colour=self.col.GREEN)
+            return
+
+        total = sum(stage_totals.values())
+        Print('Time taken by %d build%s:' % (builds,
+                                             's' if builds != 1 else ''),
+              colour=self.col.BLUE)
+        for stage in stages:
+            percent = 100.0 * stage_totals[stage] / total if total else 0
+            Print('   %-10s %10.1fs %5.1f%%' % (stage, stage_totals[stage],
+                                              percent))
+        Print('   %-10s %10.1fs' % ('total', total))
+
+        slowest = sorted(board_totals.iteritems(),
+                         key=lambda item: (-sum(item[1].values()), item[0]))
+        slowest = slowest[:top]
+        Print('Slowest board%s:' % ('s' if len(slowest) != 1 else ''),
+              colour=self.col.BLUE)
+        Print('   %-20s %9s' % ('board', 'total') +
+              ''.join([' %9s' % stage for stage in stages]))
+        for target, timing in slowest:
+            Print('   %-20s %9.1f' % (target, sum(timing.values())) +
+                  ''.join([' %9.1f' % timing.get(stage, 0)
+                           for stage in stages]))
+
+    def ExtractOutputs(self, commits, board_selected, dest_dir):
+        """Write out the output files of some builds, e.g. images kept by -k
+
+        Each build is written to a directory within dest_dir with the same
+        name as its build directory within the output directory. This
+        includes files stored with --archive as well as plain files.
+
+        Args:
+            commits: Commit objects to extract
+            board_selected: Dict containing boards to extract
+            dest_dir: Directory to write the builds to
+
+        Returns:
+            Number of builds written
+        """
+        self.commit_count = len(commits) if commits else 1
+        self.commits = commits
+        builds = 0
+        for commit_upto in range(0, self.commit_count, self._step):
+            for target in sorted(board_selected):
+                build_dir = self.GetBuildDir(commit_upto, target)
+                if not os.path.isdir(build_dir):
+                    continue
+                out_dir = os.path.join(dest_dir,
+                        os.path.relpath(build_dir, self.base_dir))
+                builderthread.Mkdir(out_dir, parents = True)
+                for fname in os.listdir(build_dir):
+                    pathname = os.path.join(build_dir, fname)
+                    if (fname != archive.MANIFEST_FNAME and
+                            os.path.isfile(pathname)):
+                        shutil.copy2(pathname, out_dir)
+                self.archive.Extract(build_dir, out_dir)
+                builds += 1
+        Print('Extracted %d build%s to %s' % (builds,
+                                              's' if builds != 1 else '',
+                                              dest_dir))
+        return builds
+
     def SetupBuild(self, board_selected, commits):
         """Set up ready to start a build.
 
@@ -1449,9 +1977,60 @@ class Builder:
         # First work out how many commits we will build
         count = (self.commit_count + self._step - 1) / self._step
         self.count = len(board_selected) * count
-        self.upto = self.warned = self.fail = 0
+        self.upto = self.warned = self.fail = self.carried_over = 0
         self._timestamps = collections.deque()
 
+    def _ReadConfigInputs(self, commit_upto):
+        """Read the inputs to the configuration from a commit's tree
+
+        Args:
+            commit_upto: Commit number to use (0..self.count-1)
+
+        Returns:
+            Tuple:
+                Hash of the Kconfig files and the kconfig tool, as a string
+                Dict of the object hash of each file in the configs/
+                    directory, keyed by filename
+        """
+        commit = self.commits[commit_upto]
+        kconfig = hashlib.sha1()
+        defconfigs = {}
+        for obj_hash, fname in gitutil.ListTree(self.git_dir, commit.hash):
+            if fname.startswith('configs/'):
+                defconfigs[fname] = obj_hash
+            elif RE_CONFIG_INPUT.match(fname):
+                kconfig.update('%s %s\n' % (obj_hash, fname))
+        return kconfig.hexdigest(), defconfigs
+
+    def GetConfigHash(self, commit_upto, brd, toolchain):
+        """Get a hash of the inputs to the configuration of a board
+
+        This covers the Kconfig files, the kconfig tool itself, the board's
+        defconfig and the toolchain and its arguments. If the hash is the
+        same for two commits, configuring the board for one gives the same
+        result as for the other, so it is not necessary to reconfigure.
+
+        Args:
+            commit_upto: Commit number to use (0..self.count-1)
+            brd: Board object to configure
+            toolchain: Toolchain object to use
+
+        Returns:
+            Hash as a string of hex digits
+        """
+        with self._config_lock:
+            inputs = self._config_inputs.get(commit_upto)
+            if inputs is None:
+                inputs = self._ReadConfigInputs(commit_upto)
+                self._config_inputs[commit_upto] = inputs
+        kconfig, defconfigs = inputs
+        defconfig = defconfigs.get('configs/%s_defconfig' % brd.target, '')
+        config_hash = hashlib.sha1()
+        for item in [kconfig, defconfig, toolchain.gcc,
+                     ' '.join(self.toolchains.GetMakeArguments(brd))]:
+            config_hash.update(item + '\n')
+        return config_hash.hexdigest()
+
     def GetThreadDir(self, thread_num):
         """Get the directory path to the working dir for a thread.
 
@@ -1464,38 +2043,71 @@ class Builder:
         """Prepare the working directory for a thread.
 
         This clones or fetches the repo into the thread's work directory.
+        Where possible a git worktree is used instead of a clone, so that all
+        threads share the object store of the source repo.
 
         Args:
             thread_num: Thread number (0, 1, ...)
-            setup_git: True to set up a git repo clone
+            setup_git:
+               'worktree' to set up a git worktree
+               'clone' to set up a git clone
+               None to skip git setup
         """
         thread_dir = self.GetThreadDir(thread_num)
         builderthread.Mkdir(thread_dir)
         git_dir = os.path.join(thread_dir, '.git')
 
-        # Clone the repo if it doesn't already exist
-        # TODO(sjg@chromium): Perhaps some git hackery to symlink instead, so
-        # we have a private index but uses the origin repo's contents?
+        # Create a worktree or a git repo clone for this thread if it
+        # doesn't already exist
         if setup_git and self.git_dir:
             src_dir = os.path.abspath(self.git_dir)
-            if os.path.exists(git_dir):
+            if os.path.isdir(git_dir):
+                # This is a clone of the src_dir repo, we can keep using
+                # it but need to fetch from src_dir.
                 gitutil.Fetch(git_dir, thread_dir)
-            else:
+            elif os.path.isfile(git_dir):
+                # This is a worktree of the src_dir repo, we don't need to
+                # create it again or update it in any way.
+                pass
+            elif os.path.exists(git_dir):
+                # Don't know what could trigger this, but we probably
+                # can't create a git worktree/clone here.
+                raise ValueError('Git dir %s exists, but is not a file '
+                                 'or a directory.' % git_dir)
+            elif setup_git == 'worktree':
+                Print('\rChecking out worktree for thread %d' % thread_num,
+                      newline=False)
+                gitutil.AddWorktree(src_dir, thread_dir)
+                Print('\r%s\r' % (' ' * 40), newline=False)
+            elif setup_git == 'clone':
                 Print('\rCloning repo for thread %d' % thread_num,
                       newline=False)
                 gitutil.Clone(src_dir, thread_dir)
-                Print('\r%s\r' % (' ' * 30), newline=False)
+                Print('\r%s\r' % (' ' * 40), newline=False)
+            else:
+                raise ValueError("Can't setup git repo with %s." % setup_git)
 
     def _PrepareWorkingSpace(self, max_threads, setup_git):
         """Prepare the working directory for use.
 
-        Set up the git repo for each thread.
+        Set up the git repo for each thread. Creates a linked working tree
+        if git-worktree is available, or clones the repo if it isn't.
 
         Args:
             max_threads: Maximum number of threads we expect to need.
-            setup_git: True to set up a git repo clone
+            setup_git: True to set up a git worktree or a git clone
         """
         builderthread.Mkdir(self._working_dir)
+        if setup_git and self.git_dir:
+            src_dir = os.path.abspath(self.git_dir)
+            if gitutil.CheckWorktreeIsAvailable(src_dir):
+                setup_git = 'worktree'
+                # If we previously added a worktree but the directory for it
+                # got deleted, we need to prune its files from the repo so
+                # that we can check out another in its place.
+                gitutil.PruneWorktrees(src_dir)
+            else:
+                setup_git = 'clone'
         for thread in range(max_threads):
             self._PrepareThread(thread, setup_git)
 
@@ -1522,6 +2134,25 @@ class Builder:
             for dirname in to_remove:
                 shutil.rmtree(dirname)
 
+    def _ShowIdleTime(self, start_time, end_time):
+        """Show how long builder threads were idle at the end of the build
+
+        Once there are no more jobs to start, threads become idle one by one
+        until the last job finishes. This shows the total of that idle time.
+
+        Args:
+            start_time: Time when the build started (from time.time())
+            end_time: Time when the build finished (from time.time())
+        """
+        total = (end_time - start_time) * self.num_threads
+        if total <= 0:
+            return
+        idle = 0
+        for t in self.threads[:self.num_threads]:
+            idle += end_time - max(t.job_end_time or start_time, start_time)
+        Print('Tail idle time: %.1fs across %d threads (%.1f%% of thread '
+              'time)' % (idle, self.num_threads, 100.0 * idle / total))
+
     def BuildBoards(self, commits, board_selected, keep_outputs, verbose):
         """Build all commits for a list of boards
 
@@ -1545,12 +2176,30 @@ class Builder:
         self._PrepareWorkingSpace(min(self.num_threads, len(board_selected)),
                 commits is not None)
         self._PrepareOutputSpace()
+        self.build_times = buildtimes.BuildTimes(os.path.join(self.base_dir,
+                                                              '.bm-times'))
+        if self.monitor:
+            self.monitor.Start()
+        if self.skip_unaffected and commits:
+            self.affected = affected.AffectedChecker(self.git_dir)
+        if self.compiler_cache:
+            cache_stats = self.compiler_cache.GetStats()
         Print('\rStarting build...', newline=False)
         self.SetupBuild(board_selected, commits)
+        if self.events:
+            self.events.Write('start', builds=self.count,
+                              boards=len(board_selected),
+                              commits=self.commit_count)
         self.ProcessResult(None)
 
-        # Create jobs to build all commits for each board
-        for brd in board_selected.itervalues():
+        # Create jobs to build all commits for each board. Start with the
+        # boards which take longest to build, so that they don't hold up the
+        # end of the build.
+        brds = board_selected.values()
+        estimate = self.build_times.Estimate(brds)
+        brds.sort(key=lambda brd: estimate[brd.target], reverse=True)
+        start_time = time.time()
+        for brd in brds:
             job = builderthread.BuilderJob()
             job.board = brd
             job.commits = commits
@@ -1558,6 +2207,38 @@ class Builder:
             job.step = self._step
             self.queue.put(job)
 
+        try:
+            self._WaitForJobs()
+        finally:
+            if self.monitor:
+                self.monitor.Stop()
+        if self._result_db:
+            self._result_db.Flush()
+        self.build_times.Save()
+        Print()
+        self.ClearLine(0)
+        if self.num_threads > 1:
+            self._ShowIdleTime(start_time, time.time())
+        if self.carried_over:
+            Print('%d build%s skipped as the commit did not affect the board' %
+                  (self.carried_over, 's' if self.carried_over != 1 else ''))
+        if self.compiler_cache:
+            summary = self.compiler_cache.GetStatsSummary(cache_stats,
+                    self.compiler_cache.GetStats())
+            if summary:
+                Print(summary)
+        if self.monitor:
+            summary = self.monitor.GetSummary()
+            if summary:
+                Print(summary)
+        if self.events:
+            self.events.Write('end', ok=self.upto - self.warned - self.fail,
+                              warned=self.warned, failed=self.fail)
+        return (self.fail, self.warned)
+
+    def _WaitForJobs(self):
+        """Wait until all queued jobs are built and their results processed"""
+        # Wait in a separate thread so that we can still handle Ctrl-C
         term = threading.Thread(target=self.queue.join)
         term.setDaemon(True)
         term.start()
@@ -1566,6 +2247,138 @@ class Builder:
 
         # Wait until we have processed all output
         self.out_queue.join()
+
+    def _GetBisectValue(self, commit_upto, target, metric):
+        """Get the value of a size metric for a build
+
+        Args:
+            commit_upto: Commit number to check (0..n-1)
+            target: Target board to check
+            metric: Size metric (see BISECT_METRICS), or 'func:<name>' for
+                the size of a function
+
+        Returns:
+            Tuple:
+                Size in bytes, or None if the build failed
+                Outcome object for the build
+        """
+        outcome = self.GetBuildOutcome(commit_upto, target, True, False,
+                                       False)
+        if outcome.rc not in [OUTCOME_OK, OUTCOME_WARNING]:
+            return None, outcome
+        if metric.startswith('func:'):
+            func_sizes = outcome.func_sizes.get('u-boot')
+            if func_sizes is None:
+                return None, outcome
+            return func_sizes.get(metric[5:], 0), outcome
+        sizes = outcome.sizes.get('u-boot')
+        if not sizes:
+            return None, outcome
+        return sizes[metric], outcome
+
+    def BisectSize(self, commits, brd, metric, threshold):
+        """Find the first commit which increases a board's size too much
+
+        Starting from the first commit, this looks for the first commit
+        where the size metric has grown by at least the threshold. It is
+        assumed that once the size has grown, it stays that way, so only
+        a few commits need to be built. Each round builds up to one commit
+        per thread, spread across the remaining range. Commits which fail to
+        build are skipped.
+
+        Args:
+            commits: List of Commit objects to check, oldest first
+            brd: Board object to build
+            metric: Size metric (see BISECT_METRICS), or 'func:<name>' for
+                the size of a function
+            threshold: Growth in bytes which counts as a regression
+
+        Returns:
+            Commit number of the first commit with the regression, or None if
+            there is none
+        """
+        self.commit_count = len(commits)
+        self.commits = commits
+        self._verbose = False
+        board_selected = {brd.target: brd}
+        builderthread.Mkdir(self.base_dir, parents = True)
+        self._PrepareWorkingSpace(self.num_threads, True)
+        self._PrepareOutputSpace()
+        self.SetupBuild(board_selected, commits)
+        self.count = 2
+        rounds = len(commits)
+        while rounds > 2:
+            self.count += min(self.num_threads, rounds - 2)
+            rounds = (rounds - 2) / (self.num_threads + 1) + 2
+        self.ProcessResult(None)
+
+        values = {}
+        def _Build(commit_uptos):
+            for commit_upto in commit_uptos:
+                job = builderthread.BuilderJob()
+                job.board = brd
+                job.commits = commits
+                job.commit_uptos = [commit_upto]
+                job.keep_outputs = False
+                job.step = 1
+                self.queue.put(job)
+            self._WaitForJobs()
+            for commit_upto in commit_uptos:
+                values[commit_upto] = self._GetBisectValue(commit_upto,
+                                                           brd.target, metric)
+
+        lo, hi = 0, len(commits) - 1
+        _Build([lo, hi])
         Print()
         self.ClearLine(0)
-        return (self.fail, self.warned)
+        base, base_outcome = values[lo]
+        if base is None:
+            Print('Cannot find %s size for %s at the first commit' %
+                  (metric, brd.target), colour=self.col.RED)
+            return None
+        if values[hi][0] is None or values[hi][0] - base < threshold:
+            Print('No commit increases %s size of %s by %d bytes or more' %
+                  (metric, brd.target, threshold), colour=self.col.GREEN)
+            return None
+
+        skipped = set()
+        while True:
+            candidates = [commit_upto for commit_upto in range(lo + 1, hi)
+                          if commit_upto not in skipped]
+            if not candidates:
+                break
+            num_probes = min(self.num_threads, len(candidates))
+            probes = [candidates[(i + 1) * len(candidates) / (num_probes + 1)]
+                      for i in range(num_probes)]
+            _Build(probes)
+            for commit_upto in probes:
+                value = values[commit_upto][0]
+                if value is None:
+                    skipped.add(commit_upto)
+                elif value - base >= threshold:
+                    hi = commit_upto
+                    break
+                else:
+                    lo = commit_upto
+        Print()
+        self.ClearLine(0)
+
+        value, outcome = values[hi]
+        prev_value, prev_outcome = values[lo]
+        commit = commits[hi]
+        Print('%02d: %s' % (hi + 1, commit.subject), colour=self.col.BLUE)
+        Print('   %s size of %s: %d -> %d bytes (%+d), %+d bytes since the '
+              'first commit' % (metric, brd.target, prev_value, value,
+                                value - prev_value, value - base),
+              colour=self.col.RED)
+        if hi - lo == 2:
+            Print('   Commit %02d could not be built, so may be the cause' %
+                  (lo + 2), colour=self.col.YELLOW)
+        elif hi - lo > 2:
+            Print('   Commits %02d to %02d could not be built, so may be the '
+                  'cause' % (lo + 2, hi), colour=self.col.YELLOW)
+        old = prev_outcome.func_sizes.get('u-boot')
+        new = outcome.func_sizes.get('u-boot')
+        if old is not None and new is not None:
+            self.PrintFuncSizeDetail('u-boot', old, new)
+        return hi
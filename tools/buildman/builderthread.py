@@ -5,15 +5,34 @@
 import errno
 import glob
 import os
+import re
 import shutil
 import sys
 import threading
+import time
 
 import command
+import elfreader
 import gitutil
 
 RETURN_CODE_RETRY = -1
 
+# Stages of a build which are timed, in the order they happen
+TIMING_STAGES = ['checkout', 'mrproper', 'config', 'build', 'sizes', 'copy']
+
+# File in the output directory holding the hash of the configuration inputs
+# when it was last configured (see Builder.GetConfigHash())
+CONFIG_HASH_FNAME = '.buildman_config_hash'
+
+# A compiler diagnostic: filename, line, optional column, type of diagnostic
+RE_DIAGNOSTIC = re.compile(r'(.*?):\d+:(?:\d+:)? (warning|error): ')
+
+# Source files for which an object file is built in the same directory
+OBJECT_SOURCE_EXTS = ['.c', '.S']
+
+# Subdirectories of the output directory which hold SPL and TPL objects
+OBJECT_SUBDIRS = ['', 'spl', 'tpl']
+
 def Mkdir(dirname, parents = False):
     """Make a directory if it doesn't already exist.
 
@@ -34,16 +53,33 @@ def Mkdir(dirname, parents = False):
         else:
             raise
 
+def ReadConfigHash(fname):
+    """Read the hash of the configuration inputs for an output directory
+
+    Args:
+        fname: Filename of the hash file (see CONFIG_HASH_FNAME)
+
+    Returns:
+        Hash as a string, or None if there is none
+    """
+    if not os.path.exists(fname):
+        return None
+    with open(fname) as fd:
+        return fd.read().strip()
+
 class BuilderJob:
     """Holds information about a job to be performed by a thread
 
     Members:
         board: Board object to build
         commits: List of commit options to build.
+        commit_uptos: List of commit numbers to build, or None to build
+            every job.step commits
     """
     def __init__(self):
         self.board = None
         self.commits = []
+        self.commit_uptos = None
 
 
 class ResultThread(threading.Thread):
@@ -82,6 +118,12 @@ class BuilderThread(threading.Thread):
         builder: The builder which contains information we might need
         thread_num: Our thread number (0-n-1), used to decide on a
                 temporary directory
+        tmpfs_dir: Output directory provided by builder.tmpfs for the
+                current job, or None to use a directory on disk
+        checked_out: Hash of the commit checked out in our working directory,
+                or None if not known
+        timing: Dict of the time spent in each stage of the current build in
+                seconds, keyed by stage name (see TIMING_STAGES)
     """
     def __init__(self, builder, thread_num, incremental, per_board_out_dir):
         """Set up a new builder thread"""
@@ -90,6 +132,10 @@ class BuilderThread(threading.Thread):
         self.thread_num = thread_num
         self.incremental = incremental
         self.per_board_out_dir = per_board_out_dir
+        self.job_end_time = None
+        self.tmpfs_dir = None
+        self.checked_out = None
+        self.timing = {}
 
     def Make(self, commit, brd, stage, cwd, *args, **kwargs):
         """Run 'make' on a particular commit and board.
@@ -110,11 +156,55 @@ class BuilderThread(threading.Thread):
         Returns:
             CommandResult object
         """
-        return self.builder.do_make(commit, brd, stage, cwd, *args,
-                **kwargs)
+        jobserver = self.builder.jobserver
+        if jobserver:
+            jobserver.Acquire()
+        start_time = time.time()
+        try:
+            return self.builder.do_make(commit, brd, stage, cwd, *args,
+                    **kwargs)
+        finally:
+            self.AddTime(stage, start_time)
+            if jobserver:
+                jobserver.Release()
+
+    def AddTime(self, stage, start_time):
+        """Add the time taken by a stage of the build to self.timing
+
+        Args:
+            stage: Name of stage (see TIMING_STAGES)
+            start_time: Time when the stage started
+        """
+        self.timing[stage] = (self.timing.get(stage, 0) + time.time() -
+                              start_time)
+
+    def CheckoutCommit(self, commit_hash, work_dir):
+        """Check out a commit in our working directory
+
+        With builder.fast_checkout, only the files which differ from the
+        commit we last checked out are written, so that make does not rebuild
+        objects whose sources are unchanged. If that fails, or we don't know
+        what is checked out, a forced checkout is done instead.
+
+        Args:
+            commit_hash: Hash of the commit to check out
+            work_dir: Directory to which the source will be checked out
+        """
+        git_dir = os.path.join(work_dir, '.git')
+        old_hash = self.checked_out
+        self.checked_out = None
+        if self.builder.fast_checkout and old_hash:
+            try:
+                gitutil.FastCheckout(old_hash, commit_hash, git_dir, work_dir)
+                self.checked_out = commit_hash
+                return
+            except OSError:
+                pass
+        gitutil.Checkout(commit_hash, git_dir, work_dir, force=True)
+        self.checked_out = commit_hash
 
     def RunCommit(self, commit_upto, brd, work_dir, do_config, config_only,
-                  force_build, force_build_failures):
+                  force_build, force_build_failures, check_config=False):
         """Build a particular commit.
 
         If the build is already done, and we are not forcing a build, we skip
@@ -129,6 +219,9 @@ class BuilderThread(threading.Thread):
             force_build: Force a build even if one was previously done
             force_build_failures: Force a bulid if the previous result showed
                 failure
+            check_config: True to skip configuring (even if do_config is
+                True) if the inputs to the configuration have not changed
+                since the output directory was last configured
 
         Returns:
             tuple containing:
@@ -146,11 +239,14 @@ class BuilderThread(threading.Thread):
                 out_rel_dir = os.path.join('..', brd.target)
             else:
                 out_rel_dir = 'build'
+            if self.tmpfs_dir:
+                out_rel_dir = self.tmpfs_dir
             out_dir = os.path.join(work_dir, out_rel_dir)
 
         # Check if the job was already completed last time
         done_file = self.builder.GetDoneFile(commit_upto, brd.target)
         result.already_done = os.path.exists(done_file)
+        result.carried_over = False
         will_build = (force_build or force_build_failures or
             not result.already_done)
         if result.already_done:
@@ -186,14 +282,13 @@ class BuilderThread(threading.Thread):
                 if self.builder.commits:
                     commit = self.builder.commits[commit_upto]
                     if self.builder.checkout:
-                        git_dir = os.path.join(work_dir, '.git')
-                        gitutil.Checkout(commit.hash, git_dir, work_dir,
-                                         force=True)
+                        start_time = time.time()
+                        self.CheckoutCommit(commit.hash, work_dir)
+                        self.AddTime('checkout', start_time)
                 else:
                     commit = 'current'
 
-                # Set up the environment and command line
-                env = self.toolchain.MakeEnvironment(self.builder.full_path)
+                # Set up the command line
                 Mkdir(out_dir)
                 args = []
                 cwd = work_dir
@@ -213,11 +308,22 @@ class BuilderThread(threading.Thread):
                         src_dir = os.getcwd()
                     else:
                         args.append('O=%s' % out_rel_dir)
+
+                # Set up the environment. A compiler cache is shared between
+                # threads by making paths relative to a directory containing
+                # both the source and the output
+                cache_dir = os.path.dirname(os.path.commonprefix(
+                        [src_dir + '/', os.path.realpath(out_dir) + '/']))
+                env = self.toolchain.MakeEnvironment(self.builder.full_path,
+                        self.builder.compiler_cache, cache_dir)
+                if self.builder.jobserver:
+                    self.builder.jobserver.AddToEnvironment(env)
                 if self.builder.verbose_build:
                     args.append('V=1')
                 else:
                     args.append('-s')
-                if self.builder.num_jobs is not None:
+                if (self.builder.num_jobs is not None and
+                        not self.builder.jobserver):
                     args.extend(['-j', str(self.builder.num_jobs)])
                 if self.builder.warnings_as_errors:
                     args.append('KCFLAGS=-Werror')
@@ -225,9 +331,22 @@ class BuilderThread(threading.Thread):
                 config_out = ''
                 args.extend(self.builder.toolchains.GetMakeArguments(brd))
 
+                # Avoid reconfiguring if nothing has changed
+                config_hash = None
+                if (do_config and self.builder.config_hash and
+                        commit_upto is not None):
+                    config_hash = self.builder.GetConfigHash(commit_upto, brd,
+                                                             self.toolchain)
+                    hash_fname = os.path.join(out_dir, CONFIG_HASH_FNAME)
+                    if (check_config and
+                            ReadConfigHash(hash_fname) == config_hash):
+                        do_config = False
+
                 # If we need to reconfigure, do that now
                 if do_config:
                     config_out = ''
+                    if config_hash and os.path.exists(hash_fname):
+                        os.remove(hash_fname)
                     if not self.incremental:
                         result = self.Make(commit, brd, 'mrproper', cwd,
                                 'mrproper', *args, env=env)
@@ -235,6 +354,9 @@ class BuilderThread(threading.Thread):
                     result = self.Make(commit, brd, 'config', cwd,
                             *(args + config_args), env=env)
                     config_out += result.combined
+                    if config_hash and result.return_code == 0:
+                        with open(hash_fname, 'w') as fd:
+                            print >>fd, config_hash
                     do_config = False   # No need to configure next time
                 if result.return_code == 0:
                     if config_only:
@@ -282,11 +404,14 @@ class BuilderThread(threading.Thread):
                 result.brd.target)
         Mkdir(build_dir)
 
-        outfile = os.path.join(build_dir, 'log')
-        with open(outfile, 'w') as fd:
-            if result.stdout:
-                # We don't want unicode characters in log files
-                fd.write(result.stdout.decode('UTF-8').encode('ASCII', 'replace'))
+        # Files stored in the archive, keyed by name, if enabled
+        archived = {} if self.builder.archive_outputs else None
+
+        log = ''
+        if result.stdout:
+            # We don't want unicode characters in log files
+            log = result.stdout.decode('UTF-8').encode('ASCII', 'replace')
+        self._WriteOutputFile(os.path.join(build_dir, 'log'), log, archived)
 
         errfile = self.builder.GetErrFile(result.commit_upto,
                 result.brd.target)
@@ -315,51 +440,30 @@ class BuilderThread(threading.Thread):
                 fd.write('%s' % result.return_code)
 
             # Write out the image and function size information and an objdump
+            start_time = time.time()
             env = result.toolchain.MakeEnvironment(self.builder.full_path)
             lines = []
             for fname in ['u-boot', 'spl/u-boot-spl']:
-                cmd = ['%snm' % self.toolchain.cross, '--size-sort', fname]
-                nm_result = command.RunPipe([cmd], capture=True,
-                        capture_stderr=True, cwd=result.out_dir,
-                        raise_on_error=False, env=env)
-                if nm_result.stdout:
+                nm_out, dump_out, size_line, rodata_size = self._GetElfInfo(
+                        result.out_dir, fname, env)
+                if nm_out:
                     nm = self.builder.GetFuncSizesFile(result.commit_upto,
                                     result.brd.target, fname)
-                    with open(nm, 'w') as fd:
-                        print >>fd, nm_result.stdout,
-
-                cmd = ['%sobjdump' % self.toolchain.cross, '-h', fname]
-                dump_result = command.RunPipe([cmd], capture=True,
-                        capture_stderr=True, cwd=result.out_dir,
-                        raise_on_error=False, env=env)
-                rodata_size = ''
-                if dump_result.stdout:
+                    self._WriteOutputFile(nm, nm_out, archived)
+                if dump_out:
                     objdump = self.builder.GetObjdumpFile(result.commit_upto,
                                     result.brd.target, fname)
-                    with open(objdump, 'w') as fd:
-                        print >>fd, dump_result.stdout,
-                    for line in dump_result.stdout.splitlines():
-                        fields = line.split()
-                        if len(fields) > 5 and fields[1] == '.rodata':
-                            rodata_size = fields[2]
-
-                cmd = ['%ssize' % self.toolchain.cross, fname]
-                size_result = command.RunPipe([cmd], capture=True,
-                        capture_stderr=True, cwd=result.out_dir,
-                        raise_on_error=False, env=env)
-                if size_result.stdout:
-                    lines.append(size_result.stdout.splitlines()[1] + ' ' +
-                                 rodata_size)
+                    self._WriteOutputFile(objdump, dump_out, archived)
+                if size_line:
+                    lines.append(size_line + ' ' + rodata_size)
 
             # Extract the environment from U-Boot and dump it out
-            cmd = ['%sobjcopy' % self.toolchain.cross, '-O', 'binary',
-                   '-j', '.rodata.default_environment',
-                   'env/built-in.o', 'uboot.env']
-            command.RunPipe([cmd], capture=True,
-                            capture_stderr=True, cwd=result.out_dir,
-                            raise_on_error=False, env=env)
-            ubootenv = os.path.join(result.out_dir, 'uboot.env')
-            self.CopyFiles(result.out_dir, build_dir, '', ['uboot.env'])
+            self._ExtractEnv(result.out_dir, env)
+            self.AddTime('sizes', start_time)
+            start_time = time.time()
+            self.CopyFiles(result.out_dir, build_dir, '', ['uboot.env'],
+                           archived)
+            self.AddTime('copy', start_time)
 
             # Write out the image sizes file. This is similar to the output
             # of binutil's 'size' utility, but it omits the header line and
@@ -372,18 +476,146 @@ class BuilderThread(threading.Thread):
                     print >>fd, '\n'.join(lines)
 
         # Write out the configuration files, with a special case for SPL
+        start_time = time.time()
         for dirname in ['', 'spl', 'tpl']:
             self.CopyFiles(result.out_dir, build_dir, dirname, ['u-boot.cfg',
                 'spl/u-boot-spl.cfg', 'tpl/u-boot-tpl.cfg', '.config',
-                'include/autoconf.mk', 'include/generated/autoconf.h'])
+                'include/autoconf.mk', 'include/generated/autoconf.h'],
+                archived)
 
         # Now write the actual build output
         if keep_outputs:
             self.CopyFiles(result.out_dir, build_dir, '', ['u-boot*', '*.bin',
                 '*.map', '*.img', 'MLO', 'SPL', 'include/autoconf.mk',
-                'spl/u-boot-spl*'])
+                'spl/u-boot-spl*'], archived)
+        if archived is not None:
+            self.builder.archive.WriteManifest(build_dir, archived)
+        else:
+            self.builder.archive.RemoveManifest(build_dir)
+        self.AddTime('copy', start_time)
+
+        # Record how long each stage took
+        with open(self.builder.GetTimingFile(result.commit_upto,
+                                             result.brd.target), 'w') as fd:
+            for stage in TIMING_STAGES:
+                if stage in self.timing:
+                    print >>fd, '%s %.3f' % (stage, self.timing[stage])
+
+    def _GetElfInfo(self, out_dir, fname, env):
+        """Get size information about an ELF file produced by the build
 
-    def CopyFiles(self, out_dir, build_dir, dirname, patterns):
+        The file is read directly where possible. If it cannot be read (e.g.
+        because it is not a valid ELF file), the toolchain's nm, objdump and
+        size tools are used instead.
+
+        Args:
+            out_dir: Output directory for the build
+            fname: Filename of ELF file, relative to out_dir
+            env: Environment to use when running the toolchain
+
+        Returns:
+            Tuple:
+                Function sizes, as output by 'nm --size-sort' ('' if none)
+                Section list, as output by 'objdump -h' ('' if none)
+                Sizes line, as output by 'size' but without the header line
+                    ('' if none)
+                Size of the .rodata section as a hex string ('' if none)
+        """
+        pathname = os.path.join(out_dir, fname)
+        if not os.path.exists(pathname):
+            return '', '', '', ''
+        try:
+            elf = elfreader.ElfFile(pathname)
+        except ValueError:
+            return self._GetElfInfoWithTools(out_dir, fname, env)
+        try:
+            size_line, rodata = elf.GetSizes(fname)
+            return (elf.GetFuncSizes(), elf.GetSectionHeaders(fname), size_line,
+                    '%08x' % rodata if rodata is not None else '')
+        finally:
+            elf.Close()
+
+    def _GetElfInfoWithTools(self, out_dir, fname, env):
+        """Get size information about an ELF file using the toolchain
+
+        Args:
+            out_dir: Output directory for the build
+            fname: Filename of ELF file, relative to out_dir
+            env: Environment to use when running the toolchain
+
+        Returns:
+            Tuple, see _GetElfInfo()
+        """
+        cmd = ['%snm' % self.toolchain.cross, '--size-sort', fname]
+        nm_result = command.RunPipe([cmd], capture=True,
+                capture_stderr=True, cwd=out_dir,
+                raise_on_error=False, env=env)
+
+        cmd = ['%sobjdump' % self.toolchain.cross, '-h', fname]
+        dump_result = command.RunPipe([cmd], capture=True,
+                capture_stderr=True, cwd=out_dir,
+                raise_on_error=False, env=env)
+        rodata_size = ''
+        if dump_result.stdout:
+            for line in dump_result.stdout.splitlines():
+                fields = line.split()
+                if len(fields) > 5 and fields[1] == '.rodata':
+                    rodata_size = fields[2]
+
+        cmd = ['%ssize' % self.toolchain.cross, fname]
+        size_result = command.RunPipe([cmd], capture=True,
+                capture_stderr=True, cwd=out_dir,
+                raise_on_error=False, env=env)
+        size_line = ''
+        if size_result.stdout:
+            size_line = size_result.stdout.splitlines()[1]
+        return (nm_result.stdout or '', dump_result.stdout or '', size_line,
+                rodata_size)
+
+    def _ExtractEnv(self, out_dir, env):
+        """Extract the default environment from the build into uboot.env
+
+        Args:
+            out_dir: Output directory for the build
+            env: Environment to use when running the toolchain
+        """
+        obj_fname = os.path.join(out_dir, 'env/built-in.o')
+        if not os.path.exists(obj_fname):
+            return
+        try:
+            elf = elfreader.ElfFile(obj_fname)
+        except ValueError:
+            cmd = ['%sobjcopy' % self.toolchain.cross, '-O', 'binary',
+                   '-j', '.rodata.default_environment',
+                   'env/built-in.o', 'uboot.env']
+            command.RunPipe([cmd], capture=True,
+                            capture_stderr=True, cwd=out_dir,
+                            raise_on_error=False, env=env)
+            return
+        try:
+            data = elf.GetSectionData('.rodata.default_environment')
+        finally:
+            elf.Close()
+        with open(os.path.join(out_dir, 'uboot.env'), 'wb') as fd:
+            fd.write(data or '')
+
+    def _WriteOutputFile(self, fname, data, archived):
+        """Write a file to the build directory, or to the archive
+
+        Args:
+            fname: Path to the file in the build directory
+            data: Contents of the file
+            archived: Dict of files stored in the archive, keyed by name, to
+                which the file is added, or None to write the file itself
+        """
+        if archived is not None:
+            archived[os.path.basename(fname)] = (
+                    self.builder.archive.StoreData(data))
+        else:
+            with open(fname, 'w') as fd:
+                fd.write(data)
+
+    def CopyFiles(self, out_dir, build_dir, dirname, patterns, archived=None):
         """Copy files from the build directory to the output.
 
         Args:
@@ -392,6 +624,8 @@ class BuilderThread(threading.Thread):
             dirname: Source directory, '' for normal U-Boot, 'spl' for SPL
             patterns: A list of filenames (strings) to copy, each relative
                to the build directory
+            archived: Dict of files stored in the archive, keyed by name, to
+                which the files are added, or None to copy them to build_dir
         """
         for pattern in patterns:
             file_list = glob.glob(os.path.join(out_dir, dirname, pattern))
@@ -401,7 +635,130 @@ class BuilderThread(threading.Thread):
                     base, ext = os.path.splitext(target)
                     if ext:
                         target = '%s-%s%s' % (base, dirname, ext)
-                shutil.copy(fname, os.path.join(build_dir, target))
+                if archived is not None:
+                    archived[target] = self.builder.archive.StoreFile(fname)
+                else:
+                    shutil.copy(fname, os.path.join(build_dir, target))
+
+    def _CarryOverResult(self, job, commit_upto):
+        """Reuse the previous commit's result if a commit cannot affect it
+
+        If enabled, this checks whether the files changed by a commit can
+        affect the board being built. If not, the board's result for the
+        previous commit is copied to this commit and no build is done.
+
+        Args:
+            job: Job being built
+            commit_upto: Commit number to check
+
+        Returns:
+            True if the result was carried over, False if the commit must be
+            built
+        """
+        builder = self.builder
+        if not builder.affected or commit_upto < job.step:
+            return False
+        brd = job.board
+        prev_upto = commit_upto - job.step
+        prev_done = builder.GetDoneFile(prev_upto, brd.target)
+        if (os.path.exists(builder.GetDoneFile(commit_upto, brd.target)) or
+                not os.path.exists(prev_done)):
+            return False
+
+        # Only carry over successful builds, so that failures are retried
+        with open(prev_done) as fd:
+            if int(fd.readline()) != 0:
+                return False
+        config = builder.GetBuildConfig(prev_upto, brd.target)
+        if not config:
+            return False
+        new_hash = job.commits[commit_upto].hash
+        try:
+            fnames = builder.affected.GetChangedFiles(
+                    job.commits[prev_upto].hash, new_hash)
+        except OSError:
+            return False
+        if builder.affected.IsAffected(brd, config, new_hash, fnames):
+            return False
+
+        build_dir = builder.GetBuildDir(commit_upto, brd.target)
+        if os.path.exists(build_dir):
+            shutil.rmtree(build_dir)
+        shutil.copytree(builder.GetBuildDir(prev_upto, brd.target), build_dir)
+
+        # No time was spent on this build
+        timing_file = builder.GetTimingFile(commit_upto, brd.target)
+        if os.path.exists(timing_file):
+            os.remove(timing_file)
+        result = command.CommandResult()
+        result.return_code = 0
+        err_file = builder.GetErrFile(commit_upto, brd.target)
+        if os.path.exists(err_file):
+            with open(err_file) as fd:
+                result.stderr = fd.read()
+        result.already_done = False
+        result.carried_over = True
+        result.duration = 0
+        result.toolchain = self.toolchain
+        result.brd = brd
+        result.commit_upto = commit_upto
+        result.out_dir = None
+        builder.out_queue.put(result)
+        return True
+
+    def _CheckTmpfs(self, work_dir):
+        """Move the output directory to disk if the tmpfs budget is used up
+
+        The build can then continue incrementally from the same objects.
+
+        Args:
+            work_dir: Thread's working directory
+        """
+        tmpfs = self.builder.tmpfs
+        if self.tmpfs_dir and tmpfs.Update(self.thread_num, self.tmpfs_dir):
+            tmpfs.Spill(self.thread_num, self.tmpfs_dir,
+                        os.path.join(work_dir, 'build'))
+            self.tmpfs_dir = None
+
+    def _RemoveWarningObjects(self, result):
+        """Remove the object files for source files which produced warnings
+
+        An incremental build of the next commit then rebuilds these files, so
+        the warnings are reported again, just as they would be if the board
+        were reconfigured and built from scratch.
+
+        Args:
+            result: CommandResult object containing the result of the build
+
+        Returns:
+            True if the objects were removed, False if some warnings could
+            not be traced to an object file (e.g. a warning in a header file
+            or from the linker), so the board must be reconfigured instead
+        """
+        objects = set()
+        for line in (result.stderr or '').splitlines():
+            if line.startswith('In file included from'):
+                return False
+            match = RE_DIAGNOSTIC.match(line)
+            if match:
+                fname, kind = match.groups()
+                if kind != 'warning':
+                    continue
+                base, ext = os.path.splitext(os.path.normpath(fname))
+                if (ext not in OBJECT_SOURCE_EXTS or os.path.isabs(base) or
+                        base.startswith('..')):
+                    return False
+                found = [os.path.join(result.out_dir, subdir, base + '.o')
+                         for subdir in OBJECT_SUBDIRS]
+                found = [obj for obj in found if os.path.exists(obj)]
+                if not found:
+                    return False
+                objects.update(found)
+            elif 'warning' in line.lower():
+                return False
+        for obj in objects:
+            os.remove(obj)
+        return True
 
     def RunJob(self, job):
         """Run a single job
@@ -417,22 +774,43 @@ class BuilderThread(threading.Thread):
         if job.commits:
             # Run 'make board_defconfig' on the first commit
             do_config = True
+            can_check_config = (self.builder.config_hash and
+                                not self.builder.force_reconfig)
+            check_config = can_check_config
             commit_upto  = 0
             force_build = False
-            for commit_upto in range(0, len(job.commits), job.step):
+            build_time = 0
+            build_count = 0
+            commit_uptos = job.commit_uptos
+            if commit_uptos is None:
+                commit_uptos = range(0, len(job.commits), job.step)
+            for commit_upto in commit_uptos:
+                if self._CarryOverResult(job, commit_upto):
+                    continue
+                start_time = time.time()
+                self.timing = {}
                 result, request_config = self.RunCommit(commit_upto, brd,
                         work_dir, do_config, self.builder.config_only,
                         force_build or self.builder.force_build,
-                        self.builder.force_build_failures)
+                        self.builder.force_build_failures, check_config)
                 failed = result.return_code or result.stderr
                 did_config = do_config
-                if failed and not do_config:
+
+                # With config_hash, an incremental build which produced only
+                # warnings can be trusted, since the objects for the files
+                # with warnings are removed (see _RemoveWarningObjects())
+                trust_build = can_check_config and not result.return_code
+                if failed and not do_config and not trust_build:
                     # If our incremental build failed, try building again
                     # with a reconfig.
                     if self.builder.force_config_on_failure:
                         result, request_config = self.RunCommit(commit_upto,
                             brd, work_dir, True, False, True, False)
                         did_config = True
+                result.duration = time.time() - start_time
+                if not result.already_done:
+                    build_time += result.duration
+                    build_count += 1
                 if not self.builder.force_reconfig:
                     do_config = request_config
 
@@ -451,6 +829,7 @@ class BuilderThread(threading.Thread):
                 # errors/warnings (e.g. 2-3x slower even if only 10% of builds
                 # have problems).
                 if (failed and not result.already_done and not did_config and
+                        not trust_build and
                         self.builder.force_config_on_failure):
                     # If this build failed, try the next one with a
                     # reconfigure.
@@ -459,12 +838,17 @@ class BuilderThread(threading.Thread):
                     # make: *** No rule to make target `include/autoconf.mk',
                     #     needed by `depend'.
                     do_config = True
+                    check_config = False
                     force_build = True
                 else:
                     force_build = False
                     if self.builder.force_config_on_failure:
                         if failed:
                             do_config = True
+                            # Where possible, just rebuild the files with
+                            # warnings, unless the configuration changes
+                            check_config = (can_check_config and
+                                    self._RemoveWarningObjects(result))
                     result.commit_upto = commit_upto
                     if result.return_code < 0:
                         raise ValueError('Interrupt')
@@ -472,11 +856,20 @@ class BuilderThread(threading.Thread):
                 # We have the build results, so output the result
                 self._WriteResult(result, job.keep_outputs)
                 self.builder.out_queue.put(result)
+                self._CheckTmpfs(work_dir)
+            if build_count and self.builder.build_times:
+                self.builder.build_times.Add(brd.target,
+                                             build_time / build_count)
         else:
             # Just build the currently checked-out build
+            start_time = time.time()
+            self.timing = {}
             result, request_config = self.RunCommit(None, brd, work_dir, True,
                         self.builder.config_only, True,
                         self.builder.force_build_failures)
+            result.duration = time.time() - start_time
+            if self.builder.build_times:
+                self.builder.build_times.Add(brd.target, result.duration)
             result.commit_upto = 0
             self._WriteResult(result, job.keep_outputs)
             self.builder.out_queue.put(result)
@@ -488,6 +881,22 @@ class BuilderThread(threading.Thread):
         next job.
         """
         while True:
+            # Wait until the machine has room for another job
+            monitor = self.builder.monitor
+            if monitor:
+                monitor.Acquire()
             job = self.builder.queue.get()
-            self.RunJob(job)
+            tmpfs = self.builder.tmpfs
+            if tmpfs:
+                self.tmpfs_dir = tmpfs.GetOutDir(self.thread_num)
+            try:
+                self.RunJob(job)
+            finally:
+                # Only the files copied by CopyFiles() are kept
+                if self.tmpfs_dir:
+                    tmpfs.Release(self.thread_num, self.tmpfs_dir)
+                    self.tmpfs_dir = None
+                if monitor:
+                    monitor.Release()
+            self.job_end_time = time.time()
             self.builder.queue.task_done()
@@ -0,0 +1,112 @@
+# SPDX-License-Identifier: GPL-2.0+
+# Copyright (c) 2019 Google, Inc
+#
+
+"""Record of how long each board takes to build
+
+Buildman uses this to start the slowest boards first, so that they do not
+hold up the end of the build while other threads sit idle.
+
+The record is kept in a simple text file with one line per board, holding
+the board target and the time in seconds for a single build of that board.
+"""
+
+import os
+import threading
+
+# Weight given to a new build time, compared to the previous recorded time
+NEW_WEIGHT = 0.5
+
+class BuildTimes:
+    """Build times for a set of boards
+
+    Private members:
+        _fname: Filename of the file holding the times
+        _lock: Lock used to serialise access from builder threads
+        _times: Dict of build times in seconds, keyed by board target
+    """
+    def __init__(self, fname):
+        """Read the build times from a file, if it exists
+
+        Args:
+            fname: Filename of file holding the times
+        """
+        self._fname = fname
+        self._lock = threading.Lock()
+        self._times = {}
+        if not os.path.exists(fname):
+            return
+        with open(fname) as fd:
+            for line in fd:
+                fields = line.split()
+                if len(fields) != 2:
+                    continue
+                try:
+                    self._times[fields[0]] = float(fields[1])
+                except ValueError:
+                    pass
+
+    def Add(self, target, seconds):
+        """Record the time taken to build a board
+
+        The recorded time is a moving average, so that a single slow or fast
+        build does not distort the schedule too much.
+
+        Args:
+            target: Board target name
+            seconds: Time taken for a single build of the board, in seconds
+        """
+        with self._lock:
+            old = self._times.get(target)
+            if old is not None:
+                seconds = old * (1 - NEW_WEIGHT) + seconds * NEW_WEIGHT
+            self._times[target] = seconds
+
+    def Get(self, target):
+        """Get the recorded build time for a board
+
+        Args:
+            target: Board target name
+
+        Returns:
+            Build time in seconds, or None if not known
+        """
+        with self._lock:
+            return self._times.get(target)
+
+    def Estimate(self, brds):
+        """Estimate the build time for a list of boards
+
+        Boards which have not been built before are assumed to take the mean
+        time of the other boards for the same architecture, or failing that,
+        the mean time of all boards.
+
+        Args:
+            brds: List of Board objects
+
+        Returns:
+            Dict of estimated build times in seconds, keyed by board target
+        """
+        with self._lock:
+            arch_times = {}
+            for brd in brds:
+                if brd.target in self._times:
+                    arch_times.setdefault(brd.arch, []).append(
+                            self._times[brd.target])
+            all_times = self._times.values()
+            default = sum(all_times) / len(all_times) if all_times else 0
+            estimate = {}
+            for brd in brds:
+                seconds = self._times.get(brd.target)
+                if seconds is None:
+                    times = arch_times.get(brd.arch)
+                    seconds = sum(times) / len(times) if times else default
+                estimate[brd.target] = seconds
+        return estimate
+
+    def Save(self):
+        """Write the build times back to the file"""
+        with self._lock:
+            with open(self._fname, 'w') as fd:
+                for target in sorted(self._times):
+                    print >>fd, '%s %.2f' % (target, self._times[target])
@@ -13,16 +13,33 @@ def ParseArgs():
             args: command lin arguments
     """
     parser = OptionParser()
+    parser.add_option('--adapt-threads', action='store_true', default=False,
+          help='Reduce the number of threads starting new jobs when the '
+               'machine is short of memory, CPU or disk bandwidth')
+    parser.add_option('--archive', action='store_true', default=False,
+          help='Store build output files (logs, config files and with -k '
+               'the images) compressed, keeping identical files only once. '
+               'Use --extract to get them back')
     parser.add_option('-b', '--branch', type='string',
           help='Branch name to build, or range of commits to build')
     parser.add_option('-B', '--bloat', dest='show_bloat',
           action='store_true', default=False,
           help='Show changes in function code size for each board')
+    parser.add_option('--bisect-size', type='string', default=None,
+          help='Find the first commit which increases the size of a board '
+               'by a number of bytes, given as METRIC:BYTES (METRIC is text, '
+               'data, bss, rodata, all or func:NAME)')
     parser.add_option('-c', '--count', dest='count', type='int',
           default=-1, help='Run build on the top n commits')
     parser.add_option('-C', '--force-reconfig', dest='force_reconfig',
           action='store_true', default=False,
           help='Reconfigure for every commit (disable incremental build)')
+    parser.add_option('--compiler-cache', type='string', default=None,
+          help='Use a compiler cache (ccache or sccache) shared between '
+               'threads, and report its hit rate')
+    parser.add_option('--config-hash', action='store_true', default=False,
+          help='Only reconfigure a board when its configuration inputs '
+               '(Kconfig files, defconfig, toolchain) change')
     parser.add_option('-d', '--detail', dest='show_detail',
           action='store_true', default=False,
           help='Show detailed information for each board in summary')
@@ -32,12 +49,19 @@ def ParseArgs():
           default=False, help='Show errors and warnings')
     parser.add_option('-E', '--warnings-as-errors', action='store_true',
           default=False, help='Treat all compiler warnings as errors')
+    parser.add_option('--extract', type='string', default=None,
+          help='Write the output files of existing builds (including images '
+               'kept with -k and files stored with --archive) to this '
+               'directory, without building anything')
     parser.add_option('-f', '--force-build', dest='force_build',
           action='store_true', default=False,
           help='Force build of boards even if already built')
     parser.add_option('-F', '--force-build-failures', dest='force_build_failures',
           action='store_true', default=False,
           help='Force build of previously-failed build')
+    parser.add_option('--fast-checkout', action='store_true', default=False,
+          help='Only write the files which change between commits, so that '
+               'incremental builds only rebuild what has changed')
     parser.add_option('--fetch-arch', type='string',
           help="Fetch a toolchain for architecture FETCH_ARCH ('list' to list)."
               ' You can also fetch several toolchains separate by comma, or'
@@ -55,6 +79,12 @@ def ParseArgs():
           default=False, help='Do not run make mrproper (when reconfiguring)')
     parser.add_option('-j', '--jobs', dest='jobs', type='int',
           default=None, help='Number of jobs to run at once (passed to make)')
+    parser.add_option('--json-stream', type='string', default=None,
+          help='Write a JSON event for each build result to a file, or to '
+               'a Unix-domain socket given as unix:PATH')
+    parser.add_option('--jobserver', action='store_true', default=False,
+          help='Share a pool of make jobs between all threads, instead of '
+               'using a fixed number of jobs per thread')
     parser.add_option('-k', '--keep-outputs', action='store_true',
           default=False, help='Keep all build output files (e.g. binaries)')
     parser.add_option('-K', '--show-config', action='store_true',
@@ -78,18 +108,36 @@ def ParseArgs():
           default=False, help="Use full toolchain path in CROSS_COMPILE")
     parser.add_option('-P', '--per-board-out-dir', action='store_true',
           default=False, help="Use an O= (output) directory per board rather than per thread")
+    parser.add_option('--remote', type='string', action='append',
+          help='Also build on remote workers, given as a comma-separated '
+               'list of host:port (see --worker)')
+    parser.add_option('--result-db', action='store_true', default=False,
+          help='Keep build results in a database in the output directory, '
+               'to speed up summaries')
     parser.add_option('-s', '--summary', action='store_true',
           default=False, help='Show a build summary')
     parser.add_option('-S', '--show-sizes', action='store_true',
           default=False, help='Show image size variation in summary')
     parser.add_option('--skip-net-tests', action='store_true', default=False,
                       help='Skip tests which need the network')
+    parser.add_option('--skip-unaffected', action='store_true',
+          default=False, help='Skip building commits which cannot affect a '
+          'board, reusing its result for the previous commit')
     parser.add_option('--step', type='int',
           default=1, help='Only build every n commits (0=just first and last)')
     parser.add_option('-t', '--test', action='store_true', dest='test',
                       default=False, help='run tests')
     parser.add_option('-T', '--threads', type='int',
           default=None, help='Number of builder threads to use')
+    parser.add_option('--timing-report', type='int', default=None,
+          help='Show the time taken by each stage of the builds, and the '
+               'TIMING_REPORT slowest boards')
+    parser.add_option('--tmpfs-budget', type='int', default=None,
+          help='Maximum space in MB to use in the --tmpfs-dir directory '
+               '(default half of the free space)')
+    parser.add_option('--tmpfs-dir', type='string', default=None,
+          help='Put build output directories in this directory, e.g. on '
+               'tmpfs, moving them to disk if it fills up')
     parser.add_option('-u', '--show_unknown', action='store_true',
           default=False, help='Show boards with unknown build result')
     parser.add_option('-U', '--show-environment', action='store_true',
@@ -98,6 +146,8 @@ def ParseArgs():
           default=False, help='Show build results while the build progresses')
     parser.add_option('-V', '--verbose-build', action='store_true',
           default=False, help='Run make with V=1, logging all output')
+    parser.add_option('--worker', type='string', default=None,
+          help='Run as a worker for remote builds, listening on host:port')
     parser.add_option('-x', '--exclude', dest='exclude',
           type='string', action='append',
           help='Specify a list of boards to exclude, separated by comma')
@@ -0,0 +1,168 @@
+# SPDX-License-Identifier: GPL-2.0+
+# Copyright (c) 2019 Google, Inc
+#
+
+"""Support for building with a compiler cache (ccache or sccache)
+
+Buildman builds the same source files many times, for different boards and
+for adjacent commits. A compiler cache can avoid most of this work, but only
+if the cache key does not depend on the directory being built in, since each
+builder thread uses its own working directory. This module sets up the
+environment so that the cache can be shared between threads, and reads the
+cache statistics so that buildman can report how effective it was.
+"""
+
+import json
+
+import command
+
+# Compiler caches that we support
+TOOLS = ['ccache', 'sccache']
+
+# Keys in 'ccache --print-stats' output which count cache hits and misses
+CCACHE_HIT_KEYS = ['direct_cache_hit', 'preprocessed_cache_hit']
+CCACHE_MISS_KEYS = ['cache_miss']
+
+class CompilerCache:
+    """A compiler cache used to speed up builds
+
+    Public members:
+        tool: Name of the cache tool (e.g. 'ccache')
+    """
+    def __init__(self, tool):
+        """Set up a compiler cache
+
+        Args:
+            tool: Name of the cache tool to use, one of TOOLS
+
+        Raises:
+            ValueError if the tool is not supported or cannot be run
+        """
+        if tool not in TOOLS:
+            raise ValueError("Unknown compiler cache '%s' (use %s)" %
+                             (tool, ' or '.join(TOOLS)))
+        self.tool = tool
+        try:
+            result = command.RunPipe([[tool, '--version']], capture=True,
+                                     capture_stderr=True,
+                                     raise_on_error=False)
+        except OSError:
+            result = None
+        if not result or result.return_code:
+            raise ValueError("Compiler cache '%s' cannot be run" % tool)
+
+    def GetWrapper(self):
+        """Get the wrapper to put in front of CROSS_COMPILE
+
+        Returns:
+            Wrapper string, including a trailing space
+        """
+        return self.tool + ' '
+
+    def AddToEnvironment(self, env, base_dir):
+        """Add settings to allow the cache to be shared between directories
+
+        With ccache, absolute paths within base_dir are rewritten relative to
+        the current directory before hashing, and the current directory
+        itself is not hashed. This means that a file built in one thread's
+        working directory can be reused by another thread.
+
+        sccache does not support this, so builds in different working
+        directories only share cache entries if the compiler command lines
+        happen to be the same.
+
+        Args:
+            env: Environment dict to update
+            base_dir: Directory containing the source and output directories
+                of the build
+        """
+        if self.tool == 'ccache':
+            env['CCACHE_BASEDIR'] = base_dir
+            env['CCACHE_NOHASHDIR'] = '1'
+
+    def GetStats(self):
+        """Get the current hit/miss statistics from the cache
+
+        Returns:
+            Tuple (hits, misses) if available, else None
+        """
+        if self.tool == 'ccache':
+            cmd = ['ccache', '--print-stats']
+        else:
+            cmd = ['sccache', '--show-stats', '--stats-format=json']
+        result = command.RunPipe([cmd], capture=True, capture_stderr=True,
+                                 raise_on_error=False)
+        if result.return_code or not result.stdout:
+            return None
+        try:
+            if self.tool == 'ccache':
+                return _ParseCcacheStats(result.stdout)
+            return _ParseSccacheStats(result.stdout)
+        except ValueError:
+            return None
+
+    def GetStatsSummary(self, before, after):
+        """Get a summary line showing the cache statistics for this run
+
+        Args:
+            before: Stats before the run, as returned by GetStats()
+            after: Stats after the run, as returned by GetStats()
+
+        Returns:
+            String containing the summary, or None if not available
+        """
+        if not before or not after:
+            return None
+        hits = after[0] - before[0]
+        misses = after[1] - before[1]
+        total = hits + misses
+        rate = 100.0 * hits / total if total else 0
+        return '%s: %d hits, %d misses (%.1f%% hit rate)' % (self.tool, hits,
+                misses, rate)
+
+
+def _ParseCcacheStats(text):
+    """Parse the output of 'ccache --print-stats'
+
+    Each line contains a key and a value, separated by a tab.
+
+    Args:
+        text: Output from ccache
+
+    Returns:
+        Tuple (hits, misses)
+
+    Raises:
+        ValueError if the output cannot be parsed
+    """
+    hits = misses = 0
+    for line in text.splitlines():
+        fields = line.split('\t')
+        if len(fields) != 2:
+            continue
+        key, value = fields
+        if key in CCACHE_HIT_KEYS:
+            hits += int(value)
+        elif key in CCACHE_MISS_KEYS:
+            misses += int(value)
+    return hits, misses
+
+def _ParseSccacheStats(text):
+    """Parse the output of 'sccache --show-stats --stats-format=json'
+
+    Args:
+        text: Output from sccache
+
+    Returns:
+        Tuple (hits, misses)
+
+    Raises:
+        ValueError if the output cannot be parsed
+    """
+    try:
+        stats = json.loads(text)['stats']
+        hits = sum(stats['cache_hits']['counts'].values())
+        misses = sum(stats['cache_misses']['counts'].values())
+    except (KeyError, TypeError, AttributeError):
+        raise ValueError('Invalid sccache stats')
+    return hits, misses
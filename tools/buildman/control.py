@@ -5,15 +5,22 @@
 import multiprocessing
 import os
 import shutil
+import socket
 import sys
 
 import board
 import bsettings
-from builder import Builder
+import compilercache
+import events
+from monitor import ResourceMonitor
+from builder import BISECT_METRICS, Builder
+from jobserver import GetMakeVersion, JobServer
 import gitutil
 import patchstream
+import remote
 import terminal
 from terminal import Print
+from tmpfs import Tmpfs
 import toolchain
 import command
 import subprocess
@@ -37,8 +44,14 @@ def GetActionSummary(is_summary, commits, selected, options):
     str = '%s %s for %d boards' % (
         'Summary of' if is_summary else 'Building', commit_str,
         len(selected))
-    str += ' (%d thread%s, %d job%s per thread)' % (options.threads,
-            GetPlural(options.threads), options.jobs, GetPlural(options.jobs))
+    if options.jobserver:
+        str += ' (%d thread%s, %d job%s shared)' % (options.threads,
+                GetPlural(options.threads), options.jobs,
+                GetPlural(options.jobs))
+    else:
+        str += ' (%d thread%s, %d job%s per thread)' % (options.threads,
+                GetPlural(options.threads), options.jobs,
+                GetPlural(options.jobs))
     return str
 
 def ShowActions(series, why_selected, boards_selected, builder, options):
@@ -102,6 +115,85 @@ def CheckOutputDir(output_dir):
             break
         path = parent
 
+def GetGnuMake(options):
+    """Get the command name of GNU make
+
+    Args:
+        options: Command line options object
+
+    Returns:
+        Command name of GNU make
+    """
+    gnu_make = command.Output(os.path.join(options.git,
+            'scripts/show-gnu-make'), raise_on_error=False).rstrip()
+    if not gnu_make:
+        sys.exit('GNU Make not found')
+    return gnu_make
+
+def ParseBisectSize(arg):
+    """Parse the argument to --bisect-size
+
+    Args:
+        arg: Argument, in the form <metric>:<bytes>, e.g. 'text:1024' or
+            'func:board_init_f:64'
+
+    Returns:
+        Tuple:
+            Size metric (see builder.BISECT_METRICS), or 'func:<name>'
+            Threshold in bytes
+
+    Raises:
+        ValueError if the argument is invalid
+    """
+    metric, sep, threshold = arg.rpartition(':')
+    if (not sep or not (metric in BISECT_METRICS or
+                        (metric.startswith('func:') and len(metric) > 5))):
+        raise ValueError("Invalid --bisect-size '%s': use <metric>:<bytes> "
+                         "where <metric> is one of %s or func:<name>" %
+                         (arg, ', '.join(BISECT_METRICS)))
+    try:
+        return metric, int(threshold)
+    except ValueError:
+        raise ValueError("Invalid size '%s' in --bisect-size" % threshold)
+
+def RunWorker(options, toolchains, make_func=None):
+    """Run as a worker, building boards for remote coordinators
+
+    This does not return until interrupted.
+
+    Args:
+        options: Command line options object
+        toolchains: Toolchains to use
+        make_func: Make function to use for the builder (see DoBuildman())
+
+    Returns:
+        Return code for buildman
+    """
+    col = terminal.Color()
+    try:
+        address = remote.ParseAddress(options.worker)
+    except ValueError as err:
+        sys.exit(col.Color(col.RED, str(err)))
+    gnu_make = GetGnuMake(options)
+    threads = options.threads or multiprocessing.cpu_count()
+    builder = remote.WorkerBuilder(toolchains,
+            os.path.join(options.output_dir, '.bm-worker'), options.git_dir,
+            threads, options.jobs or 1, gnu_make=gnu_make,
+            full_path=options.full_path,
+            verbose_build=options.verbose_build,
+            incremental=options.incremental,
+            per_board_out_dir=options.per_board_out_dir,
+            config_only=options.config_only,
+            squash_config_y=not options.preserve_config_y,
+            warnings_as_errors=options.warnings_as_errors)
+    if make_func:
+        builder.do_make = make_func
+    server = remote.WorkerServer(address, builder)
+    Print('Waiting for builds on %s:%d (%d threads)' %
+          (server.server_address + (threads,)))
+    server.serve_forever()
+    return 0
+
 def DoBuildman(options, args, toolchains=None, make_func=None, boards=None,
                clean_dir=False):
     """The main control code for buildman
@@ -136,7 +228,7 @@ def DoBuildman(options, args, toolchains=None, make_func=None, boards=None,
 
     no_toolchains = toolchains is None
     if no_toolchains:
-        toolchains = toolchain.Toolchains()
+        toolchains = toolchain.Toolchains(toolchain.CACHE_FNAME)
 
     if options.fetch_arch:
         if options.fetch_arch == 'list':
@@ -165,6 +257,13 @@ def DoBuildman(options, args, toolchains=None, make_func=None, boards=None,
         print
         return 0
 
+    if options.worker:
+        return RunWorker(options, toolchains, make_func)
+
+    # A timing report or extraction is a kind of summary, so nothing is built
+    if options.timing_report or options.extract:
+        options.summary = True
+
     # Work out how many commits to build. We want to build everything on the
     # branch. We also build the upstream commit as a control so we can see
     # problems introduced by the first commit on the branch.
@@ -254,16 +353,40 @@ def DoBuildman(options, args, toolchains=None, make_func=None, boards=None,
     if not options.threads:
         options.threads = min(multiprocessing.cpu_count(), len(selected))
     if not options.jobs:
-        options.jobs = max(1, (multiprocessing.cpu_count() +
-                len(selected) - 1) / len(selected))
+        if options.jobserver:
+            # The jobs are shared between all threads
+            options.jobs = multiprocessing.cpu_count()
+        else:
+            options.jobs = max(1, (multiprocessing.cpu_count() +
+                    len(selected) - 1) / len(selected))
 
     if not options.step:
         options.step = len(series.commits) - 1
 
-    gnu_make = command.Output(os.path.join(options.git,
-            'scripts/show-gnu-make'), raise_on_error=False).rstrip()
-    if not gnu_make:
-        sys.exit('GNU Make not found')
+    gnu_make = GetGnuMake(options)
+
+    remotes = []
+    for arg in options.remote or []:
+        if not series:
+            sys.exit(col.Color(col.RED, 'Remote builds require a branch'))
+        for address in arg.split(','):
+            try:
+                remotes.append(remote.ParseAddress(address))
+            except ValueError as err:
+                sys.exit(col.Color(col.RED, str(err)))
+
+    bisect_size = None
+    if options.bisect_size:
+        if not series:
+            sys.exit(col.Color(col.RED, 'Bisecting requires a branch'))
+        if len(selected) != 1:
+            sys.exit(col.Color(col.RED, 'Bisecting requires a single board'))
+        if remotes:
+            sys.exit(col.Color(col.RED, 'Bisecting cannot use --remote'))
+        try:
+            bisect_size = ParseBisectSize(options.bisect_size)
+        except ValueError as err:
+            sys.exit(col.Color(col.RED, str(err)))
 
     # Create a new builder with the selected options.
     output_dir = options.output_dir
@@ -276,6 +399,38 @@ def DoBuildman(options, args, toolchains=None, make_func=None, boards=None,
         if clean_dir and os.path.exists(output_dir):
             shutil.rmtree(output_dir)
     CheckOutputDir(output_dir)
+    compiler_cache = None
+    if options.compiler_cache and not options.summary:
+        try:
+            compiler_cache = compilercache.CompilerCache(options.compiler_cache)
+        except ValueError as err:
+            sys.exit(col.Color(col.RED, str(err)))
+    jobserver = None
+    if options.jobserver and not options.summary and not options.dry_run:
+        jobserver = JobServer(options.jobs, GetMakeVersion(gnu_make))
+    tmpfs = None
+    if options.tmpfs_dir and not options.summary and not options.dry_run:
+        if options.per_board_out_dir or options.in_tree:
+            sys.exit(col.Color(col.RED,
+                    '--tmpfs-dir cannot be used with -P or -i'))
+        budget = options.tmpfs_budget
+        try:
+            tmpfs = Tmpfs(options.tmpfs_dir,
+                          budget * 1024 * 1024 if budget is not None else None)
+        except OSError as err:
+            sys.exit(col.Color(col.RED, "Cannot use tmpfs directory '%s': %s" %
+                               (options.tmpfs_dir, err)))
+    event_stream = None
+    if options.json_stream and not options.summary and not options.dry_run:
+        try:
+            event_stream = events.EventStream(options.json_stream)
+        except (IOError, socket.error) as err:
+            sys.exit(col.Color(col.RED, "Cannot open event stream '%s': %s" %
+                               (options.json_stream, err)))
+    monitor = None
+    if options.adapt_threads and not options.summary and not options.dry_run:
+        monitor = ResourceMonitor(options.threads, multiprocessing.cpu_count(),
+                os.path.join(output_dir, '.bm-monitor.log'))
     builder = Builder(toolchains, output_dir, options.git_dir,
             options.threads, options.jobs, gnu_make=gnu_make, checkout=True,
             show_unknown=options.show_unknown, step=options.step,
@@ -285,7 +440,10 @@ def DoBuildman(options, args, toolchains=None, make_func=None, boards=None,
             per_board_out_dir=options.per_board_out_dir,
             config_only=options.config_only,
             squash_config_y=not options.preserve_config_y,
-            warnings_as_errors=options.warnings_as_errors)
+            warnings_as_errors=options.warnings_as_errors,
+            result_db=options.result_db, compiler_cache=compiler_cache,
+            jobserver=jobserver, tmpfs=tmpfs, events=event_stream,
+            monitor=monitor)
     builder.force_config_on_failure = not options.quick
     if make_func:
         builder.do_make = make_func
@@ -297,6 +455,10 @@ def DoBuildman(options, args, toolchains=None, make_func=None, boards=None,
         builder.force_build = options.force_build
         builder.force_build_failures = options.force_build_failures
         builder.force_reconfig = options.force_reconfig
+        builder.config_hash = options.config_hash
+        builder.fast_checkout = options.fast_checkout
+        builder.archive_outputs = options.archive
+        builder.skip_unaffected = options.skip_unaffected
         builder.in_tree = options.in_tree
 
         # Work out which boards to build
@@ -321,11 +483,31 @@ def DoBuildman(options, args, toolchains=None, make_func=None, boards=None,
                                   options.list_error_boards,
                                   options.show_config,
                                   options.show_environment)
-        if options.summary:
+        if options.timing_report:
+            builder.ShowTimingReport(commits, board_selected,
+                                     options.timing_report)
+        elif options.extract:
+            builder.ExtractOutputs(commits, board_selected, options.extract)
+        elif options.summary:
             builder.ShowSummary(commits, board_selected)
         else:
-            fail, warned = builder.BuildBoards(commits, board_selected,
-                                options.keep_outputs, options.verbose)
+            # Remote threads connect to their worker once the build starts
+            for address in remotes:
+                thread = remote.RemoteThread(builder, address)
+                thread.setDaemon(True)
+                thread.start()
+            try:
+                if bisect_size:
+                    builder.BisectSize(commits, board_selected.values()[0],
+                                       *bisect_size)
+                    return 0
+                fail, warned = builder.BuildBoards(commits, board_selected,
+                                    options.keep_outputs, options.verbose)
+            finally:
+                if tmpfs:
+                    tmpfs.Close()
+                if event_stream:
+                    event_stream.Close()
             if fail:
                 return 128
             elif warned:
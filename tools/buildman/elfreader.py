@@ -0,0 +1,467 @@
+# SPDX-License-Identifier: GPL-2.0+
+# Copyright (c) 2019 Google, Inc
+#
+
+"""Simple reader for ELF files
+
+This reads the section headers and symbol table of an ELF file, so that
+buildman can work out the image sizes and function sizes of a build without
+running the toolchain's nm, objdump, size and objcopy tools. The output of
+those tools is emulated closely enough for buildman's own use (see
+builder.ReadFuncSizes() and the 'sizes' file).
+
+Both 32- and 64-bit files in either byte order are supported.
+"""
+
+import mmap
+import os
+import struct
+
+# ELF identification
+ELFMAG = '\x7fELF'
+ELFCLASS32, ELFCLASS64 = 1, 2
+ELFDATA2LSB, ELFDATA2MSB = 1, 2
+
+# Section types
+SHT_NULL, SHT_PROGBITS, SHT_SYMTAB, SHT_STRTAB, SHT_RELA = range(5)
+SHT_NOBITS = 8
+SHT_REL = 9
+SHT_DYNSYM = 11
+SHT_GROUP = 17
+
+# Section flags
+SHF_WRITE, SHF_ALLOC, SHF_EXECINSTR = 1, 2, 4
+
+# Special section indexes
+SHN_UNDEF = 0
+SHN_ABS = 0xfff1
+SHN_COMMON = 0xfff2
+
+# Symbol binding and type
+STB_LOCAL, STB_GLOBAL, STB_WEAK = range(3)
+STB_GNU_UNIQUE = 10
+STT_OBJECT = 1
+STT_SECTION, STT_FILE = 3, 4
+
+# Program header types
+PT_LOAD = 1
+
+# Names used by objdump for the file format, keyed by e_machine. Where the
+# name includes %s, this is replaced with 'big' or 'little'
+MACHINE_NAMES = {
+    2: 'sparc',
+    3: 'i386',
+    4: 'm68k',
+    8: 'trad%smips',
+    20: 'powerpc',
+    21: 'powerpc',
+    40: '%sarm',
+    42: '%ssh',
+    62: 'x86-64',
+    92: 'or1k',
+    94: 'xtensa-%s',
+    167: 'nds32%s',
+    183: '%saarch64',
+    189: 'microblaze%s',
+    195: '%sarc',
+    243: '%sriscv',
+}
+
+# Sections which nm gives a special symbol type, by name prefix
+SPECIAL_SECTION_TYPES = [
+    ('.sbss', 's'),
+    ('.scommon', 'c'),
+    ('.sdata', 'g'),
+]
+
+class Section:
+    """Information about a section in an ELF file
+
+    Public members:
+        name: Section name, e.g. '.text'
+        type: Section type (SHT_...)
+        flags: Section flags (SHF_...)
+        addr: Virtual address of the section (VMA)
+        lma: Load address of the section (LMA)
+        offset: Offset of the section contents in the file
+        size: Size of the section in bytes
+        link: Section index of the associated section (e.g. string table)
+        align: Alignment of the section in bytes
+        entsize: Size of each entry for sections which hold a table
+    """
+    def __init__(self, name, type, flags, addr, offset, size, link, align,
+                 entsize):
+        self.name = name
+        self.type = type
+        self.flags = flags
+        self.addr = addr
+        self.lma = addr
+        self.offset = offset
+        self.size = size
+        self.link = link
+        self.align = align
+        self.entsize = entsize
+
+
+class Symbol:
+    """Information about a symbol in an ELF file
+
+    Public members:
+        name: Symbol name
+        value: Value of the symbol (normally its address)
+        size: Size of the symbol in bytes
+        bind: Symbol binding (STB_...)
+        type: Symbol type (STT_...)
+        shndx: Index of the section containing the symbol, or SHN_...
+    """
+    def __init__(self, name, value, size, bind, type, shndx):
+        self.name = name
+        self.value = value
+        self.size = size
+        self.bind = bind
+        self.type = type
+        self.shndx = shndx
+
+
+class ElfFile:
+    """An ELF file which has been read in
+
+    Public members:
+        fname: Filename of the ELF file
+        is64: True if this is a 64-bit ELF file
+        machine: ELF machine number (e_machine)
+        big_endian: True if this is a big-endian ELF file
+        sections: List of Section objects, in section-header order
+
+    Private members:
+        _data: Contents of the file (a mmap object)
+        _endian: struct byte-order character for the file
+    """
+    def __init__(self, fname):
+        """Read the headers of an ELF file
+
+        Args:
+            fname: Filename of the ELF file to read
+
+        Raises:
+            ValueError if the file is not a valid ELF file
+        """
+        self.fname = fname
+        with open(fname, 'rb') as fd:
+            size = os.fstat(fd.fileno()).st_size
+            if size < 16:
+                raise ValueError("File '%s' is not an ELF file" % fname)
+            self._data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._ReadHeaders()
+        except struct.error:
+            raise ValueError("File '%s' is truncated" % fname)
+        self._symbols = None
+
+    def _ReadHeaders(self):
+        """Read the ELF header, section headers and program headers"""
+        data = self._data
+        if data[:4] != ELFMAG:
+            raise ValueError("File '%s' is not an ELF file" % self.fname)
+        elf_class, elf_data = struct.unpack_from('BB', data, 4)
+        if elf_class not in (ELFCLASS32, ELFCLASS64):
+            raise ValueError("File '%s' has invalid ELF class %d" %
+                             (self.fname, elf_class))
+        if elf_data not in (ELFDATA2LSB, ELFDATA2MSB):
+            raise ValueError("File '%s' has invalid ELF byte order %d" %
+                             (self.fname, elf_data))
+        self.is64 = elf_class == ELFCLASS64
+        self.big_endian = elf_data == ELFDATA2MSB
+        self._endian = '>' if self.big_endian else '<'
+        # Skip e_version and e_entry, then e_flags and e_ehsize
+        if self.is64:
+            fmt = 'H4x8xQQ4x2xHHHHH'
+        else:
+            fmt = 'H4x4xII4x2xHHHHH'
+        (self.machine, phoff, shoff, phentsize, phnum, shentsize, shnum,
+         shstrndx) = struct.unpack_from(self._endian + fmt, data, 18)
+
+        # Read the section headers
+        fmt = self._endian + ('IIQQQQIIQQ' if self.is64 else 'IIIIIIIIII')
+        headers = []
+        for i in range(shnum):
+            headers.append(struct.unpack_from(fmt, data, shoff + i * shentsize))
+        names = None
+        if shstrndx < len(headers):
+            hdr = headers[shstrndx]
+            names = data[hdr[4]:hdr[4] + hdr[5]]
+        self.sections = []
+        for (name, type, flags, addr, offset, size, link, info, align,
+             entsize) in headers:
+            self.sections.append(Section(_GetString(names, name), type, flags,
+                                         addr, offset, size, link, align,
+                                         entsize))
+
+        # Work out the load address of each section from the program headers
+        if self.is64:
+            fmt = self._endian + 'II6Q'
+        else:
+            fmt = self._endian + '8I'
+        for i in range(phnum):
+            fields = struct.unpack_from(fmt, data, phoff + i * phentsize)
+            if self.is64:
+                type, flags, offset, vaddr, paddr, filesz, memsz = fields[:7]
+            else:
+                type, offset, vaddr, paddr, filesz, memsz = fields[:6]
+            if type != PT_LOAD:
+                continue
+            for sect in self.sections:
+                if (sect.flags & SHF_ALLOC and sect.lma == sect.addr and
+                        vaddr <= sect.addr < vaddr + max(memsz, 1) and
+                        (sect.type == SHT_NOBITS or
+                         offset <= sect.offset < offset + max(filesz, 1))):
+                    sect.lma = paddr + sect.addr - vaddr
+
+    def GetSection(self, name):
+        """Get a section by name
+
+        Args:
+            name: Name of section to find, e.g. '.rodata'
+
+        Returns:
+            Section object, or None if not found
+        """
+        for sect in self.sections:
+            if sect.name == name:
+                return sect
+        return None
+
+    def GetSectionData(self, name):
+        """Get the contents of a section
+
+        Args:
+            name: Name of section to read
+
+        Returns:
+            Section contents as a string, or None if the section is not found
+        """
+        sect = self.GetSection(name)
+        if not sect:
+            return None
+        if sect.type == SHT_NOBITS:
+            return '\0' * sect.size
+        return self._data[sect.offset:sect.offset + sect.size]
+
+    def GetSymbols(self):
+        """Get the symbols from the symbol table
+
+        Returns:
+            List of Symbol objects, in symbol-table order (empty if there is
+            no symbol table)
+        """
+        if self._symbols is not None:
+            return self._symbols
+        self._symbols = []
+        for sect in self.sections:
+            if sect.type == SHT_SYMTAB:
+                break
+        else:
+            return self._symbols
+        if sect.link < len(self.sections):
+            strtab = self.sections[sect.link]
+            names = self._data[strtab.offset:strtab.offset + strtab.size]
+        else:
+            names = None
+        if self.is64:
+            fmt = self._endian + 'IBBHQQ'
+        else:
+            fmt = self._endian + 'IIIBBH'
+        entsize = sect.entsize or struct.calcsize(fmt)
+        for pos in range(sect.offset, sect.offset + sect.size, entsize):
+            if self.is64:
+                name, info, other, shndx, value, size = struct.unpack_from(
+                        fmt, self._data, pos)
+            else:
+                name, value, size, info, other, shndx = struct.unpack_from(
+                        fmt, self._data, pos)
+            self._symbols.append(Symbol(_GetString(names, name), value, size,
+                                        info >> 4, info & 0xf, shndx))
+        return self._symbols
+
+    def GetSymbolType(self, sym):
+        """Get the single-character symbol type that nm shows for a symbol
+
+        Args:
+            sym: Symbol object to check
+
+        Returns:
+            Symbol type, e.g. 'T' for a global symbol in a code section
+        """
+        if sym.bind == STB_WEAK:
+            char = 'v' if sym.type == STT_OBJECT else 'w'
+            return char if sym.shndx == SHN_UNDEF else char.upper()
+        if sym.shndx == SHN_UNDEF:
+            return 'U'
+        if sym.bind == STB_GNU_UNIQUE:
+            return 'u'
+        if sym.shndx == SHN_ABS:
+            char = 'a'
+        elif sym.shndx == SHN_COMMON:
+            char = 'c'
+        elif sym.shndx < len(self.sections):
+            char = _GetSectionType(self.sections[sym.shndx])
+        else:
+            char = '?'
+        if sym.bind == STB_GLOBAL:
+            char = char.upper()
+        return char
+
+    def GetFuncSizes(self):
+        """Emulate the output of 'nm --size-sort'
+
+        Returns:
+            Output that nm would produce, as a string
+        """
+        lines = []
+        fmt = '%016x %s %s' if self.is64 else '%08x %s %s'
+        for sym in self.GetSymbols():
+            if (not sym.size or not sym.name or sym.shndx == SHN_UNDEF or
+                    sym.type in (STT_SECTION, STT_FILE)):
+                continue
+            lines.append((sym.size, sym.name,
+                          fmt % (sym.size, self.GetSymbolType(sym), sym.name)))
+        return ''.join(['%s\n' % line for size, name, line in sorted(lines)])
+
+    def GetSectionHeaders(self, name=None):
+        """Emulate the output of 'objdump -h'
+
+        Args:
+            name: Filename to show in the output, or None to use the filename
+                that the file was opened with
+
+        Returns:
+            Output that objdump would produce, as a string
+        """
+        width = 16 if self.is64 else 8
+        out = ['', '%s:     file format %s' % (name or self.fname,
+                                                   self._GetFormat()),
+               '', 'Sections:',
+               'Idx Name          Size      %-*s  %-*s  File off  Algn' %
+               (width, 'VMA', width, 'LMA')]
+        idx = 0
+        for sect in self.sections:
+            if sect.type in (SHT_NULL, SHT_GROUP):
+                continue
+            if (sect.type in (SHT_SYMTAB, SHT_STRTAB, SHT_REL, SHT_RELA) and
+                    not sect.flags & SHF_ALLOC):
+                continue
+            align = 0
+            while (1 << (align + 1)) <= sect.align:
+                align += 1
+            out.append('%3d %-13s %08x  %0*x  %0*x  %08x  2**%d' %
+                       (idx, sect.name, sect.size, width, sect.addr,
+                        width, sect.lma, sect.offset, align))
+            out.append('                  %s' %
+                       ', '.join(_GetSectionFlags(sect)))
+            idx += 1
+        return '\n'.join(out) + '\n'
+
+    def GetSizes(self, name=None):
+        """Emulate the output of binutils 'size' (Berkeley format)
+
+        Args:
+            name: Filename to show in the output, or None to use the filename
+                that the file was opened with
+
+        Returns:
+            Tuple:
+                Output line that size would produce, without the header line
+                Size of the .rodata section in bytes, or None if none
+        """
+        text = data = bss = 0
+        for sect in self.sections:
+            if not sect.flags & SHF_ALLOC:
+                continue
+            if sect.flags & SHF_EXECINSTR or not sect.flags & SHF_WRITE:
+                text += sect.size
+            elif sect.type != SHT_NOBITS:
+                data += sect.size
+            else:
+                bss += sect.size
+        total = text + data + bss
+        rodata = self.GetSection('.rodata')
+        return ('%7d\t%7d\t%7d\t%7d\t%7x\t%s' %
+                (text, data, bss, total, total, name or self.fname),
+                rodata.size if rodata else None)
+
+    def _GetFormat(self):
+        """Get the name of the file format, as shown by objdump"""
+        machine = MACHINE_NAMES.get(self.machine, '%s')
+        if '%s' in machine:
+            machine = machine % ('big' if self.big_endian else 'little')
+        return 'elf%d-%s' % (64 if self.is64 else 32, machine)
+
+    def Close(self):
+        """Release the file contents"""
+        self._data.close()
+
+
+def _GetString(strtab, offset):
+    """Get a nul-terminated string from a string table
+
+    Args:
+        strtab: String-table contents, or None if none
+        offset: Offset of the string within the table
+
+    Returns:
+        String found, or '' if none
+    """
+    if not strtab or offset >= len(strtab):
+        return ''
+    end = strtab.find('\0', offset)
+    if end == -1:
+        end = len(strtab)
+    return strtab[offset:end]
+
+def _GetSectionType(sect):
+    """Get the lower-case nm symbol type for symbols in a section
+
+    Args:
+        sect: Section object
+
+    Returns:
+        Symbol-type character
+    """
+    for prefix, char in SPECIAL_SECTION_TYPES:
+        if sect.name.startswith(prefix):
+            return char
+    if sect.flags & SHF_EXECINSTR:
+        return 't'
+    elif not sect.flags & SHF_ALLOC:
+        return 'n'
+    elif sect.type == SHT_NOBITS:
+        return 'b'
+    elif not sect.flags & SHF_WRITE:
+        return 'r'
+    return 'd'
+
+def _GetSectionFlags(sect):
+    """Get the list of section flags that objdump shows for a section
+
+    Args:
+        sect: Section object
+
+    Returns:
+        List of flag names
+    """
+    flags = []
+    if sect.type != SHT_NOBITS:
+        flags.append('CONTENTS')
+    if sect.flags & SHF_ALLOC:
+        flags.append('ALLOC')
+        if sect.type != SHT_NOBITS:
+            flags.append('LOAD')
+    if not sect.flags & SHF_WRITE:
+        flags.append('READONLY')
+    if sect.flags & SHF_EXECINSTR:
+        flags.append('CODE')
+    elif sect.flags & SHF_ALLOC and sect.type != SHT_NOBITS:
+        flags.append('DATA')
+    if sect.name.startswith('.debug'):
+        flags.append('DEBUGGING')
+    return flags
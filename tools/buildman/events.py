@@ -0,0 +1,125 @@
+# SPDX-License-Identifier: GPL-2.0+
+# Copyright (c) 2019 Google, Inc
+#
+
+"""Writing a stream of build events for other programs to follow
+
+Buildman's progress output is meant for a terminal. For a dashboard or other
+program which wants to follow a build as it happens, buildman can also write
+a stream of events, one JSON object per line, each with a 'type' field:
+
+   start:  The build is starting. 'builds' is the number of builds to do,
+           'boards' the number of boards and 'commits' the number of commits
+   result: A build has completed, giving the board, commit, outcome, sizes,
+           etc. See Builder._WriteResultEvent() for the fields
+   end:    The build has finished, with 'ok', 'warned' and 'failed' giving
+           the number of builds with each outcome
+
+Each event also has a 'time' field with the time it was written, in seconds
+since the epoch.
+
+The stream is written to a file, or to a Unix-domain socket given as
+'unix:<path>', where another program must already be listening.
+"""
+
+import json
+import socket
+import threading
+import time
+
+# Prefix used to give the path to a Unix-domain socket
+UNIX_PREFIX = 'unix:'
+
+class EventStream:
+    """A stream of JSON events
+
+    Private members:
+        _fd: File object to write events to, or None if writing has failed
+        _lock: Lock used to serialise writing events
+        _sock: Socket used by _fd, or None if writing to a file
+    """
+    def __init__(self, dest):
+        """Open a new event stream
+
+        Args:
+            dest: Filename to write to, or 'unix:<path>' to connect to a
+                Unix-domain socket
+
+        Raises:
+            IOError or socket.error if the destination cannot be opened
+        """
+        self._lock = threading.Lock()
+        self._sock = None
+        if dest.startswith(UNIX_PREFIX):
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(dest[len(UNIX_PREFIX):])
+            self._fd = self._sock.makefile('w')
+        else:
+            self._fd = open(dest, 'w')
+
+    def Write(self, event_type, **kwargs):
+        """Write an event to the stream
+
+        If the event cannot be written (e.g. because the reader has gone
+        away), a warning is printed and no further events are written, since
+        the build can continue without them.
+
+        Args:
+            event_type: Type of event (e.g. 'result')
+            kwargs: Fields of the event
+        """
+        event = dict(kwargs, type=event_type, time=time.time())
+        try:
+            line = json.dumps(event, sort_keys=True) + '\n'
+        except UnicodeDecodeError:
+            # Text from git or the build (e.g. a commit subject) need not be
+            # valid UTF-8, so replace anything which cannot be decoded
+            line = json.dumps(_DecodeStrings(event), sort_keys=True) + '\n'
+        with self._lock:
+            if not self._fd:
+                return
+            try:
+                self._fd.write(line)
+                self._fd.flush()
+            except (IOError, socket.error) as err:
+                print 'Warning: Cannot write event stream: %s' % err
+                self._Close()
+
+    def Close(self):
+        """Close the stream"""
+        with self._lock:
+            self._Close()
+
+    def _Close(self):
+        """Close the stream, with the lock held"""
+        if self._fd:
+            try:
+                self._fd.close()
+            except (IOError, socket.error):
+                pass
+            self._fd = None
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+
+def _DecodeStrings(value):
+    """Convert the byte strings in a value to unicode
+
+    Bytes which are not valid UTF-8 are replaced with U+FFFD.
+
+    Args:
+        value: Value to convert, which may be a dict or list containing
+            other values
+
+    Returns:
+        Converted value
+    """
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, dict):
+        return dict((_DecodeStrings(key), _DecodeStrings(val))
+                    for key, val in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [_DecodeStrings(item) for item in value]
+    return value
@@ -2,10 +2,13 @@
 # Copyright (c) 2014 Google, Inc
 #
 
+import json
 import os
 import shutil
+import socket
 import sys
 import tempfile
+import threading
 import unittest
 
 import board
@@ -14,6 +17,7 @@ import cmdline
 import command
 import control
 import gitutil
+import remote
 import terminal
 import toolchain
 
@@ -196,9 +200,35 @@ class TestFunctional(unittest.TestCase):
         # Number of calls to make
         self._make_calls = 0
 
+        # List of git sub-commands used to set up the thread directories
+        self._git_calls = []
+        self._worktree_ok = True
+
+        # List of (git sub-command, commit hash) used to check out commits
+        self._checkouts = []
+        self._read_tree_ok = True
+
+        # Number of ccache hits and misses so far, and make environments seen
+        self._ccache_stats = [0, 0]
+        self._make_envs = []
+        self._make_targets = []
+        self._make_args = []
+        self._changed_files = []
+        self._write_config = False
+
+        # Size of u-boot's text section for each commit, if needed
+        self._text_sizes = None
+
         # Map of [board, commit] to error messages
         self._error = {}
 
+        # Map of [board, commit] to warning messages, each a list of
+        # (source file, message) tuples
+        self._warnings = {}
+
+        # Commit number from which the Kconfig files are changed, if any
+        self._kconfig_change = None
+
         self._test_branch = TEST_BRANCH
 
         # Avoid sending any output and clear all terminal output
@@ -313,14 +343,51 @@ class TestFunctional(unittest.TestCase):
         elif sub_cmd == 'log':
             return self._HandleCommandGitLog(args)
         elif sub_cmd == 'clone':
+            self._git_calls.append(sub_cmd)
+            return command.CommandResult(return_code=0)
+        elif sub_cmd == 'worktree':
+            self._git_calls.append('%s %s' % (sub_cmd, args[0]))
+            if args[0] == 'list' and not self._worktree_ok:
+                return command.CommandResult(return_code=1)
             return command.CommandResult(return_code=0)
         elif sub_cmd == 'checkout':
+            self._checkouts.append((sub_cmd, args[-1]))
+            return command.CommandResult(return_code=0)
+        elif sub_cmd == 'read-tree':
+            self._checkouts.append((sub_cmd, args[-1]))
+            return command.CommandResult(
+                    return_code=0 if self._read_tree_ok else 128)
+        elif sub_cmd == 'update-ref':
             return command.CommandResult(return_code=0)
+        elif sub_cmd == 'diff':
+            return command.CommandResult(return_code=0,
+                                         stdout='\n'.join(self._changed_files))
+        elif sub_cmd == 'show':
+            return command.CommandResult(return_code=128)
+        elif sub_cmd == 'ls-tree':
+            return self._HandleCommandGitLsTree(args)
 
         # Not handled, so abort
         print 'git', git_args, sub_cmd, args
         sys.exit(1)
 
+    def _HandleCommandGitLsTree(self, args):
+        """Handle 'git ls-tree', giving a tree with a few config inputs
+
+        The hash of the Kconfig file changes from commit self._kconfig_change
+        onwards.
+        """
+        seq = [i for i, log in enumerate(commit_log)
+               if log.startswith('commit %s' % args[-1])][0]
+        kconfig = '1111'
+        if self._kconfig_change is not None and seq >= self._kconfig_change:
+            kconfig = '2222'
+        lines = ['100644 blob %s\tKconfig' % kconfig,
+                 '100644 blob 3333\tconfigs/board2_defconfig',
+                 '100644 blob 4444\tdrivers/fred.c',
+                 '100644 blob 5555\tscripts/kconfig/conf.c']
+        return command.CommandResult(return_code=0, stdout='\n'.join(lines))
+
     def _HandleCommandNm(self, args):
         return command.CommandResult(return_code=0)
 
@@ -358,6 +425,9 @@ class TestFunctional(unittest.TestCase):
             result = self._HandleCommandGit(args)
         elif cmd == './scripts/show-gnu-make':
             return command.CommandResult(return_code=0, stdout='make')
+        elif cmd == 'make' and args == ['--version']:
+            return command.CommandResult(return_code=0,
+                                         stdout='GNU Make 4.1\n')
         elif cmd.endswith('nm'):
             return self._HandleCommandNm(args)
         elif cmd.endswith('objdump'):
@@ -366,6 +436,8 @@ class TestFunctional(unittest.TestCase):
             return self._HandleCommandObjcopy(args)
         elif cmd.endswith( 'size'):
             return self._HandleCommandSize(args)
+        elif cmd == 'ccache':
+            return self._HandleCommandCcache(args)
 
         if not result:
             # Not handled, so abort
@@ -376,6 +448,24 @@ class TestFunctional(unittest.TestCase):
             result.stdout = len(result.stdout.splitlines())
         return result
 
+    def _HandleCommandCcache(self, args):
+        """Handle execution of ccache
+
+        Each call to --print-stats reports some more hits and misses.
+        """
+        if args == ['--version']:
+            return command.CommandResult(return_code=0,
+                                         stdout='ccache version 4.2\n')
+        elif args == ['--print-stats']:
+            stdout = ('stats_updated_timestamp\t0\n'
+                      'direct_cache_hit\t%d\n'
+                      'preprocessed_cache_hit\t%d\n'
+                      'cache_miss\t%d\n' % (self._ccache_stats[0], 1,
+                                              self._ccache_stats[1]))
+            self._ccache_stats[0] += 30
+            self._ccache_stats[1] += 10
+            return command.CommandResult(return_code=0, stdout=stdout)
+
     def _HandleMake(self, commit, brd, stage, cwd, *args, **kwargs):
         """Handle execution of 'make'
 
@@ -388,23 +478,79 @@ class TestFunctional(unittest.TestCase):
             kwargs: Arguments to pass to command.RunPipe()
         """
         self._make_calls += 1
+        self._make_targets.append(brd.target)
+        self._make_envs.append(kwargs.get('env'))
+        self._make_args.append(args)
         if stage == 'mrproper':
             return command.CommandResult(return_code=0)
         elif stage == 'config':
             return command.CommandResult(return_code=0,
                     combined='Test configuration complete')
         elif stage == 'build':
+            if self._write_config:
+                out_dir = [arg[2:] for arg in args if arg.startswith('O=')][0]
+                with open(os.path.join(cwd, out_dir, '.config'), 'w') as fd:
+                    print >>fd, 'CONFIG_SYS_BOARD="%s"' % brd.board_name
+            if self._text_sizes:
+                self._WriteSizes(commit.sequence, brd.target)
             stderr = ''
             if type(commit) is not str:
                 stderr = self._error.get((brd.target, commit.sequence))
             if stderr:
                 return command.CommandResult(return_code=1, stderr=stderr)
+            if type(commit) is not str:
+                warnings = self._warnings.get((brd.target, commit.sequence))
+                if warnings:
+                    return self._WriteWarnings(cwd, args, warnings)
             return command.CommandResult(return_code=0)
 
         # Not handled, so abort
         print 'make', stage
         sys.exit(1)
 
+    def _WriteWarnings(self, cwd, args, warnings):
+        """Write the object files for a build with warnings
+
+        Args:
+            cwd: Directory where make is run
+            args: Arguments passed to make
+            warnings: List of (source file, message) tuples
+
+        Returns:
+            CommandResult object with the warnings
+        """
+        out_dir = [arg[2:] for arg in args if arg.startswith('O=')][0]
+        stderr = ''
+        for fname, msg in warnings:
+            obj = os.path.join(cwd, out_dir,
+                               os.path.splitext(fname)[0] + '.o')
+            if not os.path.exists(os.path.dirname(obj)):
+                os.makedirs(os.path.dirname(obj))
+            with open(obj, 'w') as fd:
+                pass
+            stderr += '%s:12:3: warning: %s\n' % (fname, msg)
+        return command.CommandResult(return_code=0, stderr=stderr)
+
+    def _WriteSizes(self, commit_upto, target):
+        """Write the sizes files for a build, in place of reading the ELF file
+
+        Args:
+            commit_upto: Commit number of the build
+            target: Target board of the build
+        """
+        text = self._text_sizes[commit_upto]
+        builder = control.builder
+        build_dir = builder.GetBuildDir(commit_upto, target)
+        if not os.path.exists(build_dir):
+            os.makedirs(build_dir)
+        with open(builder.GetSizesFile(commit_upto, target), 'w') as fd:
+            print >>fd, '%d 100 50 %d %x u-boot' % (text, text + 150,
+                                                   text + 150)
+        fname = builder.GetFuncSizesFile(commit_upto, target, 'u-boot')
+        with open(fname, 'w') as fd:
+            print >>fd, '%08x T fred' % (text - 900)
+            print >>fd, '00000100 T mary'
+
     # Example function to print output lines
     def print_lines(self, lines):
         print len(lines)
@@ -533,3 +679,369 @@ class TestFunctional(unittest.TestCase):
         with self.assertRaises(SystemExit):
             self._RunControl('-b', self._test_branch, '-o',
                              os.path.join(os.getcwd(), 'test'))
+
+    def testWorktree(self):
+        """Test that each thread uses a git worktree where possible"""
+        self._RunControl('-b', TEST_BRANCH, '-T', '2')
+        self.assertEqual(self._git_calls, ['worktree list', 'worktree prune',
+                                           'worktree add', 'worktree add'])
+        self.assertEqual(self._builder.fail, 0)
+
+    def testCompilerCache(self):
+        """Test building with ccache and reporting its hit rate"""
+        self._RunControl('-b', TEST_BRANCH, '--compiler-cache', 'ccache')
+        self.assertEqual(self._builder.fail, 0)
+        work_dir = os.path.realpath(self._builder._working_dir)
+        for env in self._make_envs:
+            self.assertTrue(env['CROSS_COMPILE'].startswith('ccache '))
+            self.assertEqual('1', env['CCACHE_NOHASHDIR'])
+            self.assertTrue(env['CCACHE_BASEDIR'].startswith(work_dir))
+        lines = terminal.GetPrintTestLines()
+        self.assertEqual('ccache: 30 hits, 10 misses (75.0% hit rate)',
+                         lines[-1].text)
+
+    def testJobserver(self):
+        """Test sharing make jobs between threads with a jobserver"""
+        self._RunControl('-b', TEST_BRANCH, '--jobserver', '-j', '3')
+        self.assertEqual(self._builder.fail, 0)
+        self.assertEqual(self._total_builds, self._builder.count)
+        for env, args in zip(self._make_envs, self._make_args):
+            self.assertNotIn('-j', args)
+            self.assertRegexpMatches(env['MAKEFLAGS'],
+                                     '-j --jobserver-fds=\d+,\d+$')
+
+        # All tokens should have been returned to the pool
+        jobserver = self._builder.jobserver
+        for i in range(3):
+            jobserver.Acquire()
+        jobserver.Release()
+        jobserver.Close()
+
+    def testRemote(self):
+        """Test building some boards on a remote worker"""
+        worker_targets = []
+        def _HandleWorkerMake(commit, brd, stage, *args, **kwargs):
+            worker_targets.append(brd.target)
+            return self._HandleMake(commit, brd, stage, *args, **kwargs)
+
+        worker_dir = os.path.join(self._base_dir, 'worker')
+        worker = remote.WorkerBuilder(self._toolchains, worker_dir,
+                                      self._git_dir, 2, 1)
+        worker.do_make = _HandleWorkerMake
+        server = remote.WorkerServer(('127.0.0.1', 0), worker)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        try:
+            self._error['board2', 1] = 'fred\n'
+            self._RunControl('-b', TEST_BRANCH, '-T', '1', '--remote',
+                             '127.0.0.1:%d' % server.server_address[1])
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(self._builder.count, self._total_builds)
+        self.assertEqual(self._builder.upto, self._total_builds)
+        self.assertEqual(self._builder.fail, 1)
+        self.assertTrue(worker_targets)
+
+        # The results should all be in the normal place
+        for commit_upto in range(self._commits):
+            for brd in boards:
+                target = brd[6]
+                fname = self._builder.GetDoneFile(commit_upto, target)
+                self.assertTrue(os.path.exists(fname))
+        err_file = self._builder.GetErrFile(1, 'board2')
+        with open(err_file) as fd:
+            self.assertEqual('fred\n', fd.read())
+
+    def testBuildOrder(self):
+        """Test that the slowest boards are built first"""
+        output_dir = os.path.join(self._base_dir, 'output')
+        base_dir = os.path.join(output_dir, TEST_BRANCH)
+        os.makedirs(base_dir)
+        times_fname = os.path.join(base_dir, '.bm-times')
+
+        # board1 is unknown, so should use the mean of the other arm board
+        with open(times_fname, 'w') as fd:
+            print >>fd, 'board0 20.00\nboard2 5.00\nboard4 40.00'
+        self._RunControl('-b', TEST_BRANCH, '-o', output_dir, '-T', '1',
+                         clean_dir=False)
+        self.assertEqual(self._builder.fail, 0)
+        order = []
+        for target in self._make_targets:
+            if target not in order:
+                order.append(target)
+        self.assertEqual(['board4', 'board0', 'board1', 'board2'], order)
+
+        # The build times should have been updated with all boards
+        with open(times_fname) as fd:
+            targets = [line.split()[0] for line in fd]
+        self.assertEqual(['board0', 'board1', 'board2', 'board4'], targets)
+
+    def testSkipUnaffected(self):
+        """Test skipping builds for commits which don't affect a board"""
+        self._write_config = True
+        self._changed_files = ['arch/arm/lib/fred.c', 'doc/README.fred']
+        self._RunControl('-b', TEST_BRANCH, '--skip-unaffected')
+        self.assertEqual(self._builder.count, self._total_builds)
+        self.assertEqual(self._builder.fail, 0)
+
+        # Only the ARM boards should be built for every commit
+        for target in ['board0', 'board1']:
+            self.assertEqual(self._commits + 2,
+                             self._make_targets.count(target))
+        for target in ['board2', 'board4']:
+            self.assertEqual(3, self._make_targets.count(target))
+        self.assertEqual(2 * (self._commits - 1), self._builder.carried_over)
+        for commit_upto in range(self._commits):
+            fname = self._builder.GetDoneFile(commit_upto, 'board2')
+            self.assertTrue(os.path.exists(fname))
+
+    def testTmpfs(self):
+        """Test putting the build output directories on tmpfs"""
+        self._write_config = True
+        tmpfs_dir = os.path.join(self._base_dir, 'tmpfs')
+        os.mkdir(tmpfs_dir)
+        self._RunControl('-b', TEST_BRANCH, '--tmpfs-dir', tmpfs_dir)
+        self.assertEqual(self._builder.fail, 0)
+        for args in self._make_args:
+            out_dir = [arg[2:] for arg in args if arg.startswith('O=')][0]
+            self.assertTrue(out_dir.startswith(tmpfs_dir + '/'))
+
+        # Files listed by CopyFiles() are kept, but nothing else
+        for commit_upto in range(self._commits):
+            fname = os.path.join(self._builder.GetBuildDir(commit_upto,
+                                                           'board0'), '.config')
+            self.assertTrue(os.path.exists(fname))
+        self.assertEqual([], os.listdir(tmpfs_dir))
+
+        # With no space left, the output directories should be on disk
+        self._make_args = []
+        self._RunControl('-b', TEST_BRANCH, '--tmpfs-dir', tmpfs_dir,
+                         '--tmpfs-budget', '0')
+        self.assertEqual(self._builder.fail, 0)
+        for args in self._make_args:
+            self.assertIn('O=build', args)
+
+    def _CheckEvents(self, data):
+        """Check the events written for a build of the test branch
+
+        Args:
+            data: Event stream, as a string
+        """
+        events = [json.loads(line) for line in data.splitlines()]
+        self.assertEqual('start', events[0]['type'])
+        self.assertEqual(self._total_builds, events[0]['builds'])
+        end = events[-1]
+        del end['time']
+        self.assertEqual({'type': 'end', 'ok': self._total_builds - 1,
+                          'warned': 0, 'failed': 1}, end)
+        results = events[1:-1]
+        self.assertEqual(self._total_builds, len(results))
+        failed = [event for event in results if event['outcome'] != 'ok']
+        self.assertEqual(1, len(failed))
+        event = failed[0]
+        self.assertEqual('board2', event['board'])
+        self.assertEqual('powerpc', event['arch'])
+        self.assertEqual(1, event['commit_upto'])
+        self.assertEqual(self._builder.commits[1].hash, event['commit'])
+        self.assertEqual('error', event['outcome'])
+        self.assertEqual(1, event['return_code'])
+        self.assertEqual(1, event['errors'])
+        self.assertTrue(event['toolchain'])
+        self.assertTrue(event['duration'] >= 0)
+
+    def testJsonStream(self):
+        """Test writing a JSON event stream to a file and a socket"""
+        self._error['board2', 1] = 'main.c:12:3: error: fred\n'
+        fname = os.path.join(self._base_dir, 'events')
+        self._RunControl('-b', TEST_BRANCH, '--json-stream', fname)
+        with open(fname) as fd:
+            self._CheckEvents(fd.read())
+
+        sock_fname = os.path.join(self._base_dir, 'sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(sock_fname)
+        listener.listen(1)
+        data = []
+        def _Read():
+            conn, addr = listener.accept()
+            while True:
+                buf = conn.recv(4096)
+                if not buf:
+                    break
+                data.append(buf)
+            conn.close()
+        thread = threading.Thread(target=_Read)
+        thread.setDaemon(True)
+        thread.start()
+        try:
+            self._RunControl('-b', TEST_BRANCH, '--json-stream',
+                             'unix:' + sock_fname)
+            thread.join(10)
+        finally:
+            listener.close()
+        self._CheckEvents(''.join(data))
+
+    def testTimingReport(self):
+        """Test recording and reporting the time taken by each stage"""
+        self._RunControl('-b', TEST_BRANCH)
+        timing = self._builder.ReadTiming(0, 'board0')
+        self.assertEqual(['build', 'checkout', 'config', 'copy', 'mrproper',
+                          'sizes'], sorted(timing.keys()))
+        timing = self._builder.ReadTiming(1, 'board0')
+        self.assertNotIn('mrproper', timing)
+
+        # Make board2 look slow
+        for commit_upto in range(self._commits):
+            fname = self._builder.GetTimingFile(commit_upto, 'board2')
+            with open(fname, 'w') as fd:
+                print >>fd, 'checkout 1.0\nbuild 100.0'
+        terminal.GetPrintTestLines()
+        make_calls = self._make_calls
+        self._RunControl('-b', TEST_BRANCH, '--timing-report', '2',
+                         clean_dir=False)
+        self.assertEqual(make_calls, self._make_calls)
+        lines = [line.text for line in terminal.GetPrintTestLines()]
+        self.assertIn('Time taken by %d builds:' % self._total_builds, lines)
+        stage_lines = [line.split() for line in lines
+                       if line.startswith('   build ')]
+        self.assertEqual(1, len(stage_lines))
+        self.assertTrue(float(stage_lines[0][1][:-1]) >= 100 * self._commits)
+        pos = lines.index('Slowest boards:')
+        self.assertEqual(['board', 'total', 'checkout', 'mrproper', 'config',
+                          'build', 'sizes', 'copy'], lines[pos + 1].split())
+        self.assertEqual(4, len(lines) - pos)
+        fields = lines[pos + 2].split()
+        self.assertEqual('board2', fields[0])
+        self.assertEqual(101.0 * self._commits, float(fields[1]))
+
+    def testExtract(self):
+        """Test writing out archived build output files"""
+        self._RunControl('-b', TEST_BRANCH, '--archive', 'board0')
+        build_dir = self._builder.GetBuildDir(1, 'board0')
+        self.assertFalse(os.path.exists(os.path.join(build_dir, 'log')))
+        terminal.GetPrintTestLines()
+        make_calls = self._make_calls
+        out_dir = os.path.join(self._base_dir, 'extract')
+        self._RunControl('-b', TEST_BRANCH, '--extract', out_dir, 'board0',
+                         clean_dir=False)
+        self.assertEqual(make_calls, self._make_calls)
+        lines = [line.text for line in terminal.GetPrintTestLines()]
+        self.assertIn('Extracted %d builds to %s' % (self._commits, out_dir),
+                      lines)
+        dest_dir = os.path.join(out_dir,
+                os.path.relpath(build_dir, self._builder.base_dir))
+        fnames = os.listdir(dest_dir)
+        self.assertIn('log', fnames)
+        self.assertIn('done', fnames)
+        self.assertNotIn('archive', fnames)
+        self.assertEqual(self._commits, len(os.listdir(out_dir)))
+
+    def testBisectSize(self):
+        """Test finding the commit which caused a size regression"""
+        self._text_sizes = [1000, 1000, 1010, 1600, 1600, 1700, 1700]
+        self._RunControl('-b', TEST_BRANCH, '--bisect-size', 'text:500',
+                         'board0')
+        self.assertEqual(4, self._builder.upto)
+        self.assertEqual(4, self._make_targets.count('board0') / 3)
+        lines = [line.text for line in terminal.GetPrintTestLines()]
+        pos = lines.index('04: %s' % self._builder.commits[3].subject)
+        self.assertEqual('   text size of board0: 1010 -> 1600 bytes (+590), '
+                         '+600 bytes since the first commit', lines[pos + 1])
+        self.assertIn('fred', lines[pos + 4])
+        self.assertIn('+590', lines[pos + 4])
+
+        # A function can be used instead, and a failed build is skipped
+        self._error['board0', 3] = 'bad\n'
+        self._RunControl('-b', TEST_BRANCH, '--bisect-size', 'func:fred:500',
+                         'board0')
+        lines = [line.text for line in terminal.GetPrintTestLines()]
+        pos = lines.index('05: %s' % self._builder.commits[4].subject)
+        self.assertIn('func:fred size of board0: 110 -> 700', lines[pos + 1])
+        self.assertEqual('   Commit 04 could not be built, so may be the cause',
+                         lines[pos + 2])
+
+        self._RunControl('-b', TEST_BRANCH, '--bisect-size', 'bss:1',
+                         'board0')
+        lines = [line.text for line in terminal.GetPrintTestLines()]
+        self.assertIn('No commit increases bss size of board0 by 1 bytes or '
+                      'more', lines)
+        self.assertEqual(('text', 20), control.ParseBisectSize('text:20'))
+        self.assertRaises(ValueError, control.ParseBisectSize, 'fred:20')
+        self.assertRaises(ValueError, control.ParseBisectSize, 'func::20')
+        self.assertRaises(ValueError, control.ParseBisectSize, 'text:x')
+
+    def testConfigHash(self):
+        """Test only reconfiguring when the configuration inputs change"""
+        def _CountConfigs():
+            return len([args for args in self._make_args
+                        if 'board2_defconfig' in args])
+
+        warning = [('drivers/fred.c', "unused variable 'x'")]
+        self._warnings['board2', 1] = warning
+        self._warnings['board2', 3] = warning
+        self._RunControl('-b', TEST_BRANCH, 'board2')
+        self.assertEqual(self._builder.warned, 2)
+
+        # Reconfigure on the first commit, then retry commit 1 and 3 with a
+        # reconfigure and reconfigure for the commit after each
+        self.assertEqual(_CountConfigs(), 5)
+
+        # With --config-hash, the board is only reconfigured when the Kconfig
+        # file changes, but the warnings are still reported
+        self._make_args = []
+        self._kconfig_change = 3
+        self._RunControl('-b', TEST_BRANCH, '-f', '--config-hash', 'board2')
+        self.assertEqual(self._builder.warned, 2)
+        self.assertEqual(_CountConfigs(), 2)
+        self.assertEqual(self._builder.fail, 0)
+
+        # A warning in a header file needs a reconfigure
+        self._make_args = []
+        self._warnings['board2', 5] = [('include/fred.h', 'bad')]
+        self._RunControl('-b', TEST_BRANCH, '-f', '--config-hash', 'board2')
+        self.assertEqual(self._builder.warned, 3)
+        self.assertEqual(_CountConfigs(), 3)
+
+    def testFastCheckout(self):
+        """Test checking out only the files which change between commits"""
+        self._RunControl('-b', TEST_BRANCH, '-T', '1', '--fast-checkout')
+        self.assertEqual(self._builder.count, self._total_builds)
+        self.assertEqual(self._builder.fail, 0)
+
+        # Only the first commit needs a full checkout
+        sub_cmds = [sub_cmd for sub_cmd, commit_hash in self._checkouts]
+        self.assertEqual(['checkout'] + ['read-tree'] * (self._total_builds - 1),
+                         sub_cmds)
+        hashes = [commit_hash for sub_cmd, commit_hash in self._checkouts]
+        self.assertEqual(hashes, [commit.hash for commit in
+                                  self._builder.commits] * len(boards))
+
+        # If that fails, a full checkout should be done instead
+        self._checkouts = []
+        self._read_tree_ok = False
+        self._RunControl('-b', TEST_BRANCH, '-T', '1', '--fast-checkout')
+        self.assertEqual(self._builder.fail, 0)
+        sub_cmds = [sub_cmd for sub_cmd, commit_hash in self._checkouts]
+        self.assertEqual(['checkout'] + ['read-tree', 'checkout'] *
+                         (self._total_builds - 1), sub_cmds)
+
+    def testAdaptThreads(self):
+        """Test building with the number of threads adjusted to the machine"""
+        output_dir = os.path.join(self._base_dir, 'out')
+        self._RunControl('-b', TEST_BRANCH, '-o', output_dir, '-T', '2',
+                         '--adapt-threads')
+        self.assertEqual(self._builder.count, self._total_builds)
+        self.assertEqual(self._builder.fail, 0)
+        self.assertEqual(2, self._builder.monitor.max_threads)
+        log_fname = os.path.join(self._builder.base_dir, '.bm-monitor.log')
+        with open(log_fname) as fd:
+            self.assertIn('Starting with 2 threads', fd.read())
+
+    def testNoWorktree(self):
+        """Test falling back to a clone when git-worktree is not available"""
+        self._worktree_ok = False
+        self._RunControl('-b', TEST_BRANCH, '-T', '2')
+        self.assertEqual(self._git_calls, ['worktree list', 'clone', 'clone'])
+        self.assertEqual(self._builder.fail, 0)
@@ -0,0 +1,105 @@
+# SPDX-License-Identifier: GPL-2.0+
+# Copyright (c) 2019 Google, Inc
+#
+
+"""GNU make jobserver shared between builder threads
+
+Normally each builder thread passes a fixed '-j' value to make. When only a
+few boards are left to build, most of the threads are idle but the remaining
+ones cannot use the spare CPUs.
+
+With a jobserver, all make processes share a single pool of job tokens, held
+in a pipe. Each builder thread takes a token before starting make, which
+covers the job that make always runs itself. Make takes further tokens from
+the pipe before starting each additional job, and returns them when done. So
+the total number of jobs stays at the size of the pool, however many boards
+are being built at once.
+"""
+
+import errno
+import os
+import re
+
+import command
+
+# First version of GNU make which uses --jobserver-auth instead of
+# --jobserver-fds
+JOBSERVER_AUTH_VERSION = (4, 2)
+
+class JobServer:
+    """A pool of job tokens for make
+
+    Private members:
+        _read_fd: File descriptor for reading tokens from the pipe
+        _write_fd: File descriptor for writing tokens to the pipe
+        _flag: Name of the make flag used to pass the pipe to make
+    """
+    def __init__(self, num_jobs, make_version=None):
+        """Set up a new jobserver
+
+        Args:
+            num_jobs: Total number of jobs to allow at once
+            make_version: Version of GNU make as a tuple of integers (e.g.
+                (4, 1)), or None if not known
+        """
+        self._read_fd, self._write_fd = os.pipe()
+        os.write(self._write_fd, '+' * max(1, num_jobs))
+        if make_version and make_version < JOBSERVER_AUTH_VERSION:
+            self._flag = '--jobserver-fds'
+        else:
+            self._flag = '--jobserver-auth'
+
+    def GetMakeFlags(self):
+        """Get the flags which tell make to use this jobserver
+
+        Returns:
+            String to add to MAKEFLAGS
+        """
+        return '-j %s=%d,%d' % (self._flag, self._read_fd, self._write_fd)
+
+    def AddToEnvironment(self, env):
+        """Add the jobserver to the environment for make
+
+        Args:
+            env: Environment dict to update
+        """
+        flags = env.get('MAKEFLAGS', '').strip()
+        env['MAKEFLAGS'] = ' '.join(filter(None, [flags, self.GetMakeFlags()]))
+
+    def Acquire(self):
+        """Take a token from the pool, waiting until one is available"""
+        while True:
+            try:
+                if os.read(self._read_fd, 1):
+                    return
+            except OSError as err:
+                if err.errno != errno.EINTR:
+                    raise
+
+    def Release(self):
+        """Return a token to the pool"""
+        os.write(self._write_fd, '+')
+
+    def Close(self):
+        """Close the jobserver pipe"""
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+
+def GetMakeVersion(gnu_make):
+    """Get the version of GNU make
+
+    Args:
+        gnu_make: Command name of GNU make
+
+    Returns:
+        Version as a tuple of integers (e.g. (4, 1)), or None if not known
+    """
+    result = command.RunPipe([[gnu_make, '--version']], capture=True,
+                             capture_stderr=True, raise_on_error=False)
+    if result.return_code or not result.stdout:
+        return None
+    match = re.search(r'GNU Make (\d+)\.(\d+)', result.stdout)
+    if not match:
+        return None
+    return tuple(int(value) for value in match.groups())
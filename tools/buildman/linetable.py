@@ -0,0 +1,107 @@
+# SPDX-License-Identifier: GPL-2.0+
+# Copyright (c) 2019 Google, Inc
+#
+
+"""Compact tables of error lines and the boards which produce them
+
+When summarising a large build, the same warnings tend to be produced by
+hundreds or thousands of boards, for commit after commit. Rather than keeping
+a list of Board objects for each line of each commit and comparing the lines
+as strings, each distinct line is given a small integer ID and the boards
+with that line are held as a bitset in a single integer. Working out what
+changed from one commit to the next is then a matter of set operations on
+integers.
+"""
+
+class LineTable:
+    """Gives each distinct error/warning line an ID
+
+    IDs are allocated in the order lines are first seen, and remain valid for
+    the life of the table, so IDs from different commits can be compared.
+
+    Private members:
+        _ids: Dict of line IDs, keyed by line
+        _lines: List of lines, indexed by ID
+    """
+    def __init__(self):
+        self._ids = {}
+        self._lines = []
+
+    def Intern(self, line):
+        """Get the ID for a line, adding it to the table if needed
+
+        Trailing whitespace is ignored, so lines which differ only in that
+        way have the same ID.
+
+        Args:
+            line: Line of text
+
+        Returns:
+            ID of the line (0, 1, ...)
+        """
+        line = line.rstrip()
+        line_id = self._ids.get(line)
+        if line_id is None:
+            line_id = len(self._lines)
+            self._ids[line] = line_id
+            self._lines.append(line)
+        return line_id
+
+    def GetLine(self, line_id):
+        """Get the line with a particular ID
+
+        Args:
+            line_id: ID of the line, as returned by Intern()
+
+        Returns:
+            Line of text, without trailing whitespace
+        """
+        return self._lines[line_id]
+
+
+class BoardBits:
+    """Gives each board a bit, so that a set of boards can be an integer
+
+    Bits are allocated in the order boards are first seen, and
+    GetTargets() returns boards in the same order.
+
+    Private members:
+        _bits: Dict of the bit mask for each board, keyed by board target
+        _targets: List of board targets, indexed by bit number
+    """
+    def __init__(self):
+        self._bits = {}
+        self._targets = []
+
+    def Get(self, target):
+        """Get the bit mask for a board, allocating a bit if needed
+
+        Args:
+            target: Target name of the board
+
+        Returns:
+            Integer with only the board's bit set
+        """
+        mask = self._bits.get(target)
+        if mask is None:
+            mask = 1 << len(self._targets)
+            self._bits[target] = mask
+            self._targets.append(target)
+        return mask
+
+    def GetTargets(self, bits):
+        """Get the boards in a set
+
+        Args:
+            bits: Integer with a bit set for each board, as made by or-ing
+                together the values returned by Get()
+
+        Returns:
+            List of board targets, in the order they were first seen
+        """
+        targets = []
+        while bits:
+            low = bits & -bits
+            targets.append(self._targets[low.bit_length() - 1])
+            bits ^= low
+        return targets
@@ -0,0 +1,243 @@
+# SPDX-License-Identifier: GPL-2.0+
+# Copyright (c) 2019 Google, Inc
+#
+
+"""Adjusting the number of builder threads to suit the machine
+
+Buildman normally runs a fixed number of threads, chosen from the number of
+CPUs. On a machine shared with other users, or when building boards which
+need a lot of memory (e.g. with LTO), this can push the machine into swap or
+cause processes to be killed when memory runs out.
+
+The ResourceMonitor samples the load average, the available memory and the
+time the CPUs spend waiting for I/O, every few seconds. When the machine is
+overloaded it reduces the number of threads which may start a new job; when
+things are quiet again it allows more, up to the number buildman started
+with. Jobs which are already running are not affected. Each change is
+written to a log file, with the reason.
+"""
+
+import os
+import threading
+import time
+
+# Seconds between samples
+DEFAULT_INTERVAL = 5
+
+# Load average per CPU above which the machine is overloaded, and below which
+# more threads can be allowed
+LOAD_HIGH = 1.5
+LOAD_OK = 1.0
+
+# Part of memory which is available, below which the machine is short of
+# memory (so the number of threads is halved), and above which more threads
+# can be allowed
+MEM_LOW = 0.1
+MEM_OK = 0.2
+
+# Part of CPU time spent waiting for I/O, above which the disk is overloaded,
+# and below which more threads can be allowed
+IOWAIT_HIGH = 0.2
+IOWAIT_OK = 0.1
+
+class ResourceMonitor:
+    """Limits the number of builder threads which are running jobs
+
+    Builder threads call Acquire() before taking a job and Release() when
+    they have finished it.
+
+    Public members:
+        allowed: Number of threads currently allowed to run jobs
+        max_threads: Maximum number of threads to allow
+        min_allowed: Lowest value that 'allowed' has had
+        changes: Number of times 'allowed' has been changed
+
+    Private members:
+        _cond: Condition used to wait for a thread to be allowed to run
+        _cpus: Number of CPUs in the machine
+        _interval: Seconds between samples
+        _last_cpu_times: Tuple of the (iowait, total) CPU times at the last
+            sample, or None if none
+        _log_fd: File to write decisions to, or None
+        _log_fname: Filename of the log file, or None for no log
+        _running: Number of threads currently running jobs
+        _stop: Event used to stop the sampling thread
+        _thread: Thread which samples the resource usage, or None
+    """
+    def __init__(self, max_threads, cpus, log_fname=None,
+                 interval=DEFAULT_INTERVAL):
+        """Set up a new monitor
+
+        Args:
+            max_threads: Number of builder threads, which is the most that
+                are allowed to run jobs at once
+            cpus: Number of CPUs in the machine
+            log_fname: Filename to log decisions to, or None for no log
+            interval: Seconds between samples
+        """
+        self.max_threads = max_threads
+        self.allowed = max_threads
+        self.min_allowed = max_threads
+        self.changes = 0
+        self._cond = threading.Condition()
+        self._cpus = cpus
+        self._interval = interval
+        self._last_cpu_times = None
+        self._log_fd = None
+        self._log_fname = log_fname
+        self._running = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def Start(self):
+        """Start sampling resource usage in a background thread"""
+        if self._log_fname:
+            self._log_fd = open(self._log_fname, 'a')
+        self._Log('Starting with %d threads' % self.allowed)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._Run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def Stop(self):
+        """Stop sampling and close the log"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._log_fd:
+            self._log_fd.close()
+            self._log_fd = None
+
+    def Acquire(self):
+        """Wait until this thread is allowed to start a new job"""
+        with self._cond:
+            while self._running >= self.allowed:
+                self._cond.wait()
+            self._running += 1
+
+    def Release(self):
+        """Record that this thread has finished its job"""
+        with self._cond:
+            self._running -= 1
+            self._cond.notify_all()
+
+    def Update(self, load, mem_free, iowait):
+        """Adjust the number of threads allowed, given the resource usage
+
+        Args:
+            load: Load average over the last minute
+            mem_free: Part of memory which is available (0..1), or None if
+                not known
+            iowait: Part of CPU time spent waiting for I/O (0..1) since the
+                last sample, or None if not known
+
+        Returns:
+            New number of threads allowed
+        """
+        load_per_cpu = float(load) / self._cpus
+        allowed = self.allowed
+        if mem_free is not None and mem_free < MEM_LOW:
+            allowed = allowed / 2
+            reason = 'only %d%% of memory available' % (mem_free * 100)
+        elif load_per_cpu > LOAD_HIGH:
+            allowed -= 1
+            reason = 'load average %.1f' % load
+        elif iowait is not None and iowait > IOWAIT_HIGH:
+            allowed -= 1
+            reason = '%d%% I/O wait' % (iowait * 100)
+        elif (load_per_cpu < LOAD_OK and
+              (mem_free is None or mem_free > MEM_OK) and
+              (iowait is None or iowait < IOWAIT_OK)):
+            allowed += 1
+            reason = 'load average %.1f' % load
+        allowed = max(1, min(allowed, self.max_threads))
+        if allowed != self.allowed:
+            self._Log('Threads %d -> %d: %s' % (self.allowed, allowed, reason))
+            with self._cond:
+                self.allowed = allowed
+                self._cond.notify_all()
+            self.changes += 1
+            self.min_allowed = min(self.min_allowed, allowed)
+        return allowed
+
+    def GetSummary(self):
+        """Get a summary of the changes made to the number of threads
+
+        Returns:
+            String containing the summary, or None if there were no changes
+        """
+        if not self.changes:
+            return None
+        return ('Thread count adjusted %d time%s to suit the machine (down '
+                'to %d of %d)' % (self.changes, 's' if self.changes != 1
+                                  else '', self.min_allowed, self.max_threads))
+
+    def _Run(self):
+        """Sample the resource usage until stopped"""
+        while not self._stop.wait(self._interval):
+            self.Update(os.getloadavg()[0], _ReadMemFree(),
+                        self._ReadIoWait())
+
+    def _ReadIoWait(self):
+        """Work out the part of CPU time spent waiting for I/O
+
+        Returns:
+            Part of the CPU time since the last call (0..1), or None if not
+            known
+        """
+        cpu_times = _ReadCpuTimes()
+        last = self._last_cpu_times
+        self._last_cpu_times = cpu_times
+        if not cpu_times or not last or cpu_times[1] <= last[1]:
+            return None
+        return float(cpu_times[0] - last[0]) / (cpu_times[1] - last[1])
+
+    def _Log(self, msg):
+        """Write a message to the log, if there is one
+
+        Args:
+            msg: Message to write
+        """
+        if self._log_fd:
+            self._log_fd.write('%s: %s\n' %
+                               (time.strftime('%Y-%m-%d %H:%M:%S'), msg))
+            self._log_fd.flush()
+
+
+def _ReadMemFree():
+    """Read the part of memory which is available
+
+    Returns:
+        Available memory as a part of the total (0..1), or None if not known
+    """
+    info = {}
+    try:
+        with open('/proc/meminfo') as fd:
+            for line in fd:
+                fields = line.split()
+                if len(fields) >= 2:
+                    info[fields[0]] = int(fields[1])
+    except (IOError, ValueError):
+        return None
+    total = info.get('MemTotal:')
+    available = info.get('MemAvailable:')
+    if not total or available is None:
+        return None
+    return float(available) / total
+
+def _ReadCpuTimes():
+    """Read the total CPU time and the time spent waiting for I/O
+
+    Returns:
+        Tuple (iowait, total) in clock ticks, or None if not known
+    """
+    try:
+        with open('/proc/stat') as fd:
+            fields = fd.readline().split()
+    except IOError:
+        return None
+    if len(fields) < 6 or fields[0] != 'cpu':
+        return None
+    times = [int(field) for field in fields[1:]]
+    return times[4], sum(times)
@@ -0,0 +1,423 @@
+# SPDX-License-Identifier: GPL-2.0+
+# Copyright (c) 2019 Google, Inc
+#
+
+"""Distributing builds across several machines
+
+A worker is a buildman started with --worker, which listens on a TCP port
+for a coordinator to connect. A coordinator is a normal buildman run with
+--remote, which hands some of its boards to each worker in addition to
+building boards with its own threads.
+
+The protocol is a series of JSON objects, one per line, each with a 'type'
+field:
+
+   coordinator -> worker:
+      start:  Starts a session, giving the list of commits to build ('hash'
+              and 'subject' for each) and the build options
+      build:  Requests that a board be built for all commits ('board' holds
+              the board details)
+
+   worker -> coordinator:
+      ready:  The worker is ready to build, with 'threads' giving the number
+              of boards that it can build at once
+      result: The result of building a board at one commit. The 'files'
+              field holds a base64-encoded, gzipped tar file containing the
+              board's build directory (done, err, sizes, etc.)
+
+The session ends when the coordinator closes the connection. Each worker
+must have its own U-Boot git repository containing the commits to be built,
+and its own toolchains.
+"""
+
+import base64
+import json
+import os
+import shutil
+import socket
+import SocketServer
+import StringIO
+import tarfile
+import threading
+
+import board
+from builder import Builder
+import builderthread
+import command
+import commit
+from terminal import Print
+
+# Options copied from the coordinator's builder to each worker's builder
+BUILD_OPTIONS = ['force_build', 'force_build_failures', 'force_reconfig',
+                 'force_config_on_failure']
+
+def ParseAddress(address):
+    """Parse a network address
+
+    Args:
+        address: Address in the form host:port. The host may be omitted, in
+            which case all interfaces are used (for listening)
+
+    Returns:
+        Tuple (host, port)
+
+    Raises:
+        ValueError if the address is invalid
+    """
+    host, sep, port = address.rpartition(':')
+    if not sep or not port.isdigit():
+        raise ValueError("Invalid address '%s' (use host:port)" % address)
+    return host, int(port)
+
+def SendMessage(wfile, msg_type, **kwargs):
+    """Send a message to the other end of a connection
+
+    Args:
+        wfile: File to write the message to
+        msg_type: Type of message
+        kwargs: Fields to include in the message
+    """
+    kwargs['type'] = msg_type
+    wfile.write(json.dumps(kwargs) + '\n')
+    wfile.flush()
+
+def ReadMessage(rfile):
+    """Read a message from the other end of a connection
+
+    Args:
+        rfile: File to read the message from
+
+    Returns:
+        Dict containing the message, or None if the connection was closed
+
+    Raises:
+        ValueError if the message is invalid
+    """
+    line = rfile.readline()
+    if not line:
+        return None
+    msg = json.loads(line)
+    if not isinstance(msg, dict) or 'type' not in msg:
+        raise ValueError('Invalid message')
+    return msg
+
+def PackDir(dirname):
+    """Pack up the contents of a directory for sending
+
+    Args:
+        dirname: Directory to pack
+
+    Returns:
+        Base64-encoded gzipped tar file containing the directory contents
+    """
+    data = StringIO.StringIO()
+    with tarfile.open(fileobj=data, mode='w:gz') as tar:
+        if os.path.isdir(dirname):
+            for fname in sorted(os.listdir(dirname)):
+                tar.add(os.path.join(dirname, fname), fname)
+    return base64.b64encode(data.getvalue())
+
+def UnpackDir(packed, dirname):
+    """Unpack the contents of a directory received from the other end
+
+    Any existing contents of the directory are removed first.
+
+    Args:
+        packed: Packed directory, as returned by PackDir()
+        dirname: Directory to unpack into
+
+    Raises:
+        ValueError if the packed data contains an unsafe filename
+    """
+    if os.path.exists(dirname):
+        shutil.rmtree(dirname)
+    builderthread.Mkdir(dirname, parents=True)
+    data = StringIO.StringIO(base64.b64decode(packed))
+    with tarfile.open(fileobj=data, mode='r:gz') as tar:
+        for member in tar.getmembers():
+            name = os.path.normpath(member.name)
+            if os.path.isabs(name) or name.startswith('..'):
+                raise ValueError("Unsafe filename '%s'" % member.name)
+        tar.extractall(dirname)
+
+
+class WorkerBuilder(Builder):
+    """A builder which sends its results to a coordinator
+
+    This builds boards as requested by a coordinator, one session at a time.
+    Rather than showing progress, each result is sent back to the
+    coordinator along with the files in the board's build directory.
+
+    Private members:
+        _wfile: File used to send results to the coordinator
+        _wlock: Lock to serialise writing to _wfile
+    """
+    def __init__(self, *args, **kwargs):
+        Builder.__init__(self, *args, **kwargs)
+        self._wfile = None
+        self._wlock = threading.Lock()
+
+    def RunSession(self, rfile, wfile):
+        """Build boards for a coordinator until it closes the connection
+
+        Args:
+            rfile: File to read requests from
+            wfile: File to send results to
+        """
+        msg = ReadMessage(rfile)
+        if not msg or msg['type'] != 'start':
+            raise ValueError('Expected start message')
+        commits = None
+        if msg['commits'] is not None:
+            commits = []
+            for info in msg['commits']:
+                cmt = commit.Commit(str(info['hash']))
+                cmt.subject = info['subject'].encode('utf-8')
+                cmt.sequence = len(commits)
+                commits.append(cmt)
+        self.commits = commits
+        self.commit_count = len(commits) if commits else 1
+        for name in BUILD_OPTIONS:
+            setattr(self, name, msg[name])
+        builderthread.Mkdir(self.base_dir, parents=True)
+        self._PrepareWorkingSpace(self.num_threads, commits is not None)
+        self._wfile = wfile
+        SendMessage(wfile, 'ready', threads=self.num_threads)
+
+        boards = 0
+        try:
+            while True:
+                msg = ReadMessage(rfile)
+                if not msg:
+                    break
+                if msg['type'] != 'build':
+                    raise ValueError("Unexpected message '%s'" % msg['type'])
+                fields = dict((str(key), str(value))
+                              for key, value in msg['board'].iteritems())
+                job = builderthread.BuilderJob()
+                job.board = board.Board(**fields)
+                job.commits = commits
+                job.keep_outputs = msg['keep_outputs']
+                job.step = msg['step']
+                self.queue.put(job)
+                boards += 1
+        finally:
+            # Let any builds in progress finish before the next session
+            self.queue.join()
+            self.out_queue.join()
+            self._wfile = None
+        Print('Session complete: %d board%s' % (boards,
+                                                's' if boards != 1 else ''))
+
+    def ProcessResult(self, result):
+        """Send a build result back to the coordinator
+
+        Args:
+            result: A CommandResult object, which indicates the result for
+                    a single build
+        """
+        if not result:
+            return
+        build_dir = self.GetBuildDir(result.commit_upto, result.brd.target)
+        stderr = result.stderr or ''
+        with self._wlock:
+            if not self._wfile:
+                return
+            try:
+                SendMessage(self._wfile, 'result', target=result.brd.target,
+                            commit_upto=result.commit_upto,
+                            return_code=result.return_code,
+                            stderr=stderr.decode('utf-8', 'replace'),
+                            already_done=result.already_done,
+                            files=PackDir(build_dir))
+            except socket.error:
+                # The coordinator has gone away and will rebuild this board
+                self._wfile = None
+
+
+class WorkerServer(SocketServer.ThreadingTCPServer):
+    """Server which accepts connections from coordinators
+
+    Only one session runs at a time, since the builder's threads and
+    working directories are shared.
+
+    Public members:
+        builder: WorkerBuilder to use to build boards
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, builder):
+        SocketServer.ThreadingTCPServer.__init__(self, address,
+                                                 _WorkerHandler)
+        self.builder = builder
+        self.lock = threading.Lock()
+
+
+class _WorkerHandler(SocketServer.StreamRequestHandler):
+    """Handles a single connection from a coordinator"""
+    def handle(self):
+        with self.server.lock:
+            Print('Session from %s:%d' % self.client_address)
+            try:
+                self.server.builder.RunSession(self.rfile, self.wfile)
+            except (socket.error, ValueError, KeyError) as err:
+                Print('Session failed: %s' % err)
+
+
+class RemoteThread(threading.Thread):
+    """Thread which hands jobs to a remote worker
+
+    This takes jobs from the builder's queue, just like a BuilderThread, but
+    sends them to a worker instead of building them locally. Results are
+    unpacked into the normal output directory and passed to the builder's
+    result queue. The thread can be started before the build; it connects
+    to the worker when the first job is available.
+
+    If the connection to the worker fails, any jobs in progress are put back
+    on the queue to be built elsewhere.
+
+    Private members:
+        _address: Tuple (host, port) of the worker
+        _dead: True if the connection has failed
+        _lock: Lock to protect _pending and _dead
+        _pending: Dict of jobs sent to the worker, keyed by board target.
+            Each value is a list [job, number of results received]
+        _slots: Semaphore limiting the number of jobs sent to the worker to
+            the number of boards it can build at once
+        _wfile: File used to send requests to the worker
+    """
+    def __init__(self, builder, address):
+        """Set up a new remote thread
+
+        Args:
+            builder: Builder which will be sent our results
+            address: Tuple (host, port) of the worker
+        """
+        threading.Thread.__init__(self)
+        self.builder = builder
+        self._address = address
+        self._dead = False
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._slots = None
+        self._wfile = None
+
+    def run(self):
+        """Our thread's run function
+
+        This sends jobs to the worker in a separate thread, and processes the
+        results from the worker in this one.
+        """
+        job = self.builder.queue.get()
+        try:
+            sock = socket.create_connection(self._address)
+            rfile = sock.makefile('rb')
+            self._wfile = sock.makefile('wb')
+            SendMessage(self._wfile, 'start', commits=self._GetCommits(),
+                        **dict((name, getattr(self.builder, name))
+                               for name in BUILD_OPTIONS))
+            msg = ReadMessage(rfile)
+            if not msg or msg['type'] != 'ready':
+                raise ValueError('Worker is not ready')
+        except (socket.error, ValueError) as err:
+            Print("\nWorker %s:%d is not available: %s" %
+                  (self._address + (err,)))
+            self.builder.queue.put(job)
+            self.builder.queue.task_done()
+            return
+        self._slots = threading.Semaphore(msg['threads'])
+        self._slots.acquire()
+        sender = threading.Thread(target=self._SendJobs, args=(job,))
+        sender.setDaemon(True)
+        sender.start()
+        try:
+            while True:
+                msg = ReadMessage(rfile)
+                if not msg:
+                    raise ValueError('Connection closed')
+                self._ProcessResult(msg)
+        except (socket.error, ValueError, KeyError) as err:
+            Print("\nWorker %s:%d failed: %s" % (self._address + (err,)))
+        with self._lock:
+            self._dead = True
+            for job, count in self._pending.itervalues():
+                self.builder.queue.put(job)
+                self.builder.queue.task_done()
+            self._pending = {}
+        sock.close()
+
+    def _GetCommits(self):
+        """Get the list of commits to send to the worker
+
+        Returns:
+            List of dicts, each containing the hash and subject of a commit,
+            or None if building the current source
+        """
+        if not self.builder.commits:
+            return None
+        return [{'hash': cmt.hash, 'subject': cmt.subject.decode('utf-8',
+                                                                 'replace')}
+                for cmt in self.builder.commits]
+
+    def _SendJobs(self, job):
+        """Send jobs to the worker as it has room for them
+
+        Args:
+            job: First job to send
+        """
+        while True:
+            with self._lock:
+                if self._dead:
+                    self.builder.queue.put(job)
+                    self.builder.queue.task_done()
+                    return
+                self._pending[job.board.target] = [job, 0]
+            brd = job.board
+            fields = {'status': '', 'arch': brd.arch, 'cpu': brd.cpu,
+                      'soc': brd.soc, 'vendor': brd.vendor,
+                      'board_name': brd.board_name, 'target': brd.target,
+                      'options': brd.options}
+            try:
+                SendMessage(self._wfile, 'build', board=fields,
+                            keep_outputs=job.keep_outputs, step=job.step)
+            except socket.error:
+                # The receiving side will notice and requeue the job
+                return
+            self._slots.acquire()
+            job = self.builder.queue.get()
+
+    def _ProcessResult(self, msg):
+        """Process a result message from the worker
+
+        Args:
+            msg: Message received
+        """
+        if msg['type'] != 'result':
+            raise ValueError("Unexpected message '%s'" % msg['type'])
+        target = str(msg['target'])
+        with self._lock:
+            job, count = self._pending[target]
+        commit_upto = msg['commit_upto']
+        UnpackDir(msg['files'], self.builder.GetBuildDir(commit_upto, target))
+        result = command.CommandResult(return_code=msg['return_code'],
+                                       stderr=msg['stderr'].encode('utf-8'))
+        result.brd = job.board
+        result.commit_upto = commit_upto
+        result.already_done = msg['already_done']
+        result.toolchain = None
+        self.builder.out_queue.put(result)
+
+        # Once all commits are done, the worker has room for another board
+        if job.commits:
+            expected = len(range(0, len(job.commits), job.step))
+        else:
+            expected = 1
+        with self._lock:
+            count += 1
+            if count < expected:
+                self._pending[target][1] = count
+                return
+            del self._pending[target]
+        self._slots.release()
+        self.builder.queue.task_done()
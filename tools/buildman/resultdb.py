@@ -0,0 +1,144 @@
+# SPDX-License-Identifier: GPL-2.0+
+# Copyright (c) 2019 Google, Inc
+#
+
+"""Persistent store for build outcomes
+
+Buildman writes a set of small files for every board and commit that it
+builds (done, err, sizes, *.sizes, .config, etc.). Producing a summary means
+reading all of these back, which is slow when there are many boards and
+commits. This module keeps the decoded outcome of each build in a single
+SQLite database in the output directory, so that it only needs to be read
+from the individual files once.
+
+The files remain the primary record of each build. Each database row records
+the modification time of the 'done' file it was imported from, so that a
+rebuild (even by a buildman which does not use the database) is detected and
+the row is refreshed from the files.
+"""
+
+import json
+import sqlite3
+import threading
+
+# Number of rows to add before committing them to the database
+COMMIT_INTERVAL = 100
+
+class ResultDb:
+    """A database holding the outcome of each board/commit build
+
+    Private members:
+        _conn: sqlite3 connection to the database
+        _lock: Lock used to serialise access from the result thread and the
+            summary code
+        _pending: Number of rows added since the last commit
+    """
+    def __init__(self, fname):
+        """Open (and create if necessary) a result database
+
+        Args:
+            fname: Filename of database
+        """
+        self._conn = sqlite3.connect(fname, check_same_thread=False)
+        self._conn.text_factory = str
+        self._lock = threading.Lock()
+        self._pending = 0
+        with self._lock:
+            self._conn.execute('PRAGMA synchronous = OFF')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS results (
+                commit_dir TEXT NOT NULL,
+                target TEXT NOT NULL,
+                stamp REAL NOT NULL,
+                rc INTEGER NOT NULL,
+                err_lines TEXT,
+                sizes TEXT,
+                func_sizes TEXT,
+                config TEXT,
+                environment TEXT,
+                PRIMARY KEY (commit_dir, target))''')
+            self._conn.commit()
+
+    def Add(self, commit_dir, target, stamp, rc, err_lines, sizes, func_sizes,
+            config, environment):
+        """Add or replace the outcome of a build
+
+        Args:
+            commit_dir: Name of the commit's output directory (leaf name only)
+            target: Board target name
+            stamp: Modification time of the build's 'done' file
+            rc: Outcome value (OUTCOME_...)
+            err_lines: List of error lines
+            sizes: Dict of image size information (see Builder.Outcome)
+            func_sizes: Dict of function sizes (see Builder.Outcome)
+            config: Dict of config values (see Builder.Outcome)
+            environment: Dict of environment values (see Builder.Outcome)
+        """
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO results VALUES '
+                               '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               (commit_dir, target, stamp, rc,
+                                json.dumps(err_lines), json.dumps(sizes),
+                                json.dumps(func_sizes), json.dumps(config),
+                                json.dumps(environment)))
+            self._pending += 1
+            if self._pending >= COMMIT_INTERVAL:
+                self._conn.commit()
+                self._pending = 0
+
+    def Get(self, commit_dir, target, stamp):
+        """Look up the outcome of a build
+
+        Args:
+            commit_dir: Name of the commit's output directory (leaf name only)
+            target: Board target name
+            stamp: Modification time of the build's 'done' file. The stored
+                outcome is only returned if it was recorded for this stamp.
+
+        Returns:
+            None if there is no up-to-date outcome, else tuple:
+                rc, err_lines, sizes, func_sizes, config, environment
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT stamp, rc, err_lines, sizes, '
+                    'func_sizes, config, environment FROM results WHERE '
+                    'commit_dir = ? AND target = ?',
+                    (commit_dir, target)).fetchone()
+        if not row or row[0] != stamp:
+            return None
+        return tuple([row[1]] + [_Decode(value) for value in row[2:]])
+
+    def Flush(self):
+        """Commit any pending rows to the database"""
+        with self._lock:
+            self._conn.commit()
+            self._pending = 0
+
+    def Close(self):
+        """Commit any pending rows and close the database"""
+        self.Flush()
+        self._conn.close()
+
+
+def _Decode(value):
+    """Decode a JSON value read from the database
+
+    JSON always produces unicode strings, but the rest of buildman deals
+    with plain str objects, so convert them back.
+
+    Args:
+        value: JSON string to decode
+
+    Returns:
+        Decoded value, with all strings converted to str
+    """
+    return _ToStr(json.loads(value))
+
+def _ToStr(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, list):
+        return [_ToStr(item) for item in value]
+    elif isinstance(value, dict):
+        return dict((_ToStr(key), _ToStr(item))
+                    for key, item in value.iteritems())
+    return value
@@ -2,10 +2,12 @@
 # Copyright (c) 2012 The Chromium OS Authors.
 #
 
+import json
 import os
 import shutil
 import sys
 import tempfile
+import threading
 import time
 import unittest
 
@@ -13,13 +15,22 @@ import unittest
 our_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(our_path, '../patman'))
 
+import affected
+import archive
 import board
 import bsettings
 import builder
 import control
 import command
 import commit
+import elfreader
+import events
+import jobserver
+import linetable
+import monitor
 import terminal
+import test_util
+import tmpfs
 import toolchain
 
 use_network = True
@@ -284,6 +295,212 @@ class TestBuild(unittest.TestCase):
         self.assertEqual(len(lines), 29)
         shutil.rmtree(base_dir)
 
+    def _GetSummaryLines(self, build, board_selected):
+        """Show a summary and return the lines printed"""
+        build.SetDisplayOptions(show_errors=True, show_sizes=True)
+        build.ShowSummary(self.commits, board_selected)
+        return [(line.text, line.colour)
+                for line in terminal.GetPrintTestLines()]
+
+    def testResultDb(self):
+        """Test that summaries from the result database match the files"""
+        global base_dir
+
+        base_dir = tempfile.mkdtemp()
+        build = builder.Builder(self.toolchains, base_dir, None, 1, 2,
+                                checkout=False, show_unknown=False,
+                                result_db=True)
+        build.do_make = self.Make
+        board_selected = self.boards.GetSelectedDict()
+        build.BuildBoards(self.commits, board_selected, keep_outputs=False,
+                          verbose=False)
+        terminal.GetPrintTestLines()
+        self.assertTrue(os.path.exists(os.path.join(base_dir,
+                                                    '.bm-results.db')))
+        db_lines = self._GetSummaryLines(build, board_selected)
+
+        file_build = builder.Builder(self.toolchains, base_dir, None, 1, 2,
+                                     checkout=False, show_unknown=False)
+        self.assertEqual(db_lines,
+                         self._GetSummaryLines(file_build, board_selected))
+
+        # The outcome should come from the database, not the files
+        err_file = build.GetErrFile(2, 'board2')
+        os.remove(err_file)
+        self.assertEqual(db_lines, self._GetSummaryLines(build, board_selected))
+        outcome = file_build.GetBuildOutcome(2, 'board2', False, False, False)
+        self.assertEqual([], outcome.err_lines)
+
+        # A new database should import the existing results
+        os.remove(os.path.join(base_dir, '.bm-results.db'))
+        build = builder.Builder(self.toolchains, base_dir, None, 1, 2,
+                                checkout=False, show_unknown=False,
+                                result_db=True)
+        build.commits = self.commits
+        build.commit_count = len(self.commits)
+        outcome = build.GetBuildOutcome(2, 'board2', False, False, False)
+        self.assertEqual([], outcome.err_lines)
+        self.assertEqual(builder.OUTCOME_ERROR, outcome.rc)
+        shutil.rmtree(base_dir)
+
+    def testArchive(self):
+        """Test storing build output files in a compressed archive"""
+        global base_dir
+
+        base_dir = tempfile.mkdtemp()
+        arch = archive.Archive(base_dir)
+        build_dir = os.path.join(base_dir, 'build')
+        os.mkdir(build_dir)
+        fred = arch.StoreData('fred' * 100)
+        self.assertEqual(fred, arch.StoreData('fred' * 100))
+        self.assertEqual(400, fred[1])
+        objects = []
+        for dirpath, dirnames, fnames in os.walk(os.path.join(base_dir,
+                                                 archive.OBJECTS_DIR)):
+            objects += fnames
+        self.assertEqual(1, len(objects))
+        arch.WriteManifest(build_dir, {'u-boot.sizes': fred,
+                                       'log': arch.StoreData('')})
+        with open(os.path.join(build_dir, 'spl-u-boot-spl.sizes'), 'w') as fd:
+            fd.write('mary')
+
+        # Archived files are found first, then plain files
+        fname = os.path.join(build_dir, 'u-boot.sizes')
+        self.assertEqual('fred' * 100, arch.Open(fname).read())
+        self.assertEqual('mary', arch.Open(os.path.join(build_dir,
+                                           'spl-u-boot-spl.sizes')).read())
+        self.assertEqual(None, arch.Open(os.path.join(build_dir, 'missing')))
+        self.assertEqual([os.path.join(build_dir, 'spl-u-boot-spl.sizes'),
+                          os.path.join(build_dir, 'u-boot.sizes')],
+                         arch.Glob(os.path.join(build_dir, '*.sizes')))
+        out_dir = os.path.join(base_dir, 'out')
+        os.mkdir(out_dir)
+        self.assertEqual(['log', 'u-boot.sizes'],
+                         arch.Extract(build_dir, out_dir))
+        with open(os.path.join(out_dir, 'u-boot.sizes')) as fd:
+            self.assertEqual('fred' * 100, fd.read())
+
+        # The manifest is only parsed again when it changes, so replacing it
+        # with a file of the same size and time goes unnoticed
+        manifest = os.path.join(build_dir, archive.MANIFEST_FNAME)
+        os.utime(manifest, (1000, 1000))
+        arch.ReadManifest(build_dir)
+        with open(manifest, 'r+') as fd:
+            fd.write('x' * os.path.getsize(manifest))
+        os.utime(manifest, (1000, 1000))
+        self.assertEqual('fred' * 100, arch.Open(fname).read())
+        arch.WriteManifest(build_dir, {'u-boot.sizes': fred})
+        self.assertEqual(['u-boot.sizes'], arch.ReadManifest(build_dir).keys())
+        arch.RemoveManifest(build_dir)
+        self.assertEqual({}, arch.ReadManifest(build_dir))
+        shutil.rmtree(base_dir)
+
+        # A summary of archived builds should match one of plain builds
+        base_dir = tempfile.mkdtemp()
+        build = builder.Builder(self.toolchains, base_dir, None, 1, 2,
+                                checkout=False, show_unknown=False)
+        build.do_make = self.Make
+        board_selected = self.boards.GetSelectedDict()
+        build.BuildBoards(self.commits, board_selected, keep_outputs=False,
+                          verbose=False)
+        terminal.GetPrintTestLines()
+        plain_lines = self._GetSummaryLines(build, board_selected)
+        self.assertTrue(os.path.exists(os.path.join(
+                build.GetBuildDir(2, 'board2'), 'log')))
+
+        build = builder.Builder(self.toolchains, base_dir, None, 1, 2,
+                                checkout=False, show_unknown=False)
+        build.do_make = self.Make
+        build.archive_outputs = True
+        build.force_build = True
+        build.BuildBoards(self.commits, board_selected, keep_outputs=False,
+                          verbose=False)
+        terminal.GetPrintTestLines()
+        build_dir = build.GetBuildDir(2, 'board2')
+        self.assertFalse(os.path.exists(os.path.join(build_dir, 'log')))
+        self.assertIn('log', build.archive.ReadManifest(build_dir))
+        self.assertEqual(plain_lines,
+                         self._GetSummaryLines(build, board_selected))
+        shutil.rmtree(base_dir)
+
+    def testParallelSummary(self):
+        """Test reading build outcomes in parallel for a summary"""
+        global base_dir
+
+        base_dir = tempfile.mkdtemp()
+        build = builder.Builder(self.toolchains, base_dir, None, 1, 2,
+                                checkout=False, show_unknown=False)
+        build.do_make = self.Make
+        board_selected = self.boards.GetSelectedDict()
+        build.BuildBoards(self.commits, board_selected, keep_outputs=False,
+                          verbose=False)
+        terminal.GetPrintTestLines()
+        serial_build = builder.Builder(self.toolchains, base_dir, None, 1, 2,
+                                       checkout=False, show_unknown=False)
+        serial_lines = self._GetSummaryLines(serial_build, board_selected)
+
+        old_min = builder.MIN_PARALLEL_OUTCOMES
+        builder.MIN_PARALLEL_OUTCOMES = 1
+        try:
+            build = builder.Builder(self.toolchains, base_dir, None, 4, 2,
+                                    checkout=False, show_unknown=False)
+            build.SetDisplayOptions()
+            build.commits = self.commits
+            build.commit_count = len(self.commits)
+            build._ReadOutcomes(range(len(self.commits)), board_selected)
+        finally:
+            builder.MIN_PARALLEL_OUTCOMES = old_min
+        self.assertEqual(len(self.commits) * len(board_selected),
+                         len(build._outcomes))
+        self.assertEqual(serial_lines,
+                         self._GetSummaryLines(build, board_selected))
+
+        # A changed build should be read again
+        outcome = build.GetBuildOutcome(2, 'board2', False, False, False)
+        self.assertEqual(builder.OUTCOME_ERROR, outcome.rc)
+        self.assertTrue(outcome.err_lines)
+        os.remove(build.GetErrFile(2, 'board2'))
+        outcome = build.GetBuildOutcome(2, 'board2', False, False, False)
+        self.assertEqual([], outcome.err_lines)
+        shutil.rmtree(base_dir)
+
+    def testLineTable(self):
+        """Test interning of error lines and sets of boards"""
+        table = linetable.LineTable()
+        self.assertEqual(0, table.Intern('fred\n'))
+        self.assertEqual(1, table.Intern('mary'))
+        self.assertEqual(0, table.Intern('fred  '))
+        self.assertEqual('fred', table.GetLine(0))
+
+        bits = linetable.BoardBits()
+        mask = bits.Get('board2') | bits.Get('board0') | bits.Get('board1')
+        self.assertEqual(4, bits.Get('board1'))
+        self.assertEqual(['board2', 'board0', 'board1'], bits.GetTargets(mask))
+        self.assertEqual(['board2', 'board1'], bits.GetTargets(mask & ~2))
+        self.assertEqual([], bits.GetTargets(0))
+
+        # The summary should list the boards with each line
+        global base_dir
+
+        base_dir = tempfile.mkdtemp()
+        build = builder.Builder(self.toolchains, base_dir, None, 1, 2,
+                                checkout=False, show_unknown=False)
+        build.do_make = self.Make
+        board_selected = self.boards.GetSelectedDict()
+        build.BuildBoards(self.commits, board_selected, keep_outputs=False,
+                          verbose=False)
+        terminal.GetPrintTestLines()
+        build.SetDisplayOptions(show_errors=True, list_error_boards=True)
+        build.ShowSummary(self.commits, board_selected)
+        lines = [line.text for line in terminal.GetPrintTestLines()]
+        warn = [line for line in lines if line.startswith('w+(')][0]
+        line = warn.split('\n')[0]
+        targets = line.split('(')[1].split(')')[0].split(',')
+        self.assertEqual(['board1', 'board2', 'board3', 'board4'],
+                         sorted(targets))
+        self.assertEqual(errors[0].split('\n')[0], line.split(') ', 1)[1])
+        shutil.rmtree(base_dir)
+
     def _testGit(self):
         """Test basic builder operation by building a branch"""
         base_dir = tempfile.mkdtemp()
@@ -366,6 +583,34 @@ class TestBuild(unittest.TestCase):
         self.assertEqual(self.boards.SelectBoards(['sandbox sandbox',
                                                    'sandbox']),
                          {'all': ['board4'], 'sandbox': ['board4']})
+
+    def testBoardIndex(self):
+        """Test that indexed board selection matches checking each board"""
+        self.assertEqual(self.boards.SelectBoards(['board', 'arm'],
+                                                  ['board3']),
+                         {'all': ['board0', 'board1', 'board2', 'board4'],
+                          'board': ['board0', 'board1', 'board2', 'board4'],
+                          'arm': []})
+        for args, exclude in [(['arm Tester'], []),
+                              (['Test', 'p.*c'], ['board4']),
+                              (['ARM', 'sandbox&board'], []),
+                              (['A&B', '.*'], ['board[01]']),
+                              (['Tester&arm&board1'], ['Tester'])]:
+            # Work out the expected result the slow way
+            terms = self.boards._BuildTerms(args)
+            exclude_list = [board.Expr(expr) for expr in exclude]
+            expected = {'all': []}
+            for term in terms:
+                expected[str(term)] = []
+            for brd in self.boards.GetList():
+                match = [term for term in terms if term.Matches(brd.props)]
+                if match and not [expr for expr in exclude_list
+                                  if expr.Matches(brd.props)]:
+                    expected[str(match[0])].append(brd.target)
+                    expected['all'].append(brd.target)
+            self.assertEqual(expected,
+                             self.boards.SelectBoards(args, exclude))
+
     def CheckDirs(self, build, dirname):
         self.assertEqual('base%s' % dirname, build._GetOutputDir(1))
         self.assertEqual('base%s/fred' % dirname,
@@ -425,6 +670,317 @@ class TestBuild(unittest.TestCase):
             self.assertEqual('https://www.kernel.org/pub/tools/crosstool/files/bin/x86_64/4.9.0/x86_64-gcc-4.9.0-nolibc_arm-unknown-linux-gnueabi.tar.xz',
                 self.toolchains.LocateArchUrl('arm'))
 
+    def testToolchainCache(self):
+        """Test that toolchain test results are kept between runs"""
+        tmpdir = tempfile.mkdtemp(prefix='buildman')
+        try:
+            gcc = os.path.join(tmpdir, 'arm-linux-gcc')
+            log = os.path.join(tmpdir, 'log')
+            def _WriteGcc(rc, fname=gcc):
+                with open(fname, 'w') as fd:
+                    fd.write('#!/bin/sh\necho run >>%s\nexit %d\n' % (log, rc))
+                os.chmod(fname, 0755)
+            def _GetRuns():
+                if not os.path.exists(log):
+                    return 0
+                with open(log) as fd:
+                    return len(fd.readlines())
+
+            cache_fname = os.path.join(tmpdir, 'cache')
+            _WriteGcc(0)
+            for runs in [1, 1]:
+                tcs = toolchain.Toolchains(cache_fname)
+                tcs.paths = [tmpdir]
+                tcs.Scan(False)
+                self.assertEqual(gcc, os.path.normpath(tcs.Select('arm').gcc))
+                self.assertEqual(runs, _GetRuns())
+            self.assertTrue(os.path.exists(cache_fname))
+
+            # A changed toolchain is tested again when selected. If it fails,
+            # the next toolchain for that arch is used, as it would be without
+            # the cache
+            gcc2 = os.path.join(tmpdir, 'arm-none-eabi-gcc')
+            _WriteGcc(0, gcc2)
+            tcs = toolchain.Toolchains(cache_fname)
+            tcs.paths = [tmpdir]
+            tcs.Scan(False)
+            self.assertEqual(2, _GetRuns())
+            self.assertEqual(gcc, os.path.normpath(tcs.Select('arm').gcc))
+            _WriteGcc(10)
+            tcs = toolchain.Toolchains(cache_fname)
+            tcs.paths = [tmpdir]
+            tcs.Scan(False)
+            self.assertEqual(2, _GetRuns())
+            with test_util.capture_sys_output() as (stdout, stderr):
+                selected = tcs.Select('arm')
+            self.assertEqual(gcc2, os.path.normpath(selected.gcc))
+            self.assertIn('no longer works', stdout.getvalue())
+            self.assertEqual(3, _GetRuns())
+
+            # The failure is cached too, so it is not added
+            tcs = toolchain.Toolchains(cache_fname)
+            tcs.paths = [tmpdir]
+            tcs.Scan(False)
+            self.assertEqual(3, _GetRuns())
+            self.assertEqual(gcc2, os.path.normpath(tcs.Select('arm').gcc))
+
+            # With no other toolchain, the arch has none
+            _WriteGcc(10, gcc2)
+            tcs = toolchain.Toolchains(cache_fname)
+            tcs.paths = [tmpdir]
+            tcs.Scan(False)
+            with test_util.capture_sys_output() as (stdout, stderr):
+                with self.assertRaises(ValueError) as e:
+                    tcs.Select('arm')
+            self.assertIn("No tool chain found for arch 'arm'",
+                          str(e.exception))
+            self.assertEqual(4, _GetRuns())
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testElfReader(self):
+        """Test that reading an ELF file gives the same result as binutils"""
+        tmpdir = tempfile.mkdtemp(prefix='buildman')
+        try:
+            src = os.path.join(tmpdir, 'test.c')
+            with open(src, 'w') as fd:
+                fd.write('const char env[] = "bootcmd=boot";\n'
+                         'int data[20] = { 1 };\n'
+                         'int func(int x) { return x * data[x]; }\n'
+                         'int main(void) { return func(2); }\n')
+            elf_fname = os.path.join(tmpdir, 'test')
+            result = command.RunPipe([['cc', '-o', elf_fname, src]],
+                    capture=True, capture_stderr=True, raise_on_error=False)
+            if result.return_code:
+                self.skipTest('No host compiler available')
+            elf = elfreader.ElfFile(elf_fname)
+            try:
+                stdout = command.Output('nm', '--size-sort', elf_fname)
+                self.assertEqual(stdout, elf.GetFuncSizes())
+                stdout = command.Output('size', elf_fname)
+                size_line, rodata = elf.GetSizes()
+                self.assertEqual(stdout.splitlines()[1], size_line)
+                self.assertTrue(rodata > 0)
+                stdout = command.Output('objdump', '-h', elf_fname)
+                self.assertIn('.dynstr', stdout)
+                self.assertEqual(stdout, elf.GetSectionHeaders())
+                self.assertEqual(None, elf.GetSectionData('.missing'))
+            finally:
+                elf.Close()
+            self.assertRaises(ValueError, elfreader.ElfFile, src)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testJobserver(self):
+        """Test that make takes its jobs from the jobserver"""
+        tmpdir = tempfile.mkdtemp(prefix='buildman')
+        try:
+            with open(os.path.join(tmpdir, 'Makefile'), 'w') as fd:
+                fd.write('all: a b c d\n'
+                         'a b c d:\n'
+                         '\t@echo $@ >>log\n')
+            js = jobserver.JobServer(2, (4, 1))
+            env = dict(os.environ)
+            js.AddToEnvironment(env)
+            self.assertIn('--jobserver-fds=', env['MAKEFLAGS'])
+            js.Acquire()
+            result = command.RunPipe([['make', '-s']], capture=True,
+                    capture_stderr=True, cwd=tmpdir, raise_on_error=False,
+                    env=env)
+            js.Release()
+            self.assertEqual(0, result.return_code)
+            self.assertNotIn('jobserver unavailable', result.stderr)
+            with open(os.path.join(tmpdir, 'log')) as fd:
+                self.assertEqual(['a', 'b', 'c', 'd'],
+                                 sorted(fd.read().split()))
+
+            # Both tokens should be available again
+            js.Acquire()
+            js.Acquire()
+            js.Close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+        js = jobserver.JobServer(1, (4, 2))
+        self.assertIn('--jobserver-auth=', js.GetMakeFlags())
+        js.Close()
+
+    def testTmpfs(self):
+        """Test keeping output directories within the tmpfs budget"""
+        tmpdir = tempfile.mkdtemp(prefix='buildman')
+        try:
+            mem = tmpfs.Tmpfs(tmpdir, 16384)
+            out_dir = mem.GetOutDir(0)
+            self.assertTrue(out_dir.startswith(tmpdir))
+            with open(os.path.join(out_dir, 'small'), 'w') as fd:
+                fd.write('x')
+            self.assertFalse(mem.Update(0, out_dir))
+
+            # Going over the budget should stop other threads using it
+            with open(os.path.join(out_dir, 'big'), 'w') as fd:
+                fd.write('x' * 16384)
+            self.assertTrue(mem.Update(0, out_dir))
+            self.assertEqual(None, mem.GetOutDir(1))
+
+            # Moving the directory to disk frees the space
+            disk_dir = os.path.join(tmpdir, 'disk')
+            mem.Spill(0, out_dir, disk_dir)
+            self.assertFalse(os.path.exists(out_dir))
+            self.assertTrue(os.path.exists(os.path.join(disk_dir, 'big')))
+            out_dir = mem.GetOutDir(1)
+            self.assertTrue(os.path.isdir(out_dir))
+            mem.Release(1, out_dir)
+            self.assertFalse(os.path.exists(out_dir))
+            mem.Close()
+            self.assertEqual(['disk'], os.listdir(tmpdir))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testResourceMonitor(self):
+        """Test adjusting the number of threads to suit the machine"""
+        tmpdir = tempfile.mkdtemp()
+        log_fname = os.path.join(tmpdir, 'log')
+        mon = monitor.ResourceMonitor(4, 4, log_fname, interval=1000)
+        mon.Start()
+
+        # Quiet machine: nothing to change
+        self.assertEqual(4, mon.Update(1.0, 0.5, 0.0))
+        self.assertEqual(None, mon.GetSummary())
+
+        # High load, then high I/O wait, drop one thread each time
+        self.assertEqual(3, mon.Update(8.0, 0.5, 0.0))
+        self.assertEqual(2, mon.Update(4.0, 0.5, 0.5))
+
+        # Short of memory, halve the threads but keep at least one
+        self.assertEqual(1, mon.Update(4.0, 0.05, None))
+        self.assertEqual(1, mon.Update(4.0, 0.05, None))
+
+        # Quiet again, allow more threads up to the maximum
+        for allowed in [2, 3, 4, 4]:
+            self.assertEqual(allowed, mon.Update(1.0, None, 0.0))
+        mon.Stop()
+        self.assertEqual('Thread count adjusted 6 times to suit the machine '
+                         '(down to 1 of 4)', mon.GetSummary())
+        with open(log_fname) as fd:
+            lines = fd.read().splitlines()
+        self.assertEqual(7, len(lines))
+        self.assertIn('Starting with 4 threads', lines[0])
+        self.assertIn('Threads 4 -> 3: load average 8.0', lines[1])
+        self.assertIn('Threads 3 -> 2: 50% I/O wait', lines[2])
+        self.assertIn('Threads 2 -> 1: only 5% of memory available', lines[3])
+
+        # Only the allowed number of threads can run jobs at once
+        mon.Update(4.0, 0.05, None)
+        mon.Update(4.0, 0.05, None)
+        self.assertEqual(1, mon.allowed)
+        mon.Acquire()
+        started = threading.Event()
+        def _Run():
+            mon.Acquire()
+            started.set()
+            mon.Release()
+        thread = threading.Thread(target=_Run)
+        thread.setDaemon(True)
+        thread.start()
+        self.assertFalse(started.wait(0.1))
+        mon.Release()
+        self.assertTrue(started.wait(5))
+        shutil.rmtree(tmpdir)
+
+    def testEventEncoding(self):
+        """Test writing an event with text which is not valid UTF-8"""
+        tmpdir = tempfile.mkdtemp(prefix='buildman.')
+        fname = os.path.join(tmpdir, 'events')
+        stream = events.EventStream(fname)
+        stream.Write('result', subject='Fix caf\xe9 board', sizes={'u-boot': 1})
+        stream.Write('end', ok=1)
+        stream.Close()
+        with open(fname) as fd:
+            lines = [json.loads(line) for line in fd]
+        self.assertEqual(u'Fix caf\ufffd board', lines[0]['subject'])
+        self.assertEqual({'u-boot': 1}, lines[0]['sizes'])
+        self.assertEqual('end', lines[1]['type'])
+        shutil.rmtree(tmpdir)
+
+    def testAffected(self):
+        """Test working out which boards are affected by changed files"""
+        files = {
+            'Makefile': 'libs-y += drivers/\nlibs-$(CONFIG_API) += api/\n',
+            'drivers/Makefile': 'obj-$(CONFIG_$(SPL_)FRED) += fred/\n'
+                                'obj-y += misc/\n',
+            'drivers/misc/Makefile': 'obj-$(CONFIG_MISC_A) += a.o \\\n'
+                                     '\tc.o\n'
+                                     'ifdef CONFIG_SPL_BUILD\n'
+                                     'obj-$(CONFIG_MISC_B) += b.o\n'
+                                     'endif\n',
+            'include/configs/board0.h': '#include "board0_common.h"\n',
+            'include/configs/board0_common.h':
+                '#ifndef __BOARD0_COMMON_H\n'
+                '# include <configs/soc_common.h>\n'
+                '#include <linux/sizes.h>\n'
+                '#endif\n',
+            'include/configs/soc_common.h': '#include "board0.h"\n',
+            'board/acme/board0/Makefile': 'obj-y += ../board2/board2.o\n'
+                '\tobj-y += ../../other/board3/init.o\n',
+        }
+        def _HandleCommand(pipe_list):
+            cmd = pipe_list[0]
+            if cmd[3] == 'show':
+                fname = cmd[4].split(':', 1)[1]
+                if fname in files:
+                    return command.CommandResult(stdout=files[fname])
+            return command.CommandResult(return_code=128)
+
+        brd = board.Board('Active', 'arm', 'armv7', '', 'acme', 'board0',
+                          'board0_rev1', '')
+        config = {'CONFIG_SYS_CONFIG_NAME': '"board0"',
+                  'CONFIG_SPL_FRED': 'y'}
+        checker = affected.AffectedChecker('.git')
+        command.test_result = _HandleCommand
+        try:
+            def _Check(fname):
+                return checker.IsAffected(brd, config, 'abcd', [fname])
+            self.assertFalse(_Check('doc/README.fred'))
+            self.assertFalse(_Check('arch/x86/lib/fred.c'))
+            self.assertTrue(_Check('arch/arm/lib/fred.c'))
+            self.assertTrue(_Check('board/acme/board0/board0.c'))
+            self.assertTrue(_Check('board/acme/common/fred.c'))
+            self.assertFalse(_Check('board/acme/board1/board1.c'))
+            self.assertFalse(_Check('board/other/board0/board0.c'))
+            self.assertFalse(_Check('board/acme/board0/MAINTAINERS'))
+
+            # Directories which the board's Makefile builds objects from
+            self.assertTrue(_Check('board/acme/board2/board2.c'))
+            self.assertTrue(_Check('board/acme/board2/pinmux.h'))
+            self.assertTrue(_Check('board/other/board3/init.c'))
+            self.assertFalse(_Check('board/other/board4/init.c'))
+            self.assertTrue(_Check('configs/board0_rev1_defconfig'))
+            self.assertFalse(_Check('configs/board1_defconfig'))
+            self.assertTrue(_Check('include/configs/board0.h'))
+            self.assertFalse(_Check('include/configs/board1.h'))
+
+            # Shared headers included by the board's header affect it
+            self.assertTrue(_Check('include/configs/board0_common.h'))
+            self.assertTrue(_Check('include/configs/soc_common.h'))
+            self.assertFalse(_Check('include/configs/sizes.h'))
+            self.assertTrue(_Check('include/fred.h'))
+
+            # Makefile analysis
+            self.assertTrue(_Check('drivers/fred/fred.c'))
+            self.assertFalse(_Check('drivers/misc/a.c'))
+            self.assertFalse(_Check('drivers/misc/c.c'))
+            self.assertTrue(_Check('drivers/misc/b.c'))
+            self.assertTrue(_Check('drivers/misc/d.c'))
+            self.assertFalse(_Check('api/api.c'))
+            config['CONFIG_MISC_A'] = 'y'
+            self.assertTrue(_Check('drivers/misc/c.c'))
+            del config['CONFIG_SPL_FRED']
+            self.assertFalse(_Check('drivers/fred/fred.c'))
+            self.assertTrue(checker.IsAffected(brd, config, 'abcd',
+                    ['drivers/fred/fred.c', 'include/fred.h']))
+        finally:
+            command.test_result = None
+
 
 if __name__ == "__main__":
     unittest.main()
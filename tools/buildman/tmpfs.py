@@ -0,0 +1,162 @@
+# SPDX-License-Identifier: GPL-2.0+
+# Copyright (c) 2019 Google, Inc
+#
+
+"""Placing build output directories in memory
+
+Builds write a lot of object files which are never looked at again: only the
+files selected by BuilderThread.CopyFiles() are kept in the output directory.
+On a slow disk (or an NFS home directory) writing these files can be the main
+cost of the build. This module lets each thread use an output directory on a
+memory-backed filesystem such as tmpfs instead.
+
+Memory is limited, so the total size of the output directories is kept within
+a budget. A thread which finds that the budget is used up moves its output
+directory back to disk and continues there. Each thread's output directory is
+removed when it finishes building a board.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+
+# Part of the free space on the filesystem to use, if no budget is given
+DEFAULT_BUDGET_FRACTION = 0.5
+
+# Always leave at least this part of the filesystem free
+MIN_FREE_FRACTION = 0.1
+
+class Tmpfs:
+    """Manages output directories on a memory-backed filesystem
+
+    Public members:
+        budget: Maximum total size of the output directories, in bytes
+
+    Private members:
+        _base_dir: Directory holding the output directory for each thread
+        _lock: Lock used to serialise access from builder threads
+        _usage: Dict of the size of each thread's output directory in bytes,
+            keyed by thread number
+    """
+    def __init__(self, dirname, budget=None):
+        """Set up output directories within a directory
+
+        Args:
+            dirname: Directory on a memory-backed filesystem (e.g. /dev/shm)
+            budget: Maximum total size of the output directories in bytes,
+                or None to use part of the free space
+        """
+        self._base_dir = tempfile.mkdtemp(prefix='buildman.', dir=dirname)
+        self._lock = threading.Lock()
+        self._usage = {}
+        if budget is None:
+            budget = int(_GetFreeSpace(dirname) * DEFAULT_BUDGET_FRACTION)
+        self.budget = budget
+
+    def GetOutDir(self, thread_num):
+        """Get an output directory for a thread
+
+        Args:
+            thread_num: Thread number (0, 1, ...)
+
+        Returns:
+            Path to the output directory, or None if the budget is used up so
+            the thread should build on disk
+        """
+        with self._lock:
+            if self._IsFull():
+                return None
+            self._usage[thread_num] = 0
+        out_dir = os.path.join(self._base_dir, '%02d' % thread_num)
+        if not os.path.exists(out_dir):
+            os.mkdir(out_dir)
+        return out_dir
+
+    def Update(self, thread_num, out_dir):
+        """Record the size of a thread's output directory after a build
+
+        Args:
+            thread_num: Thread number (0, 1, ...)
+            out_dir: Output directory, as returned by GetOutDir()
+
+        Returns:
+            True if the budget is used up, so the thread should move its
+            output directory to disk
+        """
+        size = _GetDirSize(out_dir)
+        with self._lock:
+            self._usage[thread_num] = size
+            return self._IsFull()
+
+    def Spill(self, thread_num, out_dir, disk_dir):
+        """Move a thread's output directory to disk
+
+        Args:
+            thread_num: Thread number (0, 1, ...)
+            out_dir: Output directory, as returned by GetOutDir()
+            disk_dir: Directory on disk to move it to. Any existing directory
+                is removed first
+        """
+        if os.path.exists(disk_dir):
+            shutil.rmtree(disk_dir)
+        shutil.move(out_dir, disk_dir)
+        with self._lock:
+            self._usage.pop(thread_num, None)
+
+    def Release(self, thread_num, out_dir):
+        """Remove a thread's output directory when it is no longer needed
+
+        Args:
+            thread_num: Thread number (0, 1, ...)
+            out_dir: Output directory, as returned by GetOutDir()
+        """
+        shutil.rmtree(out_dir, ignore_errors=True)
+        with self._lock:
+            self._usage.pop(thread_num, None)
+
+    def Close(self):
+        """Remove all output directories"""
+        shutil.rmtree(self._base_dir, ignore_errors=True)
+
+    def _IsFull(self):
+        """Check whether the budget or the filesystem is full
+
+        Returns:
+            True if there is no room for more output
+        """
+        if sum(self._usage.values()) >= self.budget:
+            return True
+        stat = os.statvfs(self._base_dir)
+        return stat.f_bavail < stat.f_blocks * MIN_FREE_FRACTION
+
+
+def _GetFreeSpace(dirname):
+    """Get the free space on the filesystem holding a directory
+
+    Args:
+        dirname: Directory to check
+
+    Returns:
+        Free space in bytes
+    """
+    stat = os.statvfs(dirname)
+    return stat.f_bavail * stat.f_frsize
+
+def _GetDirSize(dirname):
+    """Get the space used by the files in a directory
+
+    Args:
+        dirname: Directory to check
+
+    Returns:
+        Space used in bytes, including subdirectories
+    """
+    size = 0
+    for dirpath, dirnames, fnames in os.walk(dirname):
+        for fname in fnames:
+            try:
+                size += os.lstat(os.path.join(dirpath, fname)).st_blocks * 512
+            except OSError:
+                pass
+    return size
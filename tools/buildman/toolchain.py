@@ -5,9 +5,11 @@
 import re
 import glob
 from HTMLParser import HTMLParser
+import json
 import os
 import sys
 import tempfile
+import threading
 import urllib2
 
 import bsettings
@@ -17,6 +19,9 @@ import terminal
 (PRIORITY_FULL_PREFIX, PRIORITY_PREFIX_GCC, PRIORITY_PREFIX_GCC_PATH,
     PRIORITY_CALC) = range(4)
 
+# File recording which toolchains work, so they need not be run each time
+CACHE_FNAME = '~/.buildman-toolchain-cache'
+
 # Simple class to collect links from a page
 class MyHTMLParser(HTMLParser):
     def __init__(self, arch):
@@ -139,7 +144,7 @@ class Toolchain:
 
         return value
 
-    def MakeEnvironment(self, full_path):
+    def MakeEnvironment(self, full_path, compiler_cache=None, base_dir=None):
         """Returns an environment for using the toolchain.
 
         Thie takes the current environment and adds CROSS_COMPILE so that
@@ -150,9 +155,20 @@ class Toolchain:
         Args:
             full_path: Return the full path in CROSS_COMPILE and don't set
                 PATH
+            compiler_cache: CompilerCache object to use as the wrapper for
+                the toolchain, or None to use the wrapper from the settings
+                file (if any)
+            base_dir: Directory containing the source and output directories
+                of the build, used to share the compiler cache between
+                directories (None if none)
         """
         env = dict(os.environ)
-        wrapper = self.GetWrapper()
+        if compiler_cache:
+            wrapper = compiler_cache.GetWrapper()
+            if base_dir:
+                compiler_cache.AddToEnvironment(env, base_dir)
+        else:
+            wrapper = self.GetWrapper()
 
         if full_path:
             env['CROSS_COMPILE'] = wrapper + os.path.join(self.path, self.cross)
@@ -178,13 +194,152 @@ class Toolchains:
             something on the search path, for example
             {'arm', 'arm-linux-gnueabihf-'}. Wildcards are not supported.
         paths: List of paths to check for toolchains (may contain wildcards)
+
+    Private members:
+        _cache: Dict of toolchain test results, keyed by the filename of
+            the toolchain's gcc driver. Each value is a dict:
+                mtime: Modification time of the file when tested
+                size: Size of the file when tested
+                ok: True if the toolchain worked
+        _cache_changed: True if _cache needs to be written out
+        _cache_fname: File to hold _cache, or None to test every toolchain
+        _candidates: Dict of lists of the working toolchains found for each
+            architecture, in the order they were added, keyed by
+            architecture name. This is used to select another toolchain if
+            the selected one is found not to work
+        _lock: Lock used to serialise access from builder threads
+        _unchecked: Set of filenames of toolchains whose test results were
+            taken from the cache without checking that the file is unchanged
     """
 
-    def __init__(self):
+    def __init__(self, cache_fname=None):
+        """Create a new list of toolchains
+
+        Args:
+            cache_fname: File to use to keep toolchain test results between
+                runs, or None to test every toolchain found
+        """
         self.toolchains = {}
         self.prefixes = {}
         self.paths = []
         self._make_flags = dict(bsettings.GetItems('make-flags'))
+        self._cache_fname = cache_fname
+        self._cache = {}
+        self._cache_changed = False
+        self._candidates = {}
+        self._lock = threading.Lock()
+        self._unchecked = set()
+        if cache_fname:
+            self._ReadCache()
+
+    def _ReadCache(self):
+        """Read the toolchain test results from the cache file"""
+        try:
+            with open(os.path.expanduser(self._cache_fname)) as fd:
+                self._cache = json.load(fd)
+        except (IOError, ValueError):
+            self._cache = {}
+        if not isinstance(self._cache, dict):
+            self._cache = {}
+
+    def _WriteCache(self):
+        """Write the toolchain test results to the cache file, if changed"""
+        if not self._cache_fname or not self._cache_changed:
+            return
+        fname = os.path.expanduser(self._cache_fname)
+        tmp_fname = '%s.%d' % (fname, os.getpid())
+        try:
+            with open(tmp_fname, 'w') as fd:
+                json.dump(self._cache, fd, indent=1, sort_keys=True)
+            os.rename(tmp_fname, fname)
+            self._cache_changed = False
+        except (IOError, OSError) as err:
+            print 'Warning: Cannot write toolchain cache %s: %s' % (fname, err)
+
+    def _GetCachedResult(self, fname):
+        """Get the cached test result for a toolchain
+
+        Working toolchains are assumed to be unchanged, so that the file need
+        not be checked unless the toolchain is used (see Select()). Others are
+        only taken from the cache if the file is unchanged, since it is cheap
+        to check.
+
+        Args:
+            fname: Filename of toolchain's gcc driver
+
+        Returns:
+            True if the toolchain worked, False if it did not, None if there is
+            no usable cached result
+        """
+        entry = self._cache.get(fname)
+        if not entry:
+            return None
+        if entry['ok']:
+            self._unchecked.add(fname)
+            return True
+        if _GetFileStamp(fname) == [entry['mtime'], entry['size']]:
+            return False
+        return None
+
+    def _SetCachedResult(self, fname, ok):
+        """Record the test result for a toolchain in the cache
+
+        Args:
+            fname: Filename of toolchain's gcc driver
+            ok: True if the toolchain worked
+        """
+        if not self._cache_fname:
+            return
+        stamp = _GetFileStamp(fname)
+        if stamp:
+            self._cache[fname] = {'mtime': stamp[0], 'size': stamp[1],
+                                  'ok': ok}
+        else:
+            self._cache.pop(fname, None)
+        self._cache_changed = True
+
+    def _CheckCachedResult(self, toolchain):
+        """Check that a toolchain taken from the cache still works
+
+        If the toolchain's file has changed since it was tested, it is tested
+        again. If it no longer works, it is dropped and the next best
+        toolchain for its architecture (if any) is selected in its place, as
+        if the toolchain had not been found.
+
+        Args:
+            toolchain: Toolchain object to check
+
+        Returns:
+            True if the toolchain works, False if it was dropped
+        """
+        with self._lock:
+            if toolchain.gcc in self._unchecked:
+                self._unchecked.discard(toolchain.gcc)
+                entry = self._cache[toolchain.gcc]
+                if _GetFileStamp(toolchain.gcc) != [entry['mtime'],
+                                                    entry['size']]:
+                    tested = Toolchain(toolchain.gcc, True,
+                                       priority=toolchain.priority,
+                                       arch=toolchain.arch)
+                    toolchain.ok = tested.ok
+                    self._SetCachedResult(toolchain.gcc, toolchain.ok)
+                    self._WriteCache()
+            if toolchain.ok:
+                return True
+            print ("Warning: Tool chain '%s' no longer works" %
+                   toolchain.gcc)
+            candidates = self._candidates.get(toolchain.arch, [])
+            if toolchain in candidates:
+                candidates.remove(toolchain)
+            best = None
+            for candidate in candidates:
+                if not best or candidate.priority < best.priority:
+                    best = candidate
+            if best:
+                self.toolchains[toolchain.arch] = best
+            else:
+                self.toolchains.pop(toolchain.arch, None)
+            return False
 
     def GetPathList(self, show_warning=True):
         """Get a list of available toolchain paths
@@ -230,11 +385,23 @@ class Toolchains:
 
         Args:
             fname: Filename of toolchain's gcc driver
-            test: True to run the toolchain to test it
+            test: True to run the toolchain to test it, unless the cache has
+                a result for it and verbose is False
             priority: Priority to use for this toolchain
             arch: Toolchain architecture, or None if not known
         """
-        toolchain = Toolchain(fname, test, verbose, priority, arch)
+        cached_ok = None
+        if test and not verbose:
+            cached_ok = self._GetCachedResult(fname)
+        if cached_ok is not None:
+            toolchain = Toolchain(fname, False, verbose, priority, arch)
+            toolchain.ok = cached_ok
+        else:
+            toolchain = Toolchain(fname, test, verbose, priority, arch)
+            if test:
+                self._SetCachedResult(fname, toolchain.ok)
+        if toolchain.ok:
+            self._candidates.setdefault(toolchain.arch, []).append(toolchain)
         add_it = toolchain.ok
         if toolchain.arch in self.toolchains:
             add_it = (toolchain.priority <
@@ -288,6 +455,9 @@ class Toolchains:
         architecture for each, and whether it works. Then we select the
         highest priority toolchain for each arch.
 
+        Test results are taken from the cache, if enabled, unless verbose is
+        True.
+
         Args:
             verbose: True to print out progress information
         """
@@ -312,6 +482,7 @@ class Toolchains:
             fnames = self.ScanPath(path, verbose)
             for fname in fnames:
                 self.Add(fname, True, verbose)
+        self._WriteCache()
 
     def List(self):
         """List out the selected toolchains for each architecture"""
@@ -333,15 +504,24 @@ class Toolchains:
         returns:
             toolchain object, or None if none found
         """
-        for tag, value in bsettings.GetItems('toolchain-alias'):
-            if arch == tag:
-                for alias in value.split():
-                    if alias in self.toolchains:
-                        return self.toolchains[alias]
-
-        if not arch in self.toolchains:
-            raise ValueError, ("No tool chain found for arch '%s'" % arch)
-        return self.toolchains[arch]
+        while True:
+            toolchain = None
+            for tag, value in bsettings.GetItems('toolchain-alias'):
+                if arch == tag:
+                    for alias in value.split():
+                        if alias in self.toolchains:
+                            toolchain = self.toolchains[alias]
+                            break
+                    if toolchain:
+                        break
+
+            if not toolchain:
+                if not arch in self.toolchains:
+                    raise ValueError, ("No tool chain found for arch '%s'" %
+                                       arch)
+                toolchain = self.toolchains[arch]
+            if self._CheckCachedResult(toolchain):
+                return toolchain
 
     def ResolveReferences(self, var_dict, args):
         """Resolve variable references in a string
@@ -573,3 +753,20 @@ class Toolchains:
                    bsettings.config_fname)
             bsettings.SetItem('toolchain', 'download', '%s/*/*' % dest)
         return 0
+
+
+def _GetFileStamp(fname):
+    """Get the modification time and size of a file
+
+    Args:
+        fname: Filename to check
+
+    Returns:
+        List containing modification time and size, or None if the file does
+        not exist
+    """
+    try:
+        stat = os.stat(fname)
+    except OSError:
+        return None
+    return [stat.st_mtime, stat.st_size]
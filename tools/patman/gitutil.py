@@ -225,6 +225,34 @@ def Checkout(commit_hash, git_dir=None, work_tree=None, force=False):
     if result.return_code != 0:
         raise OSError('git checkout (%s): %s' % (pipe, result.stderr))
 
+def FastCheckout(old_hash, new_hash, git_dir=None, work_tree=None):
+    """Move from one commit to another, only writing the files which differ
+
+    Unlike Checkout(), this does not look at files which are the same in both
+    commits, so their modification times are preserved. The index must match
+    the old commit.
+
+    Args:
+        old_hash: Hash of the commit which is currently checked out
+        new_hash: Hash of the commit to check out
+        git_dir: The repository containing the commits
+        work_tree: Working tree to update
+
+    Raises:
+        OSError if the new commit could not be checked out this way
+    """
+    pipe = ['git']
+    if git_dir:
+        pipe.extend(['--git-dir', git_dir])
+    if work_tree:
+        pipe.extend(['--work-tree', work_tree])
+    for args in [['read-tree', '-m', '-u', old_hash, new_hash],
+                 ['update-ref', '--no-deref', 'HEAD', new_hash]]:
+        result = command.RunPipe([pipe + args], capture=True,
+                                 raise_on_error=False, capture_stderr=True)
+        if result.return_code != 0:
+            raise OSError('git %s: %s' % (args[0], result.stderr))
+
 def Clone(git_dir, output_dir):
     """Checkout the selected commit for this build
 
@@ -237,6 +265,116 @@ def Clone(git_dir, output_dir):
     if result.return_code != 0:
         raise OSError('git clone: %s' % result.stderr)
 
+def AddWorktree(git_dir, output_dir, commit_hash=None):
+    """Create and checkout a new git worktree for this build
+
+    The worktree shares the object store of the source repository, so this
+    is much faster than a clone and uses very little extra disk space.
+
+    Args:
+        git_dir: The repository to checkout the worktree from
+        output_dir: Path for the new worktree
+        commit_hash: Commit hash to checkout, or None for HEAD
+    """
+    # We need to pass --detach to avoid creating a new branch
+    pipe = ['git', '--git-dir', git_dir, 'worktree', 'add', '.', '--detach']
+    if commit_hash:
+        pipe.append(commit_hash)
+    result = command.RunPipe([pipe], capture=True, cwd=output_dir,
+                             capture_stderr=True, raise_on_error=False)
+    if result.return_code != 0:
+        raise OSError('git worktree add: %s' % result.stderr)
+
+def PruneWorktrees(git_dir):
+    """Remove administrative files for deleted worktrees
+
+    Args:
+        git_dir: The repository whose stale worktrees should be pruned
+    """
+    pipe = ['git', '--git-dir', git_dir, 'worktree', 'prune']
+    result = command.RunPipe([pipe], capture=True, capture_stderr=True,
+                             raise_on_error=False)
+    if result.return_code != 0:
+        raise OSError('git worktree prune: %s' % result.stderr)
+
+def CheckWorktreeIsAvailable(git_dir):
+    """Check if git-worktree functionality is available
+
+    This needs git 2.5 or later.
+
+    Args:
+        git_dir: The repository to test in
+
+    Returns:
+        True if git-worktree commands will work, False otherwise.
+    """
+    pipe = ['git', '--git-dir', git_dir, 'worktree', 'list']
+    result = command.RunPipe([pipe], capture=True, capture_stderr=True,
+                             raise_on_error=False)
+    return result.return_code == 0
+
+def GetChangedFiles(git_dir, old_hash, new_hash):
+    """Get the list of files changed between two commits
+
+    Args:
+        git_dir: The repository containing the commits
+        old_hash: Hash of the old commit
+        new_hash: Hash of the new commit
+
+    Returns:
+        List of filenames changed (added, removed or modified), relative to
+        the top of the tree
+    """
+    pipe = ['git', '--git-dir', git_dir, 'diff', '--name-only', '--no-renames',
+            old_hash, new_hash]
+    result = command.RunPipe([pipe], capture=True, capture_stderr=True,
+                             raise_on_error=False)
+    if result.return_code != 0:
+        raise OSError('git diff: %s' % result.stderr)
+    return result.stdout.splitlines()
+
+def GetFileContents(git_dir, commit_hash, fname):
+    """Get the contents of a file at a particular commit
+
+    Args:
+        git_dir: The repository containing the commit
+        commit_hash: Hash of the commit
+        fname: Filename, relative to the top of the tree
+
+    Returns:
+        Contents of the file, or None if it does not exist in that commit
+    """
+    pipe = ['git', '--git-dir', git_dir, 'show', '%s:%s' % (commit_hash, fname)]
+    result = command.RunPipe([pipe], capture=True, capture_stderr=True,
+                             raise_on_error=False)
+    if result.return_code != 0:
+        return None
+    return result.stdout
+
+def ListTree(git_dir, commit_hash):
+    """Get the files in the tree of a commit
+
+    Args:
+        git_dir: The repository containing the commit
+        commit_hash: Hash of the commit
+
+    Returns:
+        List of (object hash, filename) tuples, one for each file in the tree
+        (including those in subdirectories), with the filename relative to
+        the top of the tree
+    """
+    pipe = ['git', '--git-dir', git_dir, 'ls-tree', '-r', commit_hash]
+    result = command.RunPipe([pipe], capture=True, capture_stderr=True,
+                             raise_on_error=False)
+    if result.return_code != 0:
+        raise OSError('git ls-tree: %s' % result.stderr)
+    entries = []
+    for line in result.stdout.splitlines():
+        # Each line is '<mode> <type> <hash>\t<filename>'
+        info, fname = line.split('\t', 1)
+        entries.append((info.split()[2], fname))
+    return entries
+
 def Fetch(git_dir=None, work_tree=None):
     """Fetch from the origin repo
 